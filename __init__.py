@@ -1,47 +1,194 @@
+import argparse
+from functools import partial
 import json
-from lib.map import TileMap
-from lib.types import TileDistance
-import os.path
-from typing import Sequence
-from utils import decompress, load_json, load_map, load_ferries, retrieve_or_update_ferries
-from urllib.request import urlretrieve
+from lib.incremental import diff_ferries
+from lib.inverted import BLOCK_SIZE, IndexBuilder, block_minima, save_index
+from lib.isochrones import SHAPES
+from lib.map import SEARCH_ENGINES
+from lib.matrix import save_matrix
+from lib.metrics import METRICS, enable_metrics
+from lib.parallel import parallel_distances, parallel_town_matrix
+from lib.profiles import MIXED, PROFILES
+from lib.routes import PredecessorRaster
+from lib.search import to_tile_distances
+import os
+import shutil
+from utils import FERRIES_DATA, load_costed_map, load_ferries, load_json, retrieve_or_update_ferries, save_nearest_towns, save_town_distances, update_town_distances
 
 # MAP_ARCHIVE = 'map_compressed.gz' # Currently missing some tiles for some reason.
 MAP_ARCHIVE = 'compressed.zip'
-MAP_DIR = 'map'
 TOWN_JSON = 'towns_s2.json'
 FERRIES_JSON = 'ferries.json'
 OUTPUT_DIR = 'distances'
+MAP_CACHE = 'map.cache'
+MATRIX_FILE = 'towns.matrix'
+REACHABILITY_JSON = 'reachability.json'
+INDEX_FILE = 'towns.index'
 
-def save_distances(town_name: str, distances: Sequence[TileDistance]) -> None:
-    # Convert to compressed format
-    compressed = [[d.x, d.y, d.distance] for d in distances]
+def vehicle_range(value: str) -> tuple[str, float]:
+    vehicle, _, cost = value.partition('=')
+    try:
+        return vehicle, float(cost)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected VEHICLE=COST, got {value!r}')
 
-    if not os.path.isdir(OUTPUT_DIR):
-        os.mkdir(OUTPUT_DIR)
+def vehicle_profile(value: str) -> tuple[str, str]:
+    vehicle, _, profile = value.partition('=')
+    if profile not in PROFILES:
+        raise argparse.ArgumentTypeError(f'expected VEHICLE=PROFILE with PROFILE among {", ".join(PROFILES)}, got {value!r}')
+    return vehicle, profile
 
-    file_name = f'{OUTPUT_DIR}/{town_name}.json'
-    with open(file_name, 'w', encoding='utf8') as fp:
-        fp.write(json.dumps(compressed))
-    print(f'Town distances file saved as {file_name}')
+parser = argparse.ArgumentParser(description='Computes the travel distances from every town to the tiles of the map.')
+parser.add_argument('--range', dest='ranges', metavar='VEHICLE=COST', type=vehicle_range, action='append', default=[],
+                    help=f'Only keep the tiles within COST from each town, saved in {OUTPUT_DIR}/VEHICLE. Can be repeated, one per vehicle.')
+parser.add_argument('--profile', dest='profiles', metavar='VEHICLE=PROFILE', type=vehicle_profile, action='append', default=[],
+                    help=f'Moves the vehicle of a --range can make, among {", ".join(PROFILES)} (see lib/profiles.py). Mixed by default.')
+parser.add_argument('--max-tiles', type=int, default=None,
+                    help='Stop each search after reaching this number of tiles.')
+parser.add_argument('--format', dest='output_format', choices=('json', 'raster', 'pyramid'), default='json',
+                    help='Output format: JSON list of [x, y, distance], compact binary raster (see lib/raster.py), or pyramid of raster tiles for web maps, one directory per town (see lib/pyramid.py).')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of worker processes sharing the costed map, each one computing a town at a time.')
+parser.add_argument('--engine', choices=tuple(SEARCH_ENGINES), default='heap',
+                    help='Search engine: binary heap on float costs, or bucket queue on exact fixed-point costs (see lib/dial.py).')
+parser.add_argument('--matrix', action='store_true',
+                    help=f'Only compute the costs between towns, saved as {OUTPUT_DIR}/{MATRIX_FILE} (see lib/matrix.py).')
+parser.add_argument('--reachability', action='store_true',
+                    help=f'Only list the towns reachable from each town, saved as {OUTPUT_DIR}/{REACHABILITY_JSON}. It needs no search.')
+parser.add_argument('--partition', action='store_true',
+                    help=f'Only compute the nearest town of every tile and its cost, in a single search seeded with every town, saved as rasters in {OUTPUT_DIR}.')
+parser.add_argument('--routes', action='store_true',
+                    help='Save the predecessor of each tile next to its distances, to get the route to any tile without searching again (see lib/routes.py).')
+parser.add_argument('--isochrones', dest='shapes', metavar='SHAPE', choices=SHAPES, action='append', default=[],
+                    help=f'Also save the tiles within each --range as {" or ".join(SHAPES)} (see lib/isochrones.py), in {OUTPUT_DIR}/VEHICLE/TOWN.iso.json. Can be repeated.')
+parser.add_argument('--ferries', default=FERRIES_DATA,
+                    help='URL or local file to get the ferries from.')
+parser.add_argument('--update', action='store_true',
+                    help=f'Only repair the distances saved in {OUTPUT_DIR} which are affected by the changes of the ferries since they were computed.')
+parser.add_argument('--index', action='store_true',
+                    help=f'Also index the towns reaching each block of the map within the largest --range, saved as {OUTPUT_DIR}/{INDEX_FILE} (see lib/inverted.py and reaching.py).')
+parser.add_argument('--index-block', type=int, default=BLOCK_SIZE,
+                    help='Side of the blocks of tiles of the index, 1 for exact costs per tile.')
+parser.add_argument('--metrics', metavar='FILE', default=None,
+                    help="Append timings, search counters, memory estimates and progress messages as JSON lines to FILE ('-' for the standard error), see lib/metrics.py.")
+parser.add_argument('--quiet', action='store_true',
+                    help='Do not print the progress messages (they are still written with --metrics).')
+parser.add_argument('--town', dest='selected_towns', metavar='NAME', action='append', default=[],
+                    help='Only compute the distances from this town. Can be repeated.')
 
-# If MAP_DIR doesn't exists yet or is still empty
-if not os.path.isdir(MAP_DIR) or not os.listdir(MAP_DIR):
-    decompress(MAP_ARCHIVE, MAP_DIR)
+# Worker processes import this module too: the batch must only run in the main one
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.update and (args.matrix or args.reachability or args.partition or args.max_tiles is not None):
+        parser.error('--update only applies to distance fields computed without --max-tiles')
+    if args.update and args.output_format == 'pyramid':
+        parser.error('--update does not apply to pyramids, compute them again instead')
+    if args.shapes and (not args.ranges or args.update or args.matrix or args.reachability or args.partition):
+        parser.error('--isochrones only applies to the distance fields computed with --range')
+    if args.index and (args.update or args.matrix or args.reachability or args.partition or args.max_tiles is not None):
+        parser.error('--index only applies to the distance fields computed without --max-tiles')
+    if args.index and any(profile != MIXED.name for _, profile in args.profiles):
+        parser.error('--index only applies to the mixed profile')
+    vehicles = {vehicle for vehicle, _ in args.ranges}
+    if any(vehicle not in vehicles for vehicle, _ in args.profiles):
+        parser.error('--profile only applies to the vehicles of a --range')
+    if any(profile != MIXED.name for _, profile in args.profiles) and (args.workers > 1 or args.matrix or args.reachability or args.partition or args.update):
+        parser.error('--profile only applies to the distance fields computed one town at a time')
+    # One search per town (and profile) is enough for every vehicle: it is run up to the largest range
+    max_cost = max((cost for _, cost in args.ranges), default=None)
+    # Vehicle ranges of each profile: the map is loaded and costed once, then each town is searched once per profile
+    profiles = dict(args.profiles)
+    profile_ranges: dict[str, list[tuple[str, float]]] = {}
+    for vehicle, cost in args.ranges:
+        profile_ranges.setdefault(profiles.get(vehicle, MIXED.name), []).append((vehicle, cost))
+    if args.metrics is not None:
+        enable_metrics(args.metrics)
+    METRICS.verbose = not args.quiet
+    save = partial(save_town_distances, output_dir=OUTPUT_DIR, ranges=args.ranges, output_format=args.output_format, shapes=args.shapes)
+    index = IndexBuilder(args.index_block, max_cost) if args.index else None
+    summarize = partial(block_minima, block_size=args.index_block, max_cost=max_cost) if args.index else None
 
-retrieve_or_update_ferries(FERRIES_JSON)
+    # Ferries the saved distances have been computed with
+    previous_ferries = f'{OUTPUT_DIR}/{FERRIES_JSON}'
+    retrieve_or_update_ferries(FERRIES_JSON, args.ferries)
+    towns = load_json(TOWN_JSON)
+    sources = [(t['name'].lower(), t['location']['x'], t['location']['y']) for t in towns]
+    selected = [name.lower() for name in args.selected_towns] or None
+    unknown = set(selected or ()) - {name for name, _, _ in sources}
+    if unknown:
+        parser.error(f'unknown towns: {", ".join(sorted(unknown))}')
 
-towns = load_json(TOWN_JSON)
-ferries = load_ferries(FERRIES_JSON)
-map = TileMap(load_map(MAP_DIR), ferries=ferries)
-map.compute_costs()
+    map = load_costed_map(MAP_ARCHIVE, FERRIES_JSON, MAP_CACHE)
+    map.use_engine(args.engine)
 
-for t in towns:
-    town_name: str = t['name']
-    print(f'Town: {town_name}')
-    x: int = t['location']['x']
-    y: int = t['location']['y']
+    if args.reachability:
+        reachable = map.reachable_towns([s for s in sources if selected is None or s[0] in selected])
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        with open(f'{OUTPUT_DIR}/{REACHABILITY_JSON}', 'w', encoding='utf8') as fp:
+            fp.write(json.dumps(reachable))
+        METRICS.progress(f'Reachable towns saved as {OUTPUT_DIR}/{REACHABILITY_JSON}')
+    elif args.matrix:
+        if args.workers > 1:
+            matrix = parallel_town_matrix(map, sources, sources=selected, processes=args.workers, max_cost=max_cost)
+        else:
+            matrix = map.town_matrix(sources, sources=selected, max_cost=max_cost)
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        save_matrix(f'{OUTPUT_DIR}/{MATRIX_FILE}', matrix)
+        METRICS.progress(f'Town matrix saved as {OUTPUT_DIR}/{MATRIX_FILE}')
+    elif args.partition:
+        save_nearest_towns(
+            map, [s for s in sources if selected is None or s[0] in selected], OUTPUT_DIR,
+            max_cost=max_cost, output_format='pyramid' if args.output_format == 'pyramid' else 'raster',
+        )
+    elif args.update and os.path.isfile(previous_ferries):
+        added, removed = diff_ferries(map.grid, load_ferries(previous_ferries), load_ferries(FERRIES_JSON))
+        METRICS.progress(f'Ferries: {len(added)} edges added, {len(removed)} edges removed')
+        for town_name, x, y in sources:
+            if selected is None or town_name in selected:
+                METRICS.progress(f'Town: {town_name}')
+                update_town_distances(
+                    map, town_name, x, y, OUTPUT_DIR, added, removed,
+                    ranges=args.ranges, output_format=args.output_format, predecessors=args.routes,
+                )
+    elif args.workers > 1:
+        if selected is not None:
+            sources = [s for s in sources if s[0] in selected]
+        distances = parallel_distances(
+            map, sources, save,
+            processes=args.workers, max_cost=max_cost, max_tiles=args.max_tiles, predecessors=args.routes, summarize=summarize,
+        )
+        for town_name, reached, minima in distances:
+            METRICS.progress(f'Town: {town_name} done, {reached} tiles reached', town=town_name, reached=reached)
+            if index is not None:
+                index.add(town_name, minima)
+    else:
+        for t in towns:
+            town_name: str = t['name']
+            if selected is not None and town_name.lower() not in selected:
+                continue
+            METRICS.progress(f'Town: {town_name}')
+            x: int = t['location']['x']
+            y: int = t['location']['y']
 
-    dist = map.compute_distances(x, y)
+            with METRICS.phase('town', town=town_name.lower()):
+                for profile, ranges in (profile_ranges or {MIXED.name: []}).items():
+                    profile_cost = max((cost for _, cost in ranges), default=None)
+                    if args.routes:
+                        field = map.dijkstra(x, y, max_cost=profile_cost, max_tiles=args.max_tiles, profile=profile, predecessors=True)
+                        origin = (map.grid.width, map.grid.x0, map.grid.y0)
+                        dist = to_tile_distances(field, *origin)
+                        save(town_name.lower(), dist, ranges=ranges, predecessors=PredecessorRaster.from_field(field, *origin))
+                    else:
+                        dist = map.compute_distances(x, y, max_cost=profile_cost, max_tiles=args.max_tiles, profile=profile)
+                        save(town_name.lower(), dist, ranges=ranges)
+                    if index is not None:
+                        index.add(town_name.lower(), summarize(dist))
 
-    save_distances(town_name.lower(), dist)
+    if index is not None:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        save_index(f'{OUTPUT_DIR}/{INDEX_FILE}', index.build())
+        METRICS.progress(f'Reachability index saved as {OUTPUT_DIR}/{INDEX_FILE}')
+
+    # Distances of every town are now up to date with these ferries
+    if not args.matrix and not args.reachability and not args.partition and selected is None and args.max_tiles is None:
+        shutil.copyfile(FERRIES_JSON, previous_ferries)
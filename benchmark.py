@@ -0,0 +1,133 @@
+import argparse
+import datetime
+import json
+from lib.map import SEARCH_ENGINES, TileMap
+from lib.metrics import METRICS
+from lib.synthetic import generate_map, generate_towns, save_map_archive
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from utils import load_ferries, save_distances, stream_map
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+# Times each phase of the pipeline on seeded synthetic maps (see lib/synthetic.py) of several sizes, and saves the
+# results as JSON (in OUTPUT_DIR, named after the current commit by default) to compare them across commits. Each size
+# runs in a fresh process, so that its peak RSS is its own.
+OUTPUT_DIR = 'benchmarks'
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024, 1)
+
+def run_size(size: int, seed: int, towns: int, ferries: int) -> dict:
+    phases = {}
+    def timed(name: str, tiles: int, start: float) -> None:
+        seconds = time.perf_counter() - start
+        phases[name] = {
+            'seconds': round(seconds, 4),
+            'tiles_per_second': round(tiles / seconds) if seconds > 0 else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    # Only the results are printed
+    METRICS.verbose = False
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        entries, ferry_data = generate_map(size, size, seed, ferries=ferries)
+        town_list = [(t['name'], t['location']['x'], t['location']['y']) for t in generate_towns(entries, towns, seed)]
+        timed('generate', len(entries), start)
+        save_map_archive(entries, f'{work_dir}/map.gz', compressed=True)
+        save_map_archive(entries, f'{work_dir}/map.zip', compressed=False)
+        with open(f'{work_dir}/ferries.json', 'w', encoding='utf8') as fd:
+            json.dump(ferry_data, fd)
+        del entries
+
+        start = time.perf_counter()
+        stream_map(f'{work_dir}/map.zip', size, size)
+        timed('load_uncompressed', size * size, start)
+        start = time.perf_counter()
+        grid = stream_map(f'{work_dir}/map.gz', size, size)
+        timed('load_compressed', size * size, start)
+
+        tile_map = TileMap(grid, ferries=load_ferries(f'{work_dir}/ferries.json'))
+        start = time.perf_counter()
+        tile_map.compute_costs()
+        timed('costs', size * size, start)
+
+        distances = []
+        for engine in SEARCH_ENGINES:
+            tile_map.use_engine(engine)
+            start = time.perf_counter()
+            distances = [(name, tile_map.compute_distances(x, y)) for name, x, y in town_list]
+            timed(f'search_{engine}', sum(len(d) for _, d in distances), start)
+        for output_format in ('json', 'raster'):
+            start = time.perf_counter()
+            for name, d in distances:
+                save_distances(name, d, f'{work_dir}/distances', output_format)
+            timed(f'save_{output_format}', sum(len(d) for _, d in distances), start)
+    return {'size': size, 'tiles': size * size, 'towns': len(town_list), 'phases': phases}
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline_file: str) -> None:
+    # Speedup of each phase over the baseline results, for the sizes both have
+    with open(baseline_file) as fd:
+        baseline = {r['size']: r['phases'] for r in json.load(fd)['results']}
+    print(f'Speedup over {baseline_file} (baseline seconds / seconds):')
+    for result in results['results']:
+        old = baseline.get(result['size'], {})
+        for phase, new in result['phases'].items():
+            if phase in old and new['seconds'] > 0:
+                print(f'{result["size"]:>6} {phase:>18}: {old[phase]["seconds"] / new["seconds"]:6.2f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks each phase of the pipeline on synthetic maps of several sizes.')
+    parser.add_argument('--sizes', type=lambda v: [int(s) for s in v.split(',')], default=[128, 256, 512],
+                        help='Comma separated sides of the square maps, in tiles.')
+    parser.add_argument('--towns', type=int, default=5, help='Number of towns searched on each map.')
+    parser.add_argument('--ferries', type=int, default=10, help='Number of ferries of each map.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help=f'JSON file of the results. {OUTPUT_DIR}/COMMIT.json by default.')
+    parser.add_argument('--compare', metavar='JSON', default=None, help='Results of a previous run to compare with.')
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': [],
+    }
+    context = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_size, (size, args.seed, args.towns, args.ferries))
+        results['results'].append(result)
+        for phase, timing in result['phases'].items():
+            print(f'{size:>6} {phase:>18}: {timing["seconds"]:9.3f}s, {timing["tiles_per_second"] or 0:>10} tiles/s, peak RSS {timing["peak_rss_mb"]} MB')
+
+    output = args.output or f'{OUTPUT_DIR}/{commit[:10] if commit else "results"}.json'
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf8') as fd:
+        json.dump(results, fd, indent=2)
+    print(f'Results saved as {output}')
+    if args.compare is not None:
+        compare(results, args.compare)
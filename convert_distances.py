@@ -0,0 +1,21 @@
+import json
+from lib.matrix import load_matrix, matrix_to_json
+from lib.partition import load_town_raster, town_raster_to_json
+from lib.raster import load_raster, raster_to_json
+import os.path
+import sys
+
+# Converts the distance rasters (e.g. distances/*.dist), town matrices (e.g. distances/towns.matrix) and nearest town
+# rasters (e.g. distances/nearest_town.towns) given as arguments back to the JSON format, next to them
+for file_name in sys.argv[1:]:
+    root, extension = os.path.splitext(file_name)
+    output_file_name = f'{root}.json'
+    if extension == '.matrix':
+        data = matrix_to_json(load_matrix(file_name))
+    elif extension == '.towns':
+        data = town_raster_to_json(load_town_raster(file_name))
+    else:
+        data = raster_to_json(load_raster(file_name))
+    with open(output_file_name, 'w', encoding='utf8') as fp:
+        fp.write(json.dumps(data))
+    print(f'{file_name} converted to {output_file_name}')
@@ -0,0 +1,45 @@
+import argparse
+from lib.dial import SCALE
+from lib.map import SEARCH_ENGINES
+import random
+import sys
+import time
+from utils import load_costed_map, load_json
+
+MAP_ARCHIVE = 'compressed.zip'
+TOWN_JSON = 'towns_s2.json'
+FERRIES_JSON = 'ferries.json'
+MAP_CACHE = 'map.cache'
+
+# Regression check of the search engines on the real map: from each sampled town, every engine must reach the same
+# tiles with the same distances, in thousandths (the heap engine sums floats, the dial engine exact fixed-point values).
+# tests/test_engines.py runs the same check on seeded synthetic maps.
+parser = argparse.ArgumentParser(description='Checks that every search engine computes the same distances.')
+parser.add_argument('--towns', type=int, default=5, help='Number of random towns to search from, 0 for all of them.')
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+towns = [(t['name'], t['location']['x'], t['location']['y']) for t in load_json(TOWN_JSON)]
+if args.towns > 0:
+    towns = random.Random(args.seed).sample(towns, min(args.towns, len(towns)))
+map = load_costed_map(MAP_ARCHIVE, FERRIES_JSON, MAP_CACHE)
+
+failures = 0
+for name, x, y in towns:
+    distances = {}
+    for engine in SEARCH_ENGINES:
+        map.use_engine(engine)
+        start = time.perf_counter()
+        field = map.dijkstra(x, y)
+        elapsed = time.perf_counter() - start
+        distances[engine] = {i: round(d * SCALE) for i, d in field.items()}
+        print(f'{name} ({engine}): {len(field)} tiles reached in {elapsed:.1f}s')
+    reference, *others = distances.values()
+    for engine, other in zip(list(distances)[1:], others):
+        if other != reference:
+            failures += 1
+            different = sum(1 for i in reference.keys() | other.keys() if reference.get(i) != other.get(i))
+            print(f'{name}: {different} tiles differ between {next(iter(distances))} and {engine}')
+
+print(f'{len(towns)} towns checked, {failures} mismatches')
+sys.exit(1 if failures else 0)
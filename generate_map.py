@@ -0,0 +1,28 @@
+import argparse
+import json
+from lib.synthetic import generate_map, generate_towns, save_map_archive
+
+# Writes a seeded synthetic map, with its ferries and towns, in the formats of the real data (see lib/synthetic.py), e.g.
+# to try the scripts out without the real map or to benchmark them (see benchmark.py).
+parser = argparse.ArgumentParser(description='Generates a seeded synthetic map, its ferries and its towns.')
+parser.add_argument('--width', type=int, default=512)
+parser.add_argument('--height', type=int, default=512)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--roughness', type=float, default=0.3, help='Weight (0 to 1) of the small scale altitude variations.')
+parser.add_argument('--forest', type=float, default=0.3, help='Share of the land tiles covered by forests.')
+parser.add_argument('--sea', type=float, default=0.4, help='Share of the tiles which are sea.')
+parser.add_argument('--ferries', type=int, default=10, help='Number of ferries.')
+parser.add_argument('--towns', type=int, default=20, help='Number of towns.')
+parser.add_argument('--format', dest='map_format', choices=('compressed', 'uncompressed'), default='compressed',
+                    help='Gzip JSON array of the compressed array format, or zip of the uncompressed dict format.')
+parser.add_argument('--output', default='synthetic', help='Prefix of the files written.')
+args = parser.parse_args()
+
+entries, ferries = generate_map(args.width, args.height, args.seed, args.roughness, args.forest, args.sea, args.ferries)
+map_archive = f'{args.output}.gz' if args.map_format == 'compressed' else f'{args.output}.zip'
+save_map_archive(entries, map_archive, compressed=args.map_format == 'compressed')
+with open(f'{args.output}_ferries.json', 'w', encoding='utf8') as fd:
+    json.dump(ferries, fd)
+with open(f'{args.output}_towns.json', 'w', encoding='utf8') as fd:
+    json.dump(generate_towns(entries, args.towns, args.seed), fd)
+print(f'Map saved as {map_archive}, ferries as {args.output}_ferries.json and towns as {args.output}_towns.json')
@@ -0,0 +1,64 @@
+import argparse
+from lib.cache import cache_key
+from lib.landmarks import Landmarks
+import random
+import time
+from utils import load_costed_map, load_json
+
+MAP_ARCHIVE = 'compressed.zip'
+TOWN_JSON = 'towns_s2.json'
+FERRIES_JSON = 'ferries.json'
+MAP_CACHE = 'map.cache'
+LANDMARKS_FILE = 'landmarks.bin'
+
+# Compares the number of tiles settled (and the time spent) between a full Dijkstra, plain A* and A* with landmarks (ALT)
+# on random town to town routes. Landmarks are picked among the towns and saved in LANDMARKS_FILE for the next runs.
+parser = argparse.ArgumentParser(description='Benchmarks point to point routes with and without landmarks.')
+parser.add_argument('--landmarks', type=int, default=16, help='Number of landmarks.')
+parser.add_argument('--queries', type=int, default=20, help='Number of random town to town routes.')
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+towns = [(t['location']['x'], t['location']['y']) for t in load_json(TOWN_JSON)]
+map = load_costed_map(MAP_ARCHIVE, FERRIES_JSON, MAP_CACHE)
+
+key = f'{cache_key(MAP_ARCHIVE, FERRIES_JSON)}:{args.landmarks}'
+landmarks = Landmarks.load(LANDMARKS_FILE, key)
+if landmarks is None:
+    start = time.perf_counter()
+    landmarks = map.compute_landmarks(args.landmarks, start=towns[0], candidates=towns)
+    print(f'{len(landmarks)} landmarks computed in {time.perf_counter() - start:.1f}s')
+    landmarks.save(LANDMARKS_FILE, key)
+else:
+    map.use_landmarks(landmarks)
+
+rng = random.Random(args.seed)
+totals = {'dijkstra': [0, 0.0], 'astar': [0, 0.0], 'alt': [0, 0.0]}
+for _ in range(args.queries):
+    src, dst = rng.sample(towns, 2)
+
+    start = time.perf_counter()
+    field = map.dijkstra(*src)
+    settled = len(field)
+    target = map.grid.index(*dst)
+    expected = field[target] if target in field else None
+    totals['dijkstra'][0] += settled
+    totals['dijkstra'][1] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    plain = map.shortest_path(src, dst, use_landmarks=False)
+    totals['astar'][0] += plain.settled
+    totals['astar'][1] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    alt = map.shortest_path(src, dst)
+    totals['alt'][0] += alt.settled
+    totals['alt'][1] += time.perf_counter() - start
+
+    for name, route in (('A*', plain), ('ALT', alt)):
+        if (route.cost is None) != (expected is None) or expected is not None and abs(route.cost - expected) > 1e-6:
+            raise AssertionError(f'Different costs from {src} to {dst}: {route.cost} ({name}) vs {expected} (Dijkstra)')
+    print(f'{src} -> {dst}: cost {alt.cost}, settled {settled} (Dijkstra), {plain.settled} (A*), {alt.settled} (ALT)')
+
+for engine, (settled, elapsed) in totals.items():
+    print(f'{engine:>8}: {settled / args.queries:12.0f} tiles settled, {elapsed / args.queries:8.3f}s per route')
@@ -0,0 +1,114 @@
+from __future__ import annotations
+import hashlib
+import json
+from lib.components import ComponentIndex
+from lib.graph import TileGraph
+from lib.grid import TileGrid
+from lib.map import TileMap
+from lib.metrics import METRICS
+from lib.types import DIRECTIONS
+from lib.utils import COST_RULES_VERSION
+import mmap
+import os.path
+import struct
+
+# Bump whenever the layout of the cache file changes
+FORMAT_VERSION = 3
+MAGIC = b'MERCMAP\x00'
+# magic, format version, length of the JSON header
+_PREAMBLE = struct.Struct('<8sII')
+# Arrays are aligned on this boundary in the file
+_ALIGNMENT = 64
+
+def cache_key(*paths: str) -> str:
+    """
+    Content hash of the files the costed map is built from (map archive, ferries...), together with the versions of the cost
+    rules and of the cache format: a cache file is only valid for the same key.
+    """
+    digest = hashlib.sha256(f'{FORMAT_VERSION}:{COST_RULES_VERSION}'.encode('utf8'))
+    for path in paths:
+        with open(path, 'rb') as fd:
+            while chunk := fd.read(1 << 20):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _arrays(tile_map: TileMap) -> list[tuple[str, memoryview]]:
+    grid, graph = tile_map.grid, tile_map.graph
+    arrays = [('grid.present', grid.present)]
+    arrays += [(f'grid.{name}', getattr(grid, name)) for name, _ in TileGrid.FIELDS]
+    arrays += [(f'weights.{d}', plane) for d, plane in enumerate(tile_map.weights)]
+    arrays += [('graph.offsets', graph.offsets), ('graph.targets', graph.targets), ('graph.codes', graph.codes)]
+    arrays += [('components.labels', tile_map.components.labels)]
+    return [(name, memoryview(data)) for name, data in arrays]
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+def save_cache(tile_map: TileMap, path: str, key: str) -> None:
+    """
+    Saves the costed and compiled `tile_map`: tile attributes, weight planes, graph, components and ferries.
+    The file is made of a small JSON header describing the raw arrays that follow it, so that they can be memory mapped.
+    """
+    METRICS.progress('Saving map cache...')
+    arrays = _arrays(tile_map)
+    header = {
+        'key': key,
+        'width': tile_map.grid.width,
+        'height': tile_map.grid.height,
+        'origin': [tile_map.grid.x0, tile_map.grid.y0],
+        'ferries': [[f, list(landings)] for f, landings in tile_map.ferries.items()],
+        'component_sizes': list(tile_map.components.sizes),
+        'arrays': [],
+    }
+    # Offsets are relative to the start of the data, right after the (aligned) header
+    offset = 0
+    for name, data in arrays:
+        header['arrays'].append([name, data.format, offset, len(data)])
+        offset = _aligned(offset + data.nbytes)
+    header_bytes = json.dumps(header).encode('utf8')
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    # Written to a temporary file first, a half written cache must never be picked up
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fd:
+        fd.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        fd.write(header_bytes)
+        for (name, data), (_, _, offset, _) in zip(arrays, header['arrays']):
+            fd.seek(data_start + offset)
+            fd.write(data.cast('B'))
+    os.replace(tmp_path, path)
+    METRICS.progress(f'Map cache saved as {path}')
+
+def load_cache(path: str, key: str) -> TileMap | None:
+    """
+    Memory maps the cache file in `path` and returns the costed map it holds, or None if the file is missing, has been
+    written by another version or for another `key`.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as fd:
+        magic, version, header_length = _PREAMBLE.unpack(fd.read(_PREAMBLE.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        header = json.loads(fd.read(header_length))
+        if header['key'] != key:
+            return None
+        buffer = memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))[_aligned(_PREAMBLE.size + header_length):]
+
+    arrays = {}
+    for name, fmt, offset, length in header['arrays']:
+        arrays[name] = buffer[offset:offset + length * struct.calcsize(fmt)].cast(fmt)
+    grid = TileGrid.from_arrays(
+        header['width'],
+        header['height'],
+        # Copied as the grid searches into it (16 MB at most)
+        bytes(arrays['grid.present']),
+        *header['origin'],
+        **{name: arrays[f'grid.{name}'] for name, _ in TileGrid.FIELDS},
+    )
+    weights = [arrays[f'weights.{d}'] for d in range(len(DIRECTIONS))]
+    ferries = {f: tuple(landings) for f, landings in header['ferries']}
+    graph = TileGraph(arrays['graph.offsets'], arrays['graph.targets'], arrays['graph.codes'])
+    components = ComponentIndex(arrays['components.labels'], header['component_sizes'], ferries)
+    METRICS.progress(f'Map loaded from cache {path}')
+    return TileMap.from_compiled(grid, weights, ferries, graph, components)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+from array import array
+import json
+from lib.grid import TileGrid
+from lib.metrics import METRICS
+import os.path
+import struct
+import sys
+import zlib
+
+MAGIC = b'MCHK'
+VERSION = 1
+# magic, version, length of the JSON header
+_PREAMBLE = struct.Struct('<4sII')
+# Side of the square chunks, in tiles
+CHUNK_SIZE = 64
+
+def _chunk_bounds(grid_size: int, chunk_size: int, start: int, stop: int) -> range:
+    # Chunks (along one axis) overlapping the tiles from start to stop (excluded)
+    return range(max(start, 0) // chunk_size, -(-min(stop, grid_size) // chunk_size))
+
+def save_chunks(grid: TileGrid, path: str, key: str = '', chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Saves `grid` (the whole map) split into square chunks of `chunk_size` tiles, each one compressed on its own and located by an index
+    in the header, so that any window of the map can be read without going through the rest of the file.
+    A chunk is made of the `present` flags then of each array of TileGrid.FIELDS, row by row, in little endian order.
+    Chunks without any tile are not stored. `key` identifies the map the grid comes from: utils.load_map_window stamps
+    the file with the size and modification time of the archive, cheaper to check than a hash of its content.
+    """
+    METRICS.progress('Saving map chunks...')
+    chunks_x, chunks_y = -(-grid.width // chunk_size), -(-grid.height // chunk_size)
+    index = []
+    payloads = []
+    offset = 0
+    for cy in range(chunks_y):
+        for cx in range(chunks_x):
+            x0, y0 = cx * chunk_size, cy * chunk_size
+            w, h = min(chunk_size, grid.width - x0), min(chunk_size, grid.height - y0)
+            rows = [slice((y0 + dy) * grid.width + x0, (y0 + dy) * grid.width + x0 + w) for dy in range(h)]
+            present = b''.join(grid.present[r] for r in rows)
+            if present.count(0) == len(present):
+                index.append([0, 0])
+                continue
+            parts = [present]
+            for name, typecode in TileGrid.FIELDS:
+                values = array(typecode)
+                for r in rows:
+                    values.extend(getattr(grid, name)[r])
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                parts.append(values.tobytes())
+            payload = zlib.compress(b''.join(parts), 6)
+            index.append([offset, len(payload)])
+            payloads.append(payload)
+            offset += len(payload)
+
+    header = json.dumps({
+        'key': key,
+        'width': grid.width,
+        'height': grid.height,
+        'chunk_size': chunk_size,
+        'index': index,
+    }).encode('utf8')
+    # Written to a temporary file first, like lib.cache
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fd:
+        fd.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        fd.write(header)
+        for payload in payloads:
+            fd.write(payload)
+    os.replace(tmp_path, path)
+    METRICS.progress(f'Map chunks saved as {path}')
+
+def read_header(path: str, key: str | None = None) -> dict | None:
+    # Header of the chunk file, or None if the file is missing, has been written by another version or for another `key`
+    # (if given)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as fd:
+        magic, version, header_length = _PREAMBLE.unpack(fd.read(_PREAMBLE.size))
+        if magic != MAGIC or version != VERSION:
+            return None
+        header = json.loads(fd.read(header_length))
+    if key is not None and header['key'] != key:
+        return None
+    header['data_start'] = _PREAMBLE.size + header_length
+    return header
+
+def load_window(path: str, min_x: int, max_x: int, min_y: int, max_y: int, header: dict | None = None) -> TileGrid:
+    """
+    Reads the tiles of the window (inclusive bounds, clipped to the map) out of a chunk file saved by save_chunks, into
+    a grid covering the window only (see TileGrid.x0 and y0). Only the chunks overlapping the window are read.
+    """
+    if header is None:
+        header = read_header(path)
+        if header is None:
+            raise ValueError('Not a map chunk file, or written by another version')
+    width, height, chunk_size = header['width'], header['height'], header['chunk_size']
+    min_x, min_y = max(min_x, 0), max(min_y, 0)
+    max_x, max_y = min(max_x, width - 1), min(max_y, height - 1)
+    grid = TileGrid(max(max_x - min_x + 1, 0), max(max_y - min_y + 1, 0), min_x, min_y)
+    chunks_x = -(-width // chunk_size)
+    with open(path, 'rb') as fd:
+        for cy in _chunk_bounds(height, chunk_size, min_y, max_y + 1):
+            for cx in _chunk_bounds(width, chunk_size, min_x, max_x + 1):
+                offset, length = header['index'][cy * chunks_x + cx]
+                if length == 0:
+                    continue
+                fd.seek(header['data_start'] + offset)
+                data = memoryview(zlib.decompress(fd.read(length)))
+                x0, y0 = cx * chunk_size, cy * chunk_size
+                w, h = min(chunk_size, width - x0), min(chunk_size, height - y0)
+                # Rows of the chunk within the window, as (grid slice, chunk slice)
+                left, right = max(min_x, x0), min(max_x, x0 + w - 1)
+                rows = [
+                    (slice(grid.index(left, y), grid.index(right, y) + 1), slice((y - y0) * w + left - x0, (y - y0) * w + right - x0 + 1))
+                        for y in range(max(min_y, y0), min(max_y, y0 + h - 1) + 1)
+                ]
+                for target, source in rows:
+                    grid.present[target] = data[source]
+                start = w * h
+                for name, typecode in TileGrid.FIELDS:
+                    values = array(typecode)
+                    values.frombytes(data[start:start + w * h * values.itemsize])
+                    if sys.byteorder == 'big':
+                        values.byteswap()
+                    field = getattr(grid, name)
+                    for target, source in rows:
+                        field[target] = values[source]
+                    start += w * h * values.itemsize
+    return grid
@@ -0,0 +1,125 @@
+from __future__ import annotations
+from array import array
+from functools import lru_cache
+from lib.grid import TileGrid
+from lib.types import DIRECTIONS
+from typing import Iterable, Mapping, Sequence
+
+_RIGHT = DIRECTIONS.index((1, 0))
+_DOWN = DIRECTIONS.index((0, 1))
+_DOWN_LEFT = DIRECTIONS.index((-1, 1))
+_DOWN_RIGHT = DIRECTIONS.index((1, 1))
+
+def _crossable(plane: Sequence[int], start: int, stop: int) -> bool:
+    # Whether any move of the plane between start and stop (excluded) is crossable
+    moves = bytes(plane[start:stop])
+    return moves.count(0) != len(moves)
+
+def _find(parents: list[int], r: int) -> int:
+    while parents[r] != r:
+        parents[r] = parents[parents[r]]
+        r = parents[r]
+    return r
+
+def label_components(grid: TileGrid, planes: Sequence[Sequence[int]]) -> tuple[array, list[int]]:
+    """
+    Labels the connected components of the moves of the weight planes (ferries aside). Moves are symmetric, so rows are
+    first split into runs of tiles joined by horizontal moves, then the runs of consecutive rows are joined by their
+    vertical and diagonal moves. It returns the component of each tile (-1 for missing tiles) and the size of each one.
+    """
+    width, height = grid.width, grid.height
+    right, down, down_left, down_right = planes[_RIGHT], planes[_DOWN], planes[_DOWN_LEFT], planes[_DOWN_RIGHT]
+    # Runs as (row, first x, last x), with a union-find over them
+    runs: list[tuple[int, int, int]] = []
+    parents: list[int] = []
+    previous: list[int] = []
+    for y in range(height):
+        row = y * width
+        moves = bytes(right[row:row + width])
+        current = []
+        x = grid.present.find(1, row, row + width)
+        while x != -1:
+            x -= row
+            # The run goes on as long as the move to the right is crossable
+            end = moves.find(0, x)
+            end = width - 1 if end == -1 else end
+            current.append(len(runs))
+            runs.append((y, x, end))
+            parents.append(len(parents))
+            x = grid.present.find(1, row + end + 1, row + width)
+
+        # Join the runs of the previous row to the overlapping (or diagonally touching) ones of this row
+        j = 0
+        above = row - width
+        for r in previous:
+            _, a0, a1 = runs[r]
+            while j < len(current) and runs[current[j]][2] < a0 - 1:
+                j += 1
+            k = j
+            while k < len(current) and runs[current[k]][1] <= a1 + 1:
+                _, b0, b1 = runs[current[k]]
+                if (
+                    _crossable(down, above + max(a0, b0), above + min(a1, b1) + 1)
+                    or _crossable(down_right, above + max(a0, b0 - 1), above + min(a1, b1 - 1) + 1)
+                    or _crossable(down_left, above + max(a0, b0 + 1), above + min(a1, b1 + 1) + 1)
+                ):
+                    parents[_find(parents, r)] = _find(parents, current[k])
+                k += 1
+        previous = current
+
+    labels = array('i', [-1]) * grid.size
+    components: dict[int, int] = {}
+    sizes: list[int] = []
+    for r, (y, x0, x1) in enumerate(runs):
+        root = _find(parents, r)
+        if root not in components:
+            components[root] = len(sizes)
+            sizes.append(0)
+        label = components[root]
+        sizes[label] += x1 - x0 + 1
+        labels[y * width + x0:y * width + x1 + 1] = array('i', [label]) * (x1 - x0 + 1)
+    return labels, sizes
+
+class ComponentIndex:
+    """
+    Connected components of the map: as land and sea moves never cross each other, each component is either a land or a
+    sea one. Ferries join components one way, and a search from a town also starts on the components it can board.
+    `labels` is the component of each tile (-1 for missing tiles) and `sizes` the number of tiles of each component.
+    """
+    def __init__(self, labels: Sequence[int], sizes: Sequence[int], ferries: Mapping[int, Sequence[int]]):
+        self.labels = labels
+        self.sizes = sizes
+        # Components reached by ferry from each component
+        self.links: dict[int, set[int]] = {}
+        for f, landings in ferries.items():
+            self.links.setdefault(labels[f], set()).update(labels[l] for l in landings)
+        self._closure = lru_cache(maxsize=None)(self._compute_closure)
+
+    @classmethod
+    def build(cls, grid: TileGrid, planes: Sequence[Sequence[int]], ferries: Mapping[int, Sequence[int]]) -> ComponentIndex:
+        labels, sizes = label_components(grid, planes)
+        return cls(labels, sizes, ferries)
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def _compute_closure(self, components: frozenset[int]) -> frozenset[int]:
+        reached = set(components)
+        stack = list(components)
+        while len(stack) > 0:
+            for c in self.links.get(stack.pop(), ()):
+                if c not in reached:
+                    reached.add(c)
+                    stack.append(c)
+        return frozenset(reached)
+
+    def closure(self, tiles: Iterable[int]) -> frozenset[int]:
+        # Components reachable from a search starting on `tiles`. It is cached: sources sharing their starting components
+        # (e.g. towns of the same island and sea) are only processed once.
+        return self._closure(frozenset(self.labels[i] for i in tiles))
+
+    def reachable_size(self, tiles: Iterable[int]) -> int:
+        return sum(self.sizes[c] for c in self.closure(tiles))
+
+    def is_reachable(self, tiles: Iterable[int], target: int) -> bool:
+        return self.labels[target] in self.closure(tiles)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+from itertools import repeat
+from lib.grid import NULL, TileGrid
+from lib.types import DIRECTIONS, TileInfo
+from lib.utils import compute_weight, weight_code
+from operator import ne, sub
+
+# Tile classes, as far as move costs are concerned
+ABSENT = 0
+LAND = 1
+FOREST = 2
+SEA = 3
+
+# Smallest altitude difference of each penalty band of lib.utils._height_penalty
+_BAND_HEIGHTS = (0, 25, 75, 125)
+
+# Directions actually computed. The others are their mirrors, as the weight of a move is the same in both ways.
+_FORWARD = ((1, 0), (0, 1), (-1, 1), (1, 1))
+
+def _key(src: int, dest: int, sea_neighbor: int, band: int) -> int:
+    # Fits in a byte: 2 bits per tile class, 1 bit for the sea neighbor, 2 bits for the altitude band
+    return src << 5 | dest << 3 | sea_neighbor << 2 | band
+
+def _representative(tile_class: int, x: int, y: int, alt: int = 0) -> TileInfo:
+    return TileInfo(
+        x=x,
+        y=y,
+        alt=alt,
+        fertility=None,
+        forest=1 if tile_class == FOREST else None,
+        res=None,
+        res_amount=None,
+        region=None,
+        area=1 if tile_class == SEA else None,
+        type=1 if tile_class == SEA else None,
+    )
+
+def _code_table(dx: int, dy: int) -> bytes:
+    # Runs compute_weight once per combination of the key, so that the batch engine applies exactly the same rules
+    table = bytearray(256)
+    diagonal = dx != 0 and dy != 0
+    for src in (LAND, FOREST, SEA):
+        for dest in (LAND, FOREST, SEA):
+            for sea_neighbor in ((0, 1) if diagonal else (0,)):
+                for band, height in enumerate(_BAND_HEIGHTS):
+                    s = _representative(src, 1, 1)
+                    d = _representative(dest, 1 + dx, 1 + dy, alt=height)
+                    neighbors = ()
+                    if diagonal:
+                        neighbor_class = SEA if sea_neighbor else LAND
+                        neighbors = (_representative(neighbor_class, 1, 1 + dy), _representative(neighbor_class, 1 + dx, 1))
+                    table[_key(src, dest, sea_neighbor, band)] = weight_code(compute_weight(s, d, neighbors=neighbors))
+    return bytes(table)
+
+def _band_table(max_difference: int) -> list[int]:
+    # Indexed by the (signed) altitude difference: negative differences wrap around from the end of the list
+    bands = [sum(d >= h for h in _BAND_HEIGHTS[1:]) for d in range(max_difference + 1)]
+    return bands + bands[:0:-1]
+
+def _class_table() -> bytes:
+    # Indexed by present << 2 | sea << 1 | forest. Forests do not matter on sea tiles.
+    table = bytearray(256)
+    for key in range(8):
+        present, sea, forest = key >> 2 & 1, key >> 1 & 1, key & 1
+        table[key] = ABSENT if not present else SEA if sea else FOREST if forest else LAND
+    return bytes(table)
+
+_CLASSES = _class_table()
+
+def tile_classes(grid: TileGrid) -> bytes:
+    sea = bytes(map(ne, grid.type, repeat(NULL['h'])))
+    forest = bytes(map(ne, grid.forest, repeat(NULL['i'])))
+    key = int.from_bytes(grid.present, 'big') << 2 | int.from_bytes(sea, 'big') << 1 | int.from_bytes(forest, 'big')
+    return key.to_bytes(grid.size, 'big').translate(_CLASSES)
+
+def _altitudes(grid: TileGrid) -> memoryview:
+    # Absent tiles have no altitude: give them any in range value, their moves are never crossable anyway
+    alt = grid.alt
+    i = grid.present.find(0)
+    if i == -1:
+        return memoryview(alt)
+    alt = type(alt)(alt.typecode, alt)
+    fill = next(iter(grid)).alt if len(grid) > 0 else 0
+    while i != -1:
+        alt[i] = fill
+        i = grid.present.find(0, i + 1)
+    return memoryview(alt)
+
+def compute_weight_planes(grid: TileGrid) -> list[bytearray]:
+    """
+    Batch version of lib.utils.compute_weight: it computes the weight codes (see lib.utils.WEIGHTS) of every move of the map,
+    one plane per direction of DIRECTIONS, indexed like the grid.
+
+    Each plane is built from the whole map arrays shifted by the direction: tile classes, sea neighbors and altitude bands
+    are packed into a one byte key per tile, which is then translated to the weight code.
+    """
+    size = grid.size
+    width = grid.width
+    classes = tile_classes(grid)
+    sea = classes.translate(bytes(c == SEA for c in range(256)))
+    padded_sea = b'\x00' + sea + b'\x00' * (width + 1)
+    alt = _altitudes(grid)
+    bands = _band_table(max(alt) - min(alt) if size > 0 else 0)
+
+    planes = [bytearray(size) for _ in DIRECTIONS]
+    for dx, dy in _FORWARD:
+        delta = dy * width + dx
+        n = size - delta
+        if n <= 0:
+            continue
+
+        key = int.from_bytes(classes[:n], 'big') << 5
+        key |= int.from_bytes(classes[delta:], 'big') << 3
+        key |= int.from_bytes(bytes(map(bands.__getitem__, map(sub, alt[:n], alt[delta:]))), 'big')
+        if dx != 0 and dy != 0:
+            # Sea tiles adjacent to both src and dest
+            vertical = padded_sea[1 + dy * width:1 + dy * width + n]
+            horizontal = padded_sea[1 + dx:1 + dx + n]
+            key |= (int.from_bytes(vertical, 'big') | int.from_bytes(horizontal, 'big')) << 2
+
+        plane = planes[DIRECTIONS.index((dx, dy))]
+        plane[:n] = key.to_bytes(n, 'big').translate(_code_table(dx, dy))
+        # Moves wrapping around the map boundaries do not exist
+        if dx == 1:
+            plane[width - 1::width] = bytes(len(range(width - 1, size, width)))
+        elif dx == -1:
+            plane[::width] = bytes(len(range(0, size, width)))
+
+        mirror = planes[DIRECTIONS.index((-dx, -dy))]
+        mirror[delta:] = plane[:n]
+    return planes
@@ -0,0 +1,91 @@
+from __future__ import annotations
+from array import array
+from functools import lru_cache
+import heapq
+from itertools import accumulate
+from lib.costs import FOREST, LAND, tile_classes
+from lib.grid import TileGrid
+from typing import Iterable
+
+# Tiles of a circle, as (dx, first dy, last dy) offsets from its centre, one span per dx
+Span = tuple[int, int, int]
+
+@lru_cache(maxsize=None)
+def circle_spans(radius: int) -> tuple[Span, ...]:
+    # Tiles within `radius` (centre excluded) of the centre: for each dx, every dy between the tiles of the circle's
+    # boundary in that row
+    r = radius - 1
+    spans = []
+    for dx in range(-r, r + 1):
+        dys = [dy for dy in range(-r, r + 1) if r - 0.5 <= (dx ** 2 + dy ** 2) ** 0.5 <= r + 0.5]
+        spans.append((dx, min(dys), max(dys)))
+    return tuple(spans)
+
+def in_circle(center: tuple[int, int], x: int, y: int, radius: int) -> bool:
+    spans = circle_spans(radius)
+    dx = x - center[0]
+    if not -radius < dx < radius:
+        return False
+    _, first, last = spans[dx + radius - 1]
+    return first <= y - center[1] <= last
+
+class ForestCoverage:
+    """
+    Forest tiles an outpost of `radius` covers, for any location of the grid at once. The forest bitmap (without the
+    tiles already covered by the `camps`) is turned into prefix sums along each dx column, so that the forest tiles of a
+    circle are counted with one subtraction per span of circle_spans, whatever the number of tiles it covers.
+    With an `area` (min_x, max_x, min_y, max_y, inclusive), only the forest tiles within it are counted: the grid may hold
+    a margin around it, for the circles of the locations near its border.
+    """
+    def __init__(
+        self,
+        grid: TileGrid,
+        radius: int = 8,
+        camps: Iterable[tuple[int, int]] = (),
+        area: tuple[int, int, int, int] | None = None,
+    ):
+        self.grid = grid
+        self.radius = radius
+        classes = tile_classes(grid)
+        forest = bytearray(classes.translate(bytes(c == FOREST for c in range(256))))
+        if area is not None:
+            min_x, max_x, min_y, max_y = area
+            for i in range(grid.size):
+                x, y = grid.coords(i)
+                if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                    forest[i] = 0
+        for camp in camps:
+            for x, y in self.circle(camp):
+                forest[grid.index(x, y)] = 0
+        # Prefix sums of the forest tiles of each column, from y0
+        self._columns = [array('i', accumulate(forest[x::grid.width], initial=0)) for x in range(grid.width)]
+        self._land = classes.translate(bytes(c in (LAND, FOREST) for c in range(256)))
+
+    def circle(self, center: tuple[int, int]) -> Iterable[tuple[int, int]]:
+        # Tiles of the grid within the radius of `center`
+        x, y = center
+        for dx, first, last in circle_spans(self.radius):
+            for dy in range(first, last + 1):
+                if self.grid.in_bounds(x + dx, y + dy):
+                    yield x + dx, y + dy
+
+    def count(self, x: int, y: int) -> int:
+        # Forest tiles covered by an outpost in x, y
+        grid = self.grid
+        total = 0
+        for dx, first, last in circle_spans(self.radius):
+            column = x + dx - grid.x0
+            if not 0 <= column < grid.width:
+                continue
+            start, stop = max(y + first - grid.y0, 0), min(y + last + 1 - grid.y0, grid.height)
+            if start < stop:
+                prefix = self._columns[column]
+                total += prefix[stop] - prefix[start]
+        return total
+
+    def best(self, k: int, candidates: Iterable[tuple[int, int]] | None = None) -> list[tuple[tuple[int, int], int]]:
+        # The `k` locations covering the most forest tiles, with their count, among `candidates` (every land tile of the
+        # grid by default)
+        if candidates is None:
+            candidates = (self.grid.coords(i) for i in range(self.grid.size) if self._land[i])
+        return heapq.nlargest(k, ((c, self.count(*c)) for c in candidates), key=lambda item: item[1])
@@ -0,0 +1,163 @@
+from __future__ import annotations
+from array import array
+from lib.graph import EDGE_WEIGHTS, TileGraph
+from lib.search import COST_SCALE, UNREACHABLE, DistanceField, SparseDistances
+from typing import Iterable, Iterator
+
+# Fixed-point costs: thousandths of cost. Every move weight is a whole number of thousandths, so sums of them are exact.
+SCALE = COST_SCALE
+FIXED_WEIGHTS = tuple(0 if w is None else round(w * SCALE) for w in EDGE_WEIGHTS)
+# Fixed-point distance of the tiles not reached
+UNREACHED = (1 << 63) - 1
+# Tentative distances always lie within the largest weight from the distance being settled: one bucket per value
+_SPAN = max(FIXED_WEIGHTS) + 1
+
+class SparseFixedDistances(dict):
+    # Fixed-point counterpart of lib.search.SparseDistances
+    def __missing__(self, i: int) -> int:
+        return UNREACHED
+
+class FixedDistanceField(DistanceField):
+    """
+    Result of the dial engine: `fixed` holds the exact distances in thousandths (UNREACHED if not reached). Distances read
+    through the DistanceField interface are converted on the fly, and `dist` is a float copy only built if it is accessed.
+    """
+    def __init__(
+        self,
+        fixed: array | SparseFixedDistances,
+        settled: array,
+        parents: array | dict[int, int] | None = None,
+        pushes: int = 0,
+        stale: int = 0,
+    ):
+        self.fixed = fixed
+        self.settled = settled
+        self.parents = parents
+        self.pushes = pushes
+        self.stale = stale
+        self._dist: array | None = None
+
+    @property
+    def dist(self) -> array:
+        if self._dist is None:
+            self._dist = array('d', [UNREACHABLE]) * len(self.fixed) if isinstance(self.fixed, array) else SparseDistances()
+            for i, d in self.items():
+                self._dist[i] = d
+        return self._dist
+
+    def __getitem__(self, i: int) -> float:
+        d = self.fixed[i]
+        return UNREACHABLE if d == UNREACHED else d / SCALE
+
+    def __contains__(self, i: int) -> bool:
+        return self.fixed[i] != UNREACHED
+
+    def items(self) -> Iterator[tuple[int, float]]:
+        fixed = self.fixed
+        return ((i, fixed[i] / SCALE) for i in self.settled)
+
+def dial(
+    graph: TileGraph,
+    seeds: Iterable[tuple[int, float]],
+    max_cost: float | None = None,
+    max_tiles: int | None = None,
+    targets: Iterable[int] | None = None,
+    sparse: bool = False,
+    predecessors: bool = False,
+) -> FixedDistanceField:
+    """
+    Same search as lib.search.dijkstra, on exact fixed-point distances with a bucket queue (Dial's algorithm) instead of
+    a binary heap: a circular array of _SPAN buckets, one per distance value, as tentative distances never exceed the
+    distance being settled by more than the largest weight. The next non empty bucket is found by a byte scan of the
+    `occupied` flags, and each bucket is settled at once, without any comparison.
+    """
+    pending = None if targets is None else set(targets)
+    offsets, targets, codes = graph.offsets, graph.targets, graph.codes
+    weights, span = FIXED_WEIGHTS, _SPAN
+    dist = SparseFixedDistances() if sparse else array('q', [UNREACHED]) * len(graph)
+    parents = None if not predecessors else {} if sparse else array('i', [-1]) * len(graph)
+    settled = array('i')
+    stale = 0
+    buckets: list[list[int]] = [[] for _ in range(span)]
+    occupied = bytearray(span)
+    # Seeds are pushed as the window of the buckets reaches them
+    waiting = sorted((round(d * SCALE), s) for s, d in seeds)
+    waiting.reverse()
+    max_fixed = UNREACHED if max_cost is None else round(max_cost * SCALE)
+    if max_tiles is None:
+        max_tiles = len(graph)
+    if pending is not None and not pending:
+        max_tiles = 0
+
+    current = waiting[-1][0] if waiting else 0
+    position = current % span
+    while True:
+        while waiting and waiting[-1][0] < current + span:
+            d, s = waiting.pop()
+            if d < dist[s]:
+                dist[s] = d
+                if parents is not None:
+                    parents[s] = -1
+                buckets[d % span].append(s)
+                occupied[d % span] = 1
+        b = occupied.find(1, position)
+        if b == -1:
+            b = occupied.find(1, 0, position)
+        if b == -1:
+            if not waiting:
+                break
+            current = waiting[-1][0]
+            position = current % span
+            continue
+        current += (b - position) % span
+        position = b
+        if current > max_fixed:
+            break
+
+        bucket = buckets[b]
+        buckets[b] = []
+        occupied[b] = 0
+        for j, u in enumerate(bucket):
+            # Stale entry, u has already been reached with a lower distance
+            if dist[u] != current:
+                stale += 1
+                continue
+            if len(settled) >= max_tiles:
+                stop = j
+                break
+            settled.append(u)
+            if pending is not None and u in pending:
+                pending.discard(u)
+                if not pending:
+                    stop = j + 1
+                    break
+
+            # For each neighbor of u
+            for e in range(offsets[u], offsets[u + 1]):
+                n = targets[e]
+                alt = current + weights[codes[e]]
+                if alt < dist[n]:
+                    dist[n] = alt
+                    if parents is not None:
+                        parents[n] = u
+                    k = alt % span
+                    buckets[k].append(n)
+                    occupied[k] = 1
+        else:
+            continue
+        # Stopped within the bucket: the tiles left in it are beyond the cutoff
+        buckets[b] = bucket[stop:] + buckets[b]
+        break
+
+    # Every entry pushed has been settled, found stale or is left in the buckets
+    pushes = len(settled) + stale + sum(len(bucket) for bucket in buckets)
+    # Forget the tentative distances of the tiles beyond the cutoff
+    for b, bucket in enumerate(buckets):
+        value = current + (b - position) % span
+        for n in bucket:
+            if dist[n] == value:
+                if sparse:
+                    del dist[n]
+                else:
+                    dist[n] = UNREACHED
+    return FixedDistanceField(dist, settled, parents, pushes, stale)
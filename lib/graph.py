@@ -0,0 +1,71 @@
+from __future__ import annotations
+from array import array
+from itertools import accumulate, compress
+from lib.utils import WEIGHTS
+from typing import Iterator, Mapping, Sequence
+
+# Ferries are free to take
+FERRY = len(WEIGHTS)
+EDGE_WEIGHTS = WEIGHTS + (0,)
+
+# Tiles compiled at once, it bounds the memory used by the interleaved planes
+_CHUNK_SIZE = 1 << 20
+
+class TileGraph:
+    """
+    Compressed sparse row adjacency of the map: the edges leaving tile i are the range offsets[i]:offsets[i + 1],
+    each going to tile targets[e] with weight EDGE_WEIGHTS[codes[e]]. Non crossable moves are not stored.
+    """
+    def __init__(self, offsets: Sequence[int], targets: Sequence[int], codes: Sequence[int]):
+        self.offsets = offsets
+        self.targets = targets
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def edges(self) -> int:
+        return len(self.targets)
+
+    @property
+    def nbytes(self) -> int:
+        return 4 * len(self.offsets) + 4 * len(self.targets) + len(self.codes)
+
+    def neighbours(self, i: int) -> Iterator[tuple[int, float]]:
+        for e in range(self.offsets[i], self.offsets[i + 1]):
+            yield self.targets[e], EDGE_WEIGHTS[self.codes[e]]
+
+def compile_graph(planes: Sequence[bytes], deltas: Sequence[int], ferries: Mapping[int, Sequence[int]]) -> TileGraph:
+    """
+    Builds the TileGraph out of the weight planes (one per direction, see lib.costs.compute_weight_planes), `deltas` being the
+    index offset of the neighbour in each direction. Ferry landings are appended after the moves of their ferry tile.
+    """
+    size = len(planes[0])
+    directions = len(planes)
+
+    # Degree of each tile: sum of the (0 or 1) crossable flags of each direction, added up one whole plane at a time
+    crossable = bytes([0]) + bytes([1]) * 255
+    degrees = list(sum(int.from_bytes(p.translate(crossable), 'big') for p in planes).to_bytes(size, 'big'))
+    for f, landings in ferries.items():
+        degrees[f] += len(landings)
+    offsets = array('i', accumulate(degrees, initial=0))
+    del degrees
+
+    targets = array('i')
+    codes = bytearray()
+    # Compile chunks of tiles, breaking them right after each ferry tile to append its landings
+    bounds = sorted({*range(0, size, _CHUNK_SIZE), *(f + 1 for f in ferries), size})
+    for lo, hi in zip(bounds, bounds[1:]):
+        interleaved_codes = bytearray(directions * (hi - lo))
+        interleaved_targets = array('i', bytes(4 * directions * (hi - lo)))
+        for d, (plane, delta) in enumerate(zip(planes, deltas)):
+            interleaved_codes[d::directions] = plane[lo:hi]
+            interleaved_targets[d::directions] = array('i', range(lo + delta, hi + delta))
+        targets.extend(compress(interleaved_targets, interleaved_codes))
+        codes += interleaved_codes.replace(b'\x00', b'')
+        if hi - 1 in ferries:
+            targets.extend(ferries[hi - 1])
+            codes += bytes([FERRY]) * len(ferries[hi - 1])
+    assert len(targets) == offsets[-1]
+    return TileGraph(offsets, targets, codes)
@@ -0,0 +1,173 @@
+from __future__ import annotations
+from array import array
+from lib.types import MAX_HEIGHT, MAX_WIDTH, TileInfo
+from typing import Iterable, Iterator, Sequence
+
+# Value stored in place of None, for each array typecode
+NULL = {
+    'h': -0x8000,
+    'i': -0x80000000,
+}
+
+def _null_array(typecode: str, size: int) -> array:
+    return array(typecode, [NULL[typecode]]) * size
+
+def _to_stored(value: int | None, typecode: str) -> int:
+    return NULL[typecode] if value is None else value
+
+def _from_stored(value: int, typecode: str) -> int | None:
+    return None if value == NULL[typecode] else value
+
+class TileGrid:
+    """
+    Struct-of-arrays storage of the map: each tile attribute lives in its own flat typed array indexed by `y * width + x`.
+    Optional attributes (i.e. `None` in TileInfo) are stored as the NULL value of the array typecode.
+    Tiles missing from the map data are flagged as 0 in `present`.
+    A grid may only cover a window of the map, whose top left tile is `x0, y0`: indexes are relative to it.
+    """
+    # Attribute name and array typecode of each stored tile field
+    FIELDS = (
+        ('alt', 'i'),
+        ('fertility', 'h'),
+        ('forest', 'i'),
+        ('res', 'i'),
+        ('res_amount', 'i'),
+        ('region', 'i'),
+        ('area', 'i'),
+        ('type', 'h'),
+    )
+
+    def __init__(self, width: int = MAX_WIDTH, height: int = MAX_HEIGHT, x0: int = 0, y0: int = 0):
+        self.width = width
+        self.height = height
+        self.x0 = x0
+        self.y0 = y0
+        self.size = width * height
+        self.present = bytearray(self.size)
+        self.alt = _null_array('i', self.size)
+        self.fertility = _null_array('h', self.size)
+        self.forest = _null_array('i', self.size)
+        self.res = _null_array('i', self.size)
+        self.res_amount = _null_array('i', self.size)
+        self.region = _null_array('i', self.size)
+        self.area = _null_array('i', self.size)
+        self.type = _null_array('h', self.size)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        width: int,
+        height: int,
+        present: Sequence[int],
+        x0: int = 0,
+        y0: int = 0,
+        **fields: Sequence[int],
+    ) -> TileGrid:
+        # Grid over already filled arrays (e.g. memory mapped ones), one keyword argument per name of FIELDS
+        grid = cls.__new__(cls)
+        grid.width = width
+        grid.height = height
+        grid.x0 = x0
+        grid.y0 = y0
+        grid.size = width * height
+        grid.present = present
+        for name, _ in cls.FIELDS:
+            setattr(grid, name, fields[name])
+        return grid
+
+    @classmethod
+    def from_tiles(
+        cls,
+        tiles: Iterable[TileInfo],
+        width: int = MAX_WIDTH,
+        height: int = MAX_HEIGHT,
+        x0: int = 0,
+        y0: int = 0,
+    ) -> TileGrid:
+        grid = cls(width, height, x0, y0)
+        for t in tiles:
+            grid.put_tile(t)
+        return grid
+
+    def __len__(self) -> int:
+        return self.present.count(1)
+
+    def __iter__(self) -> Iterator[TileInfo]:
+        i = self.present.find(1)
+        while i != -1:
+            yield self.tile_at(i)
+            i = self.present.find(1, i + 1)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.present) + sum(getattr(self, name).itemsize * self.size for name, _ in self.FIELDS)
+
+    def index(self, x: int, y: int) -> int:
+        return (y - self.y0) * self.width + x - self.x0
+
+    def coords(self, i: int) -> tuple[int, int]:
+        y, x = divmod(i, self.width)
+        return self.x0 + x, self.y0 + y
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return self.x0 <= x < self.x0 + self.width and self.y0 <= y < self.y0 + self.height
+
+    def has(self, x: int, y: int) -> bool:
+        return self.in_bounds(x, y) and self.present[self.index(x, y)] == 1
+
+    def put(
+        self,
+        x: int,
+        y: int,
+        alt: int | None,
+        fertility: int | None,
+        forest: int | None,
+        res: int | None,
+        res_amount: int | None,
+        region: int | None,
+        area: int | None,
+        type: int | None,
+    ) -> None:
+        i = self.index(x, y)
+        self.present[i] = 1
+        self.alt[i] = _to_stored(alt, 'i')
+        self.fertility[i] = _to_stored(fertility, 'h')
+        self.forest[i] = _to_stored(forest, 'i')
+        self.res[i] = _to_stored(res, 'i')
+        self.res_amount[i] = _to_stored(res_amount, 'i')
+        self.region[i] = _to_stored(region, 'i')
+        self.area[i] = _to_stored(area, 'i')
+        self.type[i] = _to_stored(type, 'h')
+
+    def put_tile(self, t: TileInfo) -> None:
+        self.put(t.x, t.y, t.alt, t.fertility, t.forest, t.res, t.res_amount, t.region, t.area, t.type)
+
+    def tile_at(self, i: int) -> TileInfo | None:
+        if not self.present[i]:
+            return None
+        x, y = self.coords(i)
+        return TileInfo(
+            x=x,
+            y=y,
+            alt=_from_stored(self.alt[i], 'i'),
+            fertility=_from_stored(self.fertility[i], 'h'),
+            forest=_from_stored(self.forest[i], 'i'),
+            res=_from_stored(self.res[i], 'i'),
+            res_amount=_from_stored(self.res_amount[i], 'i'),
+            region=_from_stored(self.region[i], 'i'),
+            area=_from_stored(self.area[i], 'i'),
+            type=_from_stored(self.type[i], 'h'),
+        )
+
+    def tile(self, x: int, y: int) -> TileInfo | None:
+        if not self.in_bounds(x, y):
+            return None
+        return self.tile_at(self.index(x, y))
+
+    def window(self, min_x: int, max_x: int, min_y: int, max_y: int) -> Iterator[TileInfo]:
+        # Bounds are inclusive and clipped to the grid
+        for y in range(max(min_y, self.y0), min(max_y, self.y0 + self.height - 1) + 1):
+            for x in range(max(min_x, self.x0), min(max_x, self.x0 + self.width - 1) + 1):
+                t = self.tile(x, y)
+                if t is not None:
+                    yield t
@@ -0,0 +1,96 @@
+from __future__ import annotations
+from array import array
+from lib.graph import EDGE_WEIGHTS
+from lib.grid import TileGrid
+from lib.search import UNREACHABLE, DistanceField, propagate
+from lib.types import FerryInfo, unhash_coords
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+if TYPE_CHECKING:
+    from lib.map import TileMap
+
+# Ferry edge: ferry tile and landing, as grid indexes
+FerryEdge = tuple[int, int]
+# Saved distances are either float sums (heap engine) or exact thousandths (dial engine, see lib.dial): they are compared
+# within this tolerance, far below the smallest weight
+_TOLERANCE = 1e-6
+
+def ferry_edges(grid: TileGrid, ferries: Iterable[FerryInfo]) -> set[FerryEdge]:
+    # Same edges as the graph of a TileMap built with these ferries: tiles missing from the map are ignored, and a ferry
+    # tile listed twice only keeps its last landings
+    landings = {}
+    for f in ferries:
+        if grid.has(f.x, f.y):
+            landings[grid.index(f.x, f.y)] = [grid.index(x, y) for x, y in map(unhash_coords, f.ferries) if grid.has(x, y)]
+    return {(f, l) for f, ls in landings.items() for l in ls}
+
+def diff_ferries(grid: TileGrid, old: Iterable[FerryInfo], new: Iterable[FerryInfo]) -> tuple[set[FerryEdge], set[FerryEdge]]:
+    # Added and removed ferry edges
+    old_edges, new_edges = ferry_edges(grid, old), ferry_edges(grid, new)
+    return new_edges - old_edges, old_edges - new_edges
+
+def is_affected(field: DistanceField, added: Iterable[FerryEdge], removed: Iterable[FerryEdge]) -> bool:
+    """
+    Whether the ferry changes can change the distances of `field`: an added ferry shortens the distance to its landing,
+    a removed one may be on the shortest path to its landing if the landing is exactly as far as the ferry tile.
+    """
+    return (
+        any(f in field and field[f] < field[l] - _TOLERANCE for f, l in added)
+        or any(f in field and abs(field[f] - field[l]) <= _TOLERANCE for f, l in removed)
+    )
+
+def _tight_subtree(tile_map: TileMap, dist: Sequence[float], roots: Iterable[int], seeds: set[int]) -> set[int]:
+    # Tiles reachable from `roots` through edges lying on a shortest path (dist[u] + w == dist[n], within the tolerance):
+    # every tile whose shortest paths may go through one of the roots
+    offsets, targets, codes = tile_map.graph.offsets, tile_map.graph.targets, tile_map.graph.codes
+    subtree = set()
+    stack = [r for r in roots if r not in seeds]
+    while len(stack) > 0:
+        v = stack.pop()
+        if v in subtree:
+            continue
+        subtree.add(v)
+        dist_v = dist[v]
+        for e in range(offsets[v], offsets[v + 1]):
+            n = targets[e]
+            if n not in subtree and n not in seeds and abs(dist_v + EDGE_WEIGHTS[codes[e]] - dist[n]) <= _TOLERANCE:
+                stack.append(n)
+    return subtree
+
+def repair(
+    tile_map: TileMap,
+    field: DistanceField,
+    seeds: Sequence[tuple[int, float]],
+    added: Iterable[FerryEdge],
+    removed: Iterable[FerryEdge],
+    max_cost: float | None = None,
+) -> int:
+    """
+    Updates in place `field`, computed from `seeds` (see TileMap.sources) before the ferry changes, to the graph of
+    `tile_map` which includes them (a float DistanceField, e.g. read back from a saved file, as the fixed-point fields of
+    lib.dial only expose a copy of their distances). `max_cost` must be the cutoff the field was computed with, if any.
+    Tiles whose shortest paths may go through a removed ferry are reset, then reached again from their unaffected
+    neighbours, together with the landings of the added ferries, by decrease-key propagation.
+    It returns the number of reset tiles.
+    """
+    dist = field.dist
+    seed_tiles = {s for s, _ in seeds}
+    roots = (l for f, l in removed if f in field and abs(dist[f] - dist[l]) <= _TOLERANCE)
+    affected = _tight_subtree(tile_map, dist, roots, seed_tiles)
+    for v in affected:
+        dist[v] = UNREACHABLE
+
+    boundary = []
+    for v in affected:
+        best = min((dist[u] + w for u, w in tile_map.in_moves(v) if dist[u] != UNREACHABLE), default=UNREACHABLE)
+        if best != UNREACHABLE:
+            boundary.append((v, best))
+    boundary += [(l, dist[f]) for f, l in added if dist[f] != UNREACHABLE]
+    reached = propagate(tile_map.graph, dist, boundary, max_cost=max_cost)
+
+    # Settling order of the updated field
+    settled = [i for i in field.settled if dist[i] != UNREACHABLE]
+    settled += [i for i in reached if i not in affected]
+    settled.sort(key=dist.__getitem__)
+    field.settled = array('i', settled)
+    return len(affected)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+import json
+from lib.dial import SCALE
+from lib.search import cost_bound
+from lib.types import MAX_HEIGHT, MAX_WIDTH, TileDistance
+import math
+import struct
+import sys
+from typing import Sequence
+import zlib
+
+MAGIC = b'MRIX'
+VERSION = 1
+# Side of the blocks of map tiles the towns are indexed by
+BLOCK_SIZE = 4
+# magic, version, length of the JSON header
+_PREAMBLE = struct.Struct('<4sII')
+
+def _blocks_per_row(block_size: int) -> int:
+    return -(-MAX_WIDTH // block_size)
+
+def block_minima(distances: Sequence[TileDistance], block_size: int = BLOCK_SIZE, max_cost: float | None = None) -> tuple[array, array]:
+    # Blocks reached by the distances of a town (within `max_cost`) and the lowest cost of each, as compact arrays: cheap
+    # to send back from a worker process (see lib.parallel.parallel_distances)
+    row = _blocks_per_row(block_size)
+    minima: dict[int, float] = {}
+    bound = cost_bound(max_cost)
+    for d in distances:
+        if d.distance >= bound:
+            continue
+        block = d.y // block_size * row + d.x // block_size
+        if d.distance < minima.get(block, math.inf):
+            minima[block] = d.distance
+    return array('I', minima.keys()), array('d', minima.values())
+
+class ReachabilityIndex:
+    """
+    Inverted reachability index: the towns reaching each block of `block_size` x `block_size` map tiles within
+    `max_cost`, each one with the lowest cost among the tiles of the block. Entries (town, cost) are stored flat, those of
+    block b being `offsets[b]` to `offsets[b + 1]`, sorted by cost. Costs are exact, as uint32 thousandths (see
+    lib.dial.SCALE).
+    """
+    def __init__(self, towns: list[str], block_size: int, max_cost: float | None, offsets: array, town_ids: array, costs: array):
+        self.towns = towns
+        self.block_size = block_size
+        self.max_cost = max_cost
+        self.offsets = offsets
+        self.town_ids = town_ids
+        self.costs = costs
+
+    def __len__(self) -> int:
+        return len(self.costs)
+
+    def reaching(self, x: int, y: int, max_cost: float | None = None) -> list[tuple[str, float]]:
+        """
+        Towns reaching tile x, y within `max_cost` (the one of the index by default) with their cost, by increasing
+        cost. With blocks of more than one tile, these are the towns reaching any tile of its block and their lowest cost
+        within the block: every town reaching the tile is listed, with a cost which is a lower bound of its own.
+        """
+        if not (0 <= x < MAX_WIDTH and 0 <= y < MAX_HEIGHT):
+            return []
+        block = y // self.block_size * _blocks_per_row(self.block_size) + x // self.block_size
+        start, end = self.offsets[block], self.offsets[block + 1]
+        if max_cost is not None:
+            end = bisect_right(self.costs, round(max_cost * SCALE), start, end)
+        return [(self.towns[self.town_ids[e]], self.costs[e] / SCALE) for e in range(start, end)]
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            'towns': self.towns,
+            'block_size': self.block_size,
+            'max_cost': self.max_cost,
+        }).encode('utf8')
+        arrays = [self.offsets, self.town_ids, self.costs]
+        if sys.byteorder == 'big':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        payload = b''.join(a.tobytes() for a in arrays)
+        return _PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + zlib.compress(payload, 9)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> ReachabilityIndex:
+        magic, version, header_length = _PREAMBLE.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a reachability index, or written by another version')
+        header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        payload = zlib.decompress(data[_PREAMBLE.size + header_length:])
+        blocks = _blocks_per_row(header['block_size']) * -(-MAX_HEIGHT // header['block_size'])
+        offsets = array('I', payload[:4 * (blocks + 1)])
+        entries = offsets[-1]
+        town_ids = array('H', payload[4 * (blocks + 1):4 * (blocks + 1) + 2 * entries])
+        costs = array('I', payload[4 * (blocks + 1) + 2 * entries:])
+        if sys.byteorder == 'big':
+            for a in (offsets, town_ids, costs):
+                a.byteswap()
+        return cls(header['towns'], header['block_size'], header['max_cost'], offsets, town_ids, costs)
+
+class IndexBuilder:
+    """
+    Collects the block minima of each town (see block_minima) as the batch goes, in any order, then sorts them into a
+    ReachabilityIndex.
+    """
+    def __init__(self, block_size: int = BLOCK_SIZE, max_cost: float | None = None):
+        self.block_size = block_size
+        self.max_cost = max_cost
+        self._towns: list[str] = []
+        self._blocks = array('I')
+        self._town_ids = array('H')
+        self._costs = array('d')
+
+    def add(self, town: str, minima: tuple[array, array]) -> None:
+        blocks, costs = minima
+        self._blocks += blocks
+        self._costs += costs
+        self._town_ids += array('H', [len(self._towns)]) * len(blocks)
+        self._towns.append(town)
+
+    def build(self) -> ReachabilityIndex:
+        # Entries sorted by block, then cost, then town, as single integers
+        keys = sorted(b << 48 | round(c * SCALE) << 16 | t for b, c, t in zip(self._blocks, self._costs, self._town_ids))
+        counts = array('I', bytes(4 * _blocks_per_row(self.block_size) * -(-MAX_HEIGHT // self.block_size)))
+        for b in self._blocks:
+            counts[b] += 1
+        offsets = array('I', accumulate(counts, initial=0))
+        town_ids = array('H', (k & 0xFFFF for k in keys))
+        costs = array('I', (k >> 16 & 0xFFFFFFFF for k in keys))
+        return ReachabilityIndex(list(self._towns), self.block_size, self.max_cost, offsets, town_ids, costs)
+
+def save_index(file_name: str, index: ReachabilityIndex) -> None:
+    with open(file_name, 'wb') as fd:
+        fd.write(index.to_bytes())
+
+def load_index(file_name: str) -> ReachabilityIndex:
+    with open(file_name, 'rb') as fd:
+        return ReachabilityIndex.from_bytes(fd.read())
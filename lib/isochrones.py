@@ -0,0 +1,208 @@
+from __future__ import annotations
+from lib.search import cost_bound
+from lib.types import TileDistance
+from typing import Any, Iterable, Sequence
+
+# Tiles of a column, as (x, first y, last y), like lib.coverage.circle_spans
+Span = tuple[int, int, int]
+# Corners of a polygon ring, closed (the first one is repeated last) as in GeoJSON
+Ring = list[tuple[float, float]]
+
+# Shapes isochrones can be exported as
+SHAPES = ('spans', 'polygons')
+
+class _Region:
+    """
+    Tiles within a threshold, as a column-major bitmap over their bounding box with a border of one empty tile on every
+    side, so that neighbours never need a bounds check.
+    """
+    def __init__(self, distances: Sequence[TileDistance], threshold: float):
+        bound = cost_bound(threshold)
+        within = [d for d in distances if d.distance < bound]
+        if not within:
+            self.x0, self.y0, self.height, self.bitmap = 0, 0, 0, bytearray()
+            return
+        # Origin of the bitmap, border included
+        self.x0 = min(d.x for d in within) - 1
+        self.y0 = min(d.y for d in within) - 1
+        self.height = max(d.y for d in within) - self.y0 + 2
+        width = max(d.x for d in within) - self.x0 + 2
+        self.bitmap = bytearray(width * self.height)
+        for d in within:
+            self.bitmap[(d.x - self.x0) * self.height + d.y - self.y0] = 1
+
+    def runs(self) -> Iterable[tuple[int, int, int]]:
+        # (column, first row, last row) of each run of tiles, in bitmap coordinates
+        bitmap, height = self.bitmap, self.height
+        start = bitmap.find(1)
+        while start != -1:
+            # The bottom border of each column ends the runs
+            end = bitmap.find(0, start)
+            column, row = divmod(start, height)
+            yield column, row, end - 1 - column * height
+            start = bitmap.find(1, end)
+
+def spans(distances: Sequence[TileDistance], threshold: float) -> list[Span]:
+    # Tiles within `threshold`, run-length encoded along each column, sorted by x then y
+    region = _Region(distances, threshold)
+    return [(region.x0 + c, region.y0 + first, region.y0 + last) for c, first, last in region.runs()]
+
+def _sign(v: int) -> int:
+    return (v > 0) - (v < 0)
+
+def _boundary(region: _Region) -> dict[tuple[int, int], list[tuple[int, int]]]:
+    """
+    Edges of the outline of the tiles, between tile corners (tile x, y spans x to x + 1 and y to y + 1), by start corner.
+    Edges run with the tiles on their right in map coordinates (y growing downwards): outer rings run clockwise on the
+    map, holes anticlockwise. Vertical edges are merged along each run; horizontal ones are one tile long.
+    """
+    bitmap, height, x0, y0 = region.bitmap, region.height, region.x0, region.y0
+    edges: dict[tuple[int, int], list[tuple[int, int]]] = {}
+    def add(a: tuple[int, int], b: tuple[int, int]) -> None:
+        edges.setdefault(a, []).append(b)
+    for c, first, last in region.runs():
+        x = x0 + c
+        add((x, y0 + first), (x + 1, y0 + first))
+        add((x + 1, y0 + last + 1), (x, y0 + last + 1))
+        # Sides facing empty tiles of the neighbouring columns, as runs of zeros
+        for side, offset in ((x + 1, height), (x, -height)):
+            column = c * height + offset
+            row = bitmap.find(0, column + first, column + last + 1)
+            while row != -1:
+                end = bitmap.find(1, row, column + last + 1)
+                end = column + last + 1 if end == -1 else end
+                top, bottom = y0 + row - column, y0 + end - column
+                if side == x + 1:
+                    add((side, top), (side, bottom))
+                else:
+                    add((side, bottom), (side, top))
+                row = bitmap.find(0, end, column + last + 1) if end < column + last + 1 else -1
+    return edges
+
+def _trace(edges: dict[tuple[int, int], list[tuple[int, int]]]) -> list[list[tuple[int, int]]]:
+    # Rings of corners (not closed, collinear corners dropped) out of the edges. Where two regions touch by a corner, the
+    # right turn is taken, so that each ring goes around 4-connected tiles only.
+    def successor(a: tuple[int, int], b: tuple[int, int]) -> tuple[int, int]:
+        dx, dy = _sign(b[0] - a[0]), _sign(b[1] - a[1])
+        options = edges[b]
+        if len(options) == 1:
+            return options[0]
+        for turn in ((-dy, dx), (dx, dy), (dy, -dx)):
+            for c in options:
+                if (_sign(c[0] - b[0]), _sign(c[1] - b[1])) == turn:
+                    return c
+        raise AssertionError(f'No edge leaving {b}')
+
+    visited: set[tuple[tuple[int, int], tuple[int, int]]] = set()
+    rings = []
+    for start, ends in edges.items():
+        for end in ends:
+            if (start, end) in visited:
+                continue
+            ring = []
+            a, b = start, end
+            while (a, b) not in visited:
+                visited.add((a, b))
+                ring.append(a)
+                a, b = b, successor(a, b)
+            rings.append(_drop_collinear(ring))
+    return rings
+
+def _drop_collinear(ring: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    n = len(ring)
+    kept = []
+    for k, (x, y) in enumerate(ring):
+        (px, py), (nx, ny) = ring[k - 1], ring[(k + 1) % n]
+        if (_sign(x - px), _sign(y - py)) != (_sign(nx - x), _sign(ny - y)):
+            kept.append((x, y))
+    return kept
+
+def _area(ring: Sequence[tuple[float, float]]) -> float:
+    # Shoelace formula: positive for the outer rings of _boundary, negative for the holes
+    return sum(x * ny - nx * y for (x, y), (nx, ny) in zip(ring, ring[1:] + ring[:1])) / 2
+
+def _contains(ring: Sequence[tuple[float, float]], px: float, py: float) -> bool:
+    # Ray casting, `px, py` never lying on an edge (centre of a tile)
+    inside = False
+    for (x, y), (nx, ny) in zip(ring, ring[1:] + ring[:1]):
+        if (y > py) != (ny > py) and px < x + (py - y) * (nx - x) / (ny - y):
+            inside = not inside
+    return inside
+
+def _simplify(ring: list[tuple[int, int]], tolerance: float) -> list[tuple[int, int]]:
+    # Douglas-Peucker on a closed ring, split at its farthest corner from the first one. Rings it would collapse are kept.
+    def distance(p: tuple[int, int], a: tuple[int, int], b: tuple[int, int]) -> float:
+        (x, y), (ax, ay), (bx, by) = p, a, b
+        length = ((bx - ax) ** 2 + (by - ay) ** 2) ** 0.5
+        if length == 0:
+            return ((x - ax) ** 2 + (y - ay) ** 2) ** 0.5
+        return abs((bx - ax) * (ay - y) - (ax - x) * (by - ay)) / length
+
+    def chain(points: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        # Simplified chain, without its last point
+        stack = [(0, len(points) - 1)]
+        marks = bytearray(len(points))
+        marks[0] = 1
+        while stack:
+            first, last = stack.pop()
+            far, worst = -1, tolerance
+            for k in range(first + 1, last):
+                d = distance(points[k], points[first], points[last])
+                if d > worst:
+                    far, worst = k, d
+            if far != -1:
+                marks[far] = 1
+                stack += [(first, far), (far, last)]
+        return [p for p, m in zip(points, marks) if m]
+
+    if tolerance <= 0 or len(ring) <= 4:
+        return ring
+    first = ring[0]
+    split = max(range(len(ring)), key=lambda k: (ring[k][0] - first[0]) ** 2 + (ring[k][1] - first[1]) ** 2)
+    simplified = chain(ring[:split + 1]) + chain(ring[split:] + ring[:1])
+    return simplified if len(simplified) >= 3 and _area(simplified) != 0 else ring
+
+def polygons(distances: Sequence[TileDistance], threshold: float, tolerance: float = 0) -> list[list[Ring]]:
+    """
+    Outlines of the tiles within `threshold`, as polygons of tile corners (tile x, y covering the square from x, y to
+    x + 1, y + 1): each polygon is its outer ring followed by its holes, every ring being closed as in GeoJSON. Outer
+    rings are anticlockwise with y growing upwards (clockwise on the map), holes the other way round. Tiles touching by a
+    corner only belong to separate polygons. Corners within `tolerance` tiles of a simplified outline are dropped
+    (Douglas-Peucker), only the collinear ones by default, which keeps the outlines exact.
+    """
+    region = _Region(distances, threshold)
+    rings = _trace(_boundary(region))
+    outers = [r for r in rings if _area(r) > 0]
+    outers.sort(key=_area)
+    shapes: list[list[list[tuple[int, int]]]] = [[r] for r in outers]
+    for hole in (r for r in rings if _area(r) < 0):
+        # Centre of the empty tile on the left of the first edge of the hole
+        (ax, ay), (bx, by) = hole[0], hole[1]
+        dx, dy = _sign(bx - ax), _sign(by - ay)
+        px, py = ax + dx * 0.5 + dy * 0.5, ay + dy * 0.5 - dx * 0.5
+        # Smallest outer ring around it
+        owner = next((s for s in shapes if _contains(s[0], px, py)), None)
+        if owner is not None:
+            owner.append(hole)
+    result = []
+    for shape in shapes:
+        rings = [_simplify(r, tolerance) for r in shape]
+        result.append([[*r, r[0]] for r in rings])
+    return result
+
+def isochrones(
+    distances: Sequence[TileDistance],
+    thresholds: Sequence[float],
+    shapes: Sequence[str] = SHAPES,
+    tolerance: float = 0,
+) -> list[dict[str, Any]]:
+    # Tiles within each of `thresholds`, as the `shapes` (among SHAPES) of spans and polygons, ready to be saved as JSON
+    result = []
+    for threshold in thresholds:
+        isochrone: dict[str, Any] = {'cost': threshold}
+        if 'spans' in shapes:
+            isochrone['spans'] = spans(distances, threshold)
+        if 'polygons' in shapes:
+            isochrone['polygons'] = polygons(distances, threshold, tolerance)
+        result.append(isochrone)
+    return result
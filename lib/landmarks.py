@@ -0,0 +1,127 @@
+from __future__ import annotations
+from array import array
+import json
+from lib.search import DistanceField
+import mmap
+import os.path
+import struct
+from typing import TYPE_CHECKING, Callable, Iterable, Sequence
+
+if TYPE_CHECKING:
+    from lib.map import TileMap
+
+MAGIC = b'MLMK'
+VERSION = 2
+# Fixed-point distances: thousandths of cost. Every move weight is a whole number of thousandths, so they are exact.
+SCALE = 1000
+UNREACHABLE = 0xFFFFFFFF
+# magic, version, length of the JSON header
+_PREAMBLE = struct.Struct('<4sII')
+# The fields start at a multiple of it, like the arrays of lib.cache, so that they can be cast in place
+_ALIGNMENT = 64
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+def _to_fixed_point(dist: DistanceField, size: int) -> array:
+    fixed = array('I', [UNREACHABLE]) * size
+    for i, d in dist.items():
+        fixed[i] = round(d * SCALE)
+    return fixed
+
+class Landmarks:
+    """
+    ALT (A*, Landmarks, Triangle inequality) preprocessing: the distance fields from K landmark tiles.
+    For any landmark L, d(L, t) <= d(L, i) + d(i, t), hence d(L, t) - d(L, i) is a lower bound of the cost from i to t.
+    Fields are stored as fixed-point uint32 (see SCALE), one array per landmark indexed like the grid.
+    """
+    def __init__(self, width: int, height: int, coords: Sequence[tuple[int, int]], fields: Sequence[Sequence[int]]):
+        self.width = width
+        self.height = height
+        self.coords = list(coords)
+        self.fields = list(fields)
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    @classmethod
+    def compute(cls, tile_map: TileMap, coords: Iterable[tuple[int, int]]) -> Landmarks:
+        # One full search per landmark
+        grid = tile_map.grid
+        coords = list(coords)
+        fields = [_to_fixed_point(tile_map.dijkstra(x, y), grid.size) for x, y in coords]
+        return cls(grid.width, grid.height, coords, fields)
+
+    @classmethod
+    def farthest(cls, tile_map: TileMap, k: int, start: tuple[int, int], candidates: Sequence[tuple[int, int]] = ()) -> Landmarks:
+        """
+        Picks `k` landmarks greedily, each one being the tile (or the candidate, e.g. the towns, if any) farthest from the
+        landmarks already picked. The first one is the farthest from `start`.
+        """
+        grid = tile_map.grid
+        coords: list[tuple[int, int]] = []
+        fields: list[array] = []
+        # Distance of each tile from the closest landmark (from start, until the first one is picked)
+        closest = _to_fixed_point(tile_map.dijkstra(*start), grid.size)
+        for _ in range(k):
+            if candidates:
+                distances = {i: closest[i] for i in (grid.index(x, y) for x, y in candidates) if closest[i] != UNREACHABLE}
+                landmark = max(distances, key=distances.__getitem__, default=None)
+            else:
+                farthest = max((d for d in closest if d != UNREACHABLE), default=None)
+                landmark = closest.index(farthest) if farthest is not None else None
+            # Every reachable tile is already a landmark
+            if landmark is None or closest[landmark] == 0 and fields:
+                break
+            coords.append(grid.coords(landmark))
+            fields.append(_to_fixed_point(tile_map.dijkstra(*coords[-1]), grid.size))
+            closest = array('I', map(min, closest, fields[-1])) if len(fields) > 1 else array('I', fields[-1])
+        return cls(grid.width, grid.height, coords, fields)
+
+    def heuristic(self, target: int) -> Callable[[int], float]:
+        # Lower bound of the cost from any tile to target. If a landmark reaches a tile but not target, then target is not
+        # reachable from that tile at all.
+        bounds = [(field, field[target]) for field in self.fields]
+        def heuristic(i: int) -> float:
+            best = 0
+            for field, to_target in bounds:
+                to_i = field[i]
+                if to_i == UNREACHABLE:
+                    continue
+                if to_target == UNREACHABLE:
+                    return float('inf')
+                if to_target - to_i > best:
+                    best = to_target - to_i
+            # Slightly shrunk so that float rounding can never make it overestimate
+            return best / SCALE * (1 - 1e-9)
+        return heuristic
+
+    def save(self, file_name: str, key: str = '') -> None:
+        # `key` identifies the costed map the fields have been computed on (see lib.cache.cache_key)
+        header = json.dumps({'key': key, 'width': self.width, 'height': self.height, 'coords': self.coords}).encode('utf8')
+        with open(file_name, 'wb') as fd:
+            fd.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            fd.write(header)
+            fd.seek(_aligned(_PREAMBLE.size + len(header)))
+            for field in self.fields:
+                fd.write(field)
+
+    @classmethod
+    def load(cls, file_name: str, key: str = '') -> Landmarks | None:
+        """
+        Memory maps the landmarks saved in `file_name` (in native byte order, like lib.cache), or returns None if the file is
+        missing, has been written by another version or for another `key`.
+        """
+        if not os.path.isfile(file_name):
+            return None
+        with open(file_name, 'rb') as fd:
+            magic, version, header_length = _PREAMBLE.unpack(fd.read(_PREAMBLE.size))
+            if magic != MAGIC or version != VERSION:
+                return None
+            header = json.loads(fd.read(header_length))
+            if header['key'] != key:
+                return None
+            buffer = memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))[_aligned(_PREAMBLE.size + header_length):]
+        size = header['width'] * header['height']
+        fields = [buffer[k * 4 * size:(k + 1) * 4 * size].cast('I') for k in range(len(header['coords']))]
+        return cls(header['width'], header['height'], [tuple(c) for c in header['coords']], fields)
@@ -1,89 +1,351 @@
 from __future__ import annotations
-import heapq
-from lib.types import FerryInfo, TileDistance, TileWeight, hash_coords, MAX_HEIGHT
-from lib.utils import compute_weight, is_crossable_if_source_is_town, size_logger
-import sys
-from typing import Sequence
+from array import array
+from lib.chunks import load_window
+from lib.components import ComponentIndex
+from lib.costs import compute_weight_planes
+from lib.dial import dial
+from lib.graph import TileGraph, compile_graph
+from lib.grid import NULL, TileGrid
+from lib.landmarks import Landmarks
+from lib.matrix import TownMatrix, town_costs
+from lib.metrics import METRICS, nbytes
+from lib.partition import nearest_towns
+from lib.profiles import MIXED, PROFILES, profile_planes
+from lib.routes import board_from_town
+from lib.search import DistanceField, astar, dijkstra, to_tile_distances
+from lib.types import DIRECTIONS, FerryInfo, Route, TileDistance, TileInfo, unhash_coords
+from lib.utils import DIAGONAL_LENGTH, STRAIGHT_LENGTH, WEIGHTS, is_crossable_if_source_is_town
+import math
+from typing import Callable, Iterable, Iterator, Sequence
+
+# Search engines sharing the signature of lib.search.dijkstra: binary heap on float costs, or bucket queue on exact
+# fixed-point costs
+SEARCH_ENGINES = {
+    'heap': dijkstra,
+    'dial': dial,
+}
+
+def tile_radius(max_cost: float) -> int:
+    # Every move costs at least the smallest weight and goes one tile away at most: tiles within `max_cost` of a source
+    # are within this many tiles of it, ferries aside
+    return math.floor(max_cost / min(w for w in WEIGHTS if w is not None))
+
+# Searches reaching less than 1/_SPARSE_RATIO of the map only allocate distances for the tiles they reach
+_SPARSE_RATIO = 16
 
 class TileMap:
-    def __init__(self, tiles: Sequence[TileWeight], ferries: Sequence[FerryInfo] = ()):
-        self._map = {
-            t.key: t for t in tiles
-        }
+    def __init__(self, tiles: TileGrid | Iterable[TileInfo], ferries: Sequence[FerryInfo] = ()):
+        self._grid = tiles if isinstance(tiles, TileGrid) else TileGrid.from_tiles(tiles)
+        # One plane of weight codes per direction (see lib.utils.WEIGHTS), indexed like the grid, set by compute_costs.
+        # Code 0 means the move is not crossable or does not exist.
+        self._weights: Sequence[Sequence[int]] = ()
+        # Index offset of the neighbour in each direction
+        self._deltas = tuple(dy * self._grid.width + dx for dx, dy in DIRECTIONS)
+        self._ferries: dict[int, tuple[int, ...]] = {}
         for f in ferries:
-            self._map[f.key].ferries = f.ferries
-        size_logger('Map loaded. Total size in RAM: {size} GB', self._map, unit='GB')
-        # print(f'Map loaded. Total size in RAM: {asizeof(self._map)/1024/1024/1024} GB')
+            if self._grid.has(f.x, f.y):
+                landings = (unhash_coords(k) for k in f.ferries)
+                self._ferries[self._grid.index(f.x, f.y)] = tuple(self._grid.index(x, y) for x, y in landings if self._grid.has(x, y))
+        self._graph: TileGraph | None = None
+        self._components: ComponentIndex | None = None
+        self._engine = SEARCH_ENGINES['heap']
+        # Ferry tiles of each landing, built on demand by in_moves
+        self._landing_ferries: dict[int, list[int]] | None = None
+        self._landmarks: Landmarks | None = None
+        # Graphs of the other profiles than the mixed one, compiled on demand by profile_graph
+        self._profile_graphs: dict[str, TileGraph] = {}
+        METRICS.progress(f'Map loaded: {nbytes(self._grid) / 1024 / 1024:.0f} MB')
+
+    @classmethod
+    def from_compiled(
+        cls,
+        grid: TileGrid,
+        weights: Sequence[Sequence[int]],
+        ferries: dict[int, tuple[int, ...]],
+        graph: TileGraph,
+        components: ComponentIndex,
+    ) -> TileMap:
+        # Map whose costs have already been computed and compiled (e.g. restored by lib.cache)
+        tile_map = cls(grid)
+        tile_map._weights = weights
+        tile_map._ferries = ferries
+        tile_map._graph = graph
+        tile_map._components = components
+        return tile_map
+
+    @classmethod
+    def from_chunks(
+        cls,
+        path: str,
+        min_x: int,
+        max_x: int,
+        min_y: int,
+        max_y: int,
+        ferries: Sequence[FerryInfo] = (),
+    ) -> TileMap:
+        """
+        Map of the window (inclusive bounds) only, read out of a chunk file (see lib.chunks). Moves leaving the window do
+        not exist, and only the ferries whose tile and landings are within the window are kept.
+        """
+        return cls(load_window(path, min_x, max_x, min_y, max_y), ferries=ferries)
+
+    @classmethod
+    def around(cls, path: str, x: int, y: int, max_cost: float, ferries: Sequence[FerryInfo] = ()) -> TileMap:
+        # Map of the window holding every tile within `max_cost` of x, y, except the ones only reachable through ferries
+        # leaving the window. The tiles boarded from the town (see sources) start one tile away.
+        radius = tile_radius(max_cost) + 1
+        return cls.from_chunks(path, x - radius, x + radius, y - radius, y + radius, ferries=ferries)
+
+    @property
+    def grid(self) -> TileGrid:
+        return self._grid
+
+    @property
+    def weights(self) -> Sequence[Sequence[int]]:
+        return self._weights
+
+    @property
+    def ferries(self) -> dict[int, tuple[int, ...]]:
+        # Landings of each ferry tile, as grid indexes
+        return self._ferries
+
+    def tile(self, x: int, y: int) -> TileInfo | None:
+        return self._grid.tile(x, y)
+
+    def _neighbour(self, i: int, direction: int) -> int | None:
+        x, y = self._grid.coords(i)
+        dx, dy = DIRECTIONS[direction]
+        if not self._grid.has(x + dx, y + dy):
+            return None
+        return self._grid.index(x + dx, y + dy)
+
+    def weight(self, x: int, y: int, direction: int) -> float | None:
+        return WEIGHTS[self._weights[direction][self._grid.index(x, y)]]
+
+    def in_moves(self, i: int) -> Iterator[tuple[int, float]]:
+        # Reverse adjacency of tile i (tile and weight of each move ending in i), ferries included
+        for delta, plane in zip(self._deltas, self._weights):
+            u = i - delta
+            if 0 <= u < self._grid.size and plane[u] != 0:
+                yield u, WEIGHTS[plane[u]]
+        if self._landing_ferries is None:
+            self._landing_ferries = {}
+            for f, landings in self._ferries.items():
+                for l in landings:
+                    self._landing_ferries.setdefault(l, []).append(f)
+        for f in self._landing_ferries.get(i, ()):
+            yield f, 0
 
     def compute_costs(self) -> None:
-        print('Computing costs...')
-        for i, w in enumerate(self._map.values()):
-            try:
-                if w.up_key is not None:
-                    w.up_weight = compute_weight(self._map[w.key], self._map[w.up_key])
-                if w.left_key is not None:
-                    w.left_weight = compute_weight(self._map[w.key], self._map[w.left_key])
-                if w.right_key is not None:
-                    w.right_weight = compute_weight(self._map[w.key], self._map[w.right_key])
-                if w.down_key is not None:
-                    w.down_weight = compute_weight(self._map[w.key], self._map[w.down_key])
-                if w.up_left_key is not None:
-                    w.up_left_weight = compute_weight(self._map[w.key], self._map[w.up_left_key], neighbors=(self._map[w.up_key], self._map[w.left_key]))
-                if w.up_right_key is not None:
-                    w.up_right_weight = compute_weight(self._map[w.key], self._map[w.up_right_key], neighbors=(self._map[w.up_key], self._map[w.right_key]))
-                if w.down_left_key is not None:
-                    w.down_left_weight = compute_weight(self._map[w.key], self._map[w.down_left_key], neighbors=(self._map[w.down_key], self._map[w.left_key]))
-                if w.down_right_key is not None:
-                    w.down_right_weight = compute_weight(self._map[w.key], self._map[w.down_right_key], neighbors=(self._map[w.down_key], self._map[w.right_key]))
-            except:
-                print(f'Failed when processing weight {w.x} {w.y}')
-                raise
-            if i % MAX_HEIGHT == 0:
-                print(f'Processed {i // MAX_HEIGHT} rows of the map')
-        size_logger('Costs computed. Total size in RAM: {size} GB', self._map, unit='GB')
-        # print(f'Costs computed. Total size in RAM: {asizeof(self._map)/1024/1024/1024} GB')
-
-    def dijkstra(self, x: int, y: int) -> dict[int, float]:
-        print('Running djkstra...')
-        pq = []
-        dist: dict[int, float] = {}
-
-        source_key = hash_coords(x, y)
-
-        for k in self._map.keys():
-            if k == source_key:
-                dist[source_key] = 0
-                heapq.heappush(pq, (0, k))
-            else:
-                dist[k] = sys.float_info.max
-
-        while len(pq) > 0:
-            # define u ← vertex in Q with minimum dist[u]
-            _, u = heapq.heappop(pq)
-
-            # For each neighbor of u
-            for n in self._map[u].adjacency_keys:
-                distance_u_n = self._map[u].distance(n)
-                # If distance_u_n is None, u and n are not crossable, mostly because is a land -> sea move.
-                # But if we are starting from a town, we can go whenever we want (i.e. land -> sea is allowed as we are boarding).
-                # In such a case, the initial weight is 0 as we are starting from the sea tile with the boat.
-                if distance_u_n is None and u == source_key and is_crossable_if_source_is_town(self._map[u], self._map[n]):
-                    distance_u_n = 0
-
-                # distance_u_n is still None, u and n are not connected in the graph
-                if distance_u_n is None:
-                    continue
-
-                alt = dist[u] + distance_u_n
-                if alt < dist[n]:
-                    dist[n] = alt
-                    heapq.heappush(pq, (alt, n))
-        return dist
-    
-    def compute_distances(self, x: int, y: int) -> Sequence[TileDistance]:
-        dist = self.dijkstra(x, y)
-        return [
-            TileDistance(t.x, t.y, dist[t.key] if dist[t.key] != sys.float_info.max else None)
-                for t in self._map.values()
-                if dist[t.key] != sys.float_info.max
-            ]
+        METRICS.progress('Computing costs...')
+        with METRICS.phase('costs', tiles=len(self._grid)) as record:
+            self._weights = compute_weight_planes(self._grid)
+            record['bytes'] = nbytes(self._weights)
+        METRICS.progress(f'Costs computed: {record["bytes"] / 1024 / 1024:.0f} MB')
+        self.compile()
+        METRICS.progress('Indexing components...')
+        with METRICS.phase('components') as record:
+            self._components = ComponentIndex.build(self._grid, self._weights, self._ferries)
+            record['components'] = len(self._components)
+        METRICS.progress(f'{len(self._components)} components indexed')
+
+    def compile(self) -> None:
+        METRICS.progress('Compiling graph...')
+        with METRICS.phase('compile') as record:
+            self._graph = compile_graph(self._weights, self._deltas, self._ferries)
+            record.update(edges=self._graph.edges, bytes=self._graph.nbytes)
+        self._profile_graphs = {}
+        METRICS.progress(f'Graph compiled: {self._graph.edges} edges, {self._graph.nbytes / 1024 / 1024:.0f} MB')
+
+    @property
+    def graph(self) -> TileGraph:
+        if self._graph is None:
+            raise RuntimeError('Costs have not been computed yet, run compute_costs() first')
+        return self._graph
+
+    @property
+    def components(self) -> ComponentIndex:
+        if self._components is None:
+            raise RuntimeError('Costs have not been computed yet, run compute_costs() first')
+        return self._components
+
+    def _boarding_moves(self, source: int) -> Iterator[int]:
+        # If a move from u to n is not crossable, mostly because is a land -> sea move, it is not in the graph.
+        # But if we are starting from a town, we can go whenever we want (i.e. land -> sea is allowed as we are boarding).
+        # In such a case, the initial weight is 0 as we are starting from the sea tile with the boat.
+        for d, plane in enumerate(self._weights):
+            if plane[source] != 0:
+                continue
+            n = self._neighbour(source, d)
+            if n is not None and is_crossable_if_source_is_town(self._grid.tile_at(source), self._grid.tile_at(n)):
+                yield n
+
+    def sources(self, x: int, y: int, profile: str = MIXED.name) -> list[tuple[int, float]]:
+        # Seeds of a search starting from the town in x, y. A profile only boards the tiles it can move from.
+        source_key = self._grid.index(x, y)
+        boarding = self._boarding_moves(source_key)
+        if profile != MIXED.name:
+            allowed = PROFILES[profile]
+            boarding = (n for n in boarding if (allowed.sea if self._grid.type[n] != NULL['h'] else allowed.land))
+        return [(source_key, 0)] + [(n, 0) for n in boarding]
+
+    def profile_graph(self, profile: str) -> TileGraph:
+        """
+        Graph of the moves of a profile of lib.profiles.PROFILES: the one of the map for the mixed profile, otherwise
+        compiled out of the weight planes masked for the profile, the first time it is needed.
+        """
+        graph = self.graph
+        if profile == MIXED.name:
+            return graph
+        if profile not in self._profile_graphs:
+            METRICS.progress(f'Compiling {profile} graph...')
+            planes = profile_planes(self._grid, self._weights, PROFILES[profile])
+            ferries = self._ferries if PROFILES[profile].ferries else {}
+            self._profile_graphs[profile] = compile_graph(planes, self._deltas, ferries)
+        return self._profile_graphs[profile]
+
+    @property
+    def engine(self) -> Callable[..., DistanceField]:
+        return self._engine
+
+    def use_engine(self, name: str) -> None:
+        # Engine of the searches, among SEARCH_ENGINES
+        self._engine = SEARCH_ENGINES[name]
+
+    def is_reachable(self, src: tuple[int, int], dst: tuple[int, int]) -> bool:
+        # Whether the tile in `dst` can be reached at all from the town in `src`, without searching
+        return self.components.is_reachable((s for s, _ in self.sources(*src)), self._grid.index(*dst))
+
+    def reachable_targets(self, seeds: Sequence[tuple[int, float]], targets: Iterable[int]) -> list[int]:
+        closure = self.components.closure(s for s, _ in seeds)
+        return [t for t in targets if self.components.labels[t] in closure]
+
+    def is_sparse(self, seeds: Sequence[tuple[int, float]]) -> bool:
+        # Whether a search from `seeds` only reaches a small part of the map
+        return self.components.reachable_size(s for s, _ in seeds) * _SPARSE_RATIO < self._grid.size
+
+    def dijkstra(
+        self,
+        x: int,
+        y: int,
+        max_cost: float | None = None,
+        max_tiles: int | None = None,
+        profile: str = MIXED.name,
+        predecessors: bool = False,
+    ) -> DistanceField:
+        seeds = self.sources(x, y, profile)
+        graph = self.profile_graph(profile)
+        sparse = self.is_sparse(seeds)
+        with METRICS.phase('search', x=x, y=y, profile=profile, engine=self._engine.__name__, sparse=sparse) as record:
+            field = self._engine(graph, seeds, max_cost=max_cost, max_tiles=max_tiles, sparse=sparse, predecessors=predecessors)
+            METRICS.count_search(record, field, graph)
+        if predecessors:
+            board_from_town(field, seeds)
+        return field
+
+    def compute_distances(
+        self,
+        x: int,
+        y: int,
+        max_cost: float | None = None,
+        max_tiles: int | None = None,
+        profile: str = MIXED.name,
+    ) -> Sequence[TileDistance]:
+        dist = self.dijkstra(x, y, max_cost=max_cost, max_tiles=max_tiles, profile=profile)
+        return to_tile_distances(dist, self._grid.width, self._grid.x0, self._grid.y0)
+
+    def town_matrix(
+        self,
+        towns: Sequence[tuple[str, int, int]],
+        sources: Sequence[str] | None = None,
+        max_cost: float | None = None,
+    ) -> TownMatrix:
+        """
+        Costs from each town of `sources` (all the `towns` by default) to every (name, x, y) of `towns`.
+        Each search stops as soon as every town has been settled, or beyond `max_cost`.
+        """
+        names = [name for name, _, _ in towns]
+        keys = [self._grid.index(x, y) for _, x, y in towns]
+        coords = {name: (x, y) for name, x, y in towns}
+        matrix = TownMatrix.empty(names if sources is None else sources, names)
+        for source in matrix.sources:
+            METRICS.progress(f'Town: {source}')
+            seeds = self.sources(*coords[source])
+            # Towns out of reach would make the search go through the whole components it can reach
+            targets = self.reachable_targets(seeds, keys)
+            dist = self._engine(self.graph, seeds, max_cost=max_cost, targets=targets, sparse=self.is_sparse(seeds))
+            matrix.set_row(source, town_costs(dist, keys))
+        return matrix
+
+    def nearest_towns(self, towns: Sequence[tuple[str, int, int]], max_cost: float | None = None) -> tuple[array, DistanceField]:
+        """
+        Partition of the map between the (name, x, y) `towns`: a single search seeded with every town, and the tiles it
+        boards, at cost 0, so that the distance of each tile is the one to its nearest town. It returns the nearest town
+        of each tile (index into `towns`, lib.partition.NO_TOWN if none reaches it) and the distance field.
+        A tile boarded by several towns goes to the first one, a town tile to its own town.
+        """
+        seeds: dict[int, int] = {}
+        for t, (_, x, y) in enumerate(towns):
+            seeds.setdefault(self._grid.index(x, y), t)
+        for t, (_, x, y) in enumerate(towns):
+            for s, _ in self.sources(x, y)[1:]:
+                seeds.setdefault(s, t)
+        field = self._engine(self.graph, [(s, 0) for s in seeds], max_cost=max_cost)
+        return nearest_towns(self.graph, field, seeds), field
+
+    def reachable_towns(self, towns: Sequence[tuple[str, int, int]]) -> dict[str, list[str]]:
+        # Towns reachable from each (name, x, y) of `towns`, out of the component index only
+        reachable = {}
+        for name, x, y in towns:
+            closure = self.components.closure(s for s, _ in self.sources(x, y))
+            reachable[name] = [n for n, tx, ty in towns if self.components.labels[self._grid.index(tx, ty)] in closure]
+        return reachable
+
+    def _octile(self, x: int, y: int) -> Callable[[int], float]:
+        # Lower bound of the cost from any tile to x, y: every straight move costs at least 1 and every diagonal one 1.414.
+        # Slightly shrunk so that float rounding can never make it overestimate.
+        width = self._grid.width
+        # Relative to the origin of the grid
+        x, y = x - self._grid.x0, y - self._grid.y0
+        def heuristic(i: int) -> float:
+            dy, dx = divmod(i, width)
+            dx, dy = abs(dx - x), abs(dy - y)
+            return ((max(dx, dy) - min(dx, dy)) * STRAIGHT_LENGTH + min(dx, dy) * DIAGONAL_LENGTH) * (1 - 1e-9)
+        return heuristic
+
+    def _ferry_safe(self, heuristic: Callable[[int], float]) -> Callable[[int], float]:
+        # Ferries are free jumps: any path taking one costs at least as much as from the closest landing to the destination
+        landings = {l for ls in self._ferries.values() for l in ls}
+        if not landings:
+            return heuristic
+        bound = min(heuristic(l) for l in landings)
+        return lambda i: min(heuristic(i), bound)
+
+    def compute_landmarks(self, k: int, start: tuple[int, int] | None = None, candidates: Sequence[tuple[int, int]] = ()) -> Landmarks:
+        """
+        Preprocessing for shortest_path: picks `k` landmarks (among `candidates` if any, e.g. the towns) as far as possible
+        from each other and computes their distance fields. It costs one full search per landmark.
+        """
+        if start is None:
+            start = self._grid.coords(self._grid.present.find(1))
+        self._landmarks = Landmarks.farthest(self, k, start, candidates=candidates)
+        return self._landmarks
+
+    def use_landmarks(self, landmarks: Landmarks | None) -> None:
+        # E.g. landmarks previously saved and loaded with Landmarks.load
+        if landmarks is not None and (landmarks.width, landmarks.height) != (self._grid.width, self._grid.height):
+            raise ValueError('Landmarks have been computed on a map of a different size')
+        self._landmarks = landmarks
+
+    def shortest_path(self, src: tuple[int, int], dst: tuple[int, int], use_landmarks: bool = True) -> Route:
+        """
+        Cost and tiles of the cheapest route from the town in `src` to the tile in `dst`, using A* with the octile distance
+        (made safe for ferries) as heuristic, or the best of it and the landmarks lower bound once landmarks are available.
+        """
+        source, target = self._grid.index(*src), self._grid.index(*dst)
+        heuristic = self._ferry_safe(self._octile(*dst))
+        if use_landmarks and self._landmarks is not None:
+            octile, alt = heuristic, self._landmarks.heuristic(target)
+            heuristic = lambda i: max(octile(i), alt(i))
+        cost, path, settled = astar(self.graph, source, target, heuristic, boarding=self._boarding_moves(source))
+        return Route(cost, [self._grid.coords(i) for i in path], settled)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+from array import array
+import json
+from lib.search import DistanceField
+import struct
+import sys
+from typing import Sequence
+import zlib
+
+MAGIC = b'MTMX'
+VERSION = 1
+# Fixed-point costs: thousandths of cost. Every move weight is a whole number of thousandths, so they are exact.
+SCALE = 1000
+# Cost of the towns which are not reachable (or beyond the cutoff)
+UNREACHABLE = 0xFFFFFFFF
+# magic, version, length of the JSON header
+_PREAMBLE = struct.Struct('<4sII')
+
+class TownMatrix:
+    """
+    Costs between towns: one row per source town, one column per town, stored row-major as fixed-point uint32 values
+    (see SCALE), UNREACHABLE meaning the town is not reachable from the source.
+    """
+    def __init__(self, sources: Sequence[str], towns: Sequence[str], values: array):
+        self.sources = list(sources)
+        self.towns = list(towns)
+        self.values = values
+        self._rows = {name: r for r, name in enumerate(self.sources)}
+        self._columns = {name: c for c, name in enumerate(self.towns)}
+
+    @classmethod
+    def empty(cls, sources: Sequence[str], towns: Sequence[str]) -> TownMatrix:
+        return cls(sources, towns, array('I', [UNREACHABLE]) * (len(sources) * len(towns)))
+
+    def set_row(self, source: str, costs: Sequence[float | None]) -> None:
+        # One cost per column, None if not reachable
+        start = self._rows[source] * len(self.towns)
+        for c, cost in enumerate(costs):
+            self.values[start + c] = UNREACHABLE if cost is None else round(cost * SCALE)
+
+    def get(self, source: str, town: str) -> float | None:
+        value = self.values[self._rows[source] * len(self.towns) + self._columns[town]]
+        return None if value == UNREACHABLE else value / SCALE
+
+    def row(self, source: str) -> list[float | None]:
+        start = self._rows[source] * len(self.towns)
+        return [None if v == UNREACHABLE else v / SCALE for v in self.values[start:start + len(self.towns)]]
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({'sources': self.sources, 'towns': self.towns}).encode('utf8')
+        values = self.values
+        if sys.byteorder == 'big':
+            values = array('I', values)
+            values.byteswap()
+        return _PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + zlib.compress(values.tobytes(), 9)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> TownMatrix:
+        magic, version, header_length = _PREAMBLE.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a town matrix, or written by another version')
+        header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        values = array('I')
+        values.frombytes(zlib.decompress(data[_PREAMBLE.size + header_length:]))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return cls(header['sources'], header['towns'], values)
+
+def town_costs(dist: DistanceField, town_keys: Sequence[int]) -> list[float | None]:
+    # Row of the matrix out of the distance field of a source, `town_keys` being the grid indexes of the columns
+    return [dist[k] if k in dist else None for k in town_keys]
+
+def save_matrix(file_name: str, matrix: TownMatrix) -> None:
+    with open(file_name, 'wb') as fd:
+        fd.write(matrix.to_bytes())
+
+def load_matrix(file_name: str) -> TownMatrix:
+    with open(file_name, 'rb') as fd:
+        return TownMatrix.from_bytes(fd.read())
+
+def matrix_to_json(matrix: TownMatrix) -> dict[str, dict[str, float | None]]:
+    return {source: dict(zip(matrix.towns, matrix.row(source))) for source in matrix.sources}
@@ -0,0 +1,95 @@
+from __future__ import annotations
+from array import array
+from contextlib import contextmanager
+import json
+from lib.dial import FixedDistanceField
+from lib.graph import TileGraph
+from lib.search import DistanceField
+import os
+import sys
+import time
+from typing import Any, Iterator, TextIO
+
+# Rough size of a dict entry (slot, key and value objects), e.g. of the sparse distances
+DICT_ENTRY_BYTES = 100
+
+def nbytes(data: Any) -> int:
+    """
+    Cheap estimate of the memory held by `data`, out of the sizes of its arrays rather than by walking its objects:
+    arrays, buffers and objects having an `nbytes` (grids, graphs) exactly, dicts roughly, sequences and distance fields
+    as the sum of their parts. The float copy of the fixed-point fields is not counted, as it is only built on demand.
+    """
+    if isinstance(data, array):
+        return data.itemsize * len(data)
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, memoryview):
+        return data.nbytes
+    if isinstance(data, dict):
+        return DICT_ENTRY_BYTES * len(data)
+    if isinstance(data, (list, tuple)):
+        return sum(nbytes(d) for d in data)
+    if isinstance(data, DistanceField):
+        distances = data.fixed if isinstance(data, FixedDistanceField) else data.dist
+        return nbytes(distances) + nbytes(data.settled) + (0 if data.parents is None else nbytes(data.parents))
+    return data.nbytes
+
+def search_counters(field: DistanceField, graph: TileGraph) -> dict[str, int]:
+    # Counters of the search which computed `field` over `graph`. `edges_scanned` is the number of edges looked at: each
+    # settled tile scans all its edges, so they are counted here rather than in the loop of the search. Only the ones
+    # improving a distance are pushed, see `pushes`.
+    offsets = graph.offsets
+    return {
+        'settled': len(field),
+        'pushes': field.pushes,
+        'stale': field.stale,
+        'edges_scanned': sum(offsets[u + 1] - offsets[u] for u in field.settled),
+    }
+
+class Metrics:
+    """
+    Records metrics as JSON lines written to `stream`, one object per event: its name, time, process and fields.
+    Nothing is written (and nothing is counted, see `enabled`) as long as there is no stream. Progress messages are
+    events too, also printed on the standard output when `verbose`.
+    """
+    def __init__(self, stream: TextIO | None = None, verbose: bool = True):
+        self.stream = stream
+        self.verbose = verbose
+
+    @property
+    def enabled(self) -> bool:
+        return self.stream is not None
+
+    def emit(self, event: str, **fields: Any) -> None:
+        if self.stream is None:
+            return
+        self.stream.write(json.dumps({'event': event, 'time': round(time.time(), 3), 'pid': os.getpid(), **fields}) + '\n')
+        self.stream.flush()
+
+    def progress(self, message: str, **fields: Any) -> None:
+        # Progress of the run for whoever watches it, as a `progress` event with `fields`
+        if self.verbose:
+            print(message, flush=True)
+        self.emit('progress', message=message, **fields)
+
+    @contextmanager
+    def phase(self, name: str, **fields: Any) -> Iterator[dict[str, Any]]:
+        # Wall and CPU times of the block, emitted as a `phase` event with `fields` and the ones the block adds to the
+        # dict it is given. Nothing is emitted if the block raises.
+        record = dict(fields)
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield record
+        self.emit('phase', phase=name, wall=round(time.perf_counter() - wall, 6), cpu=round(time.process_time() - cpu, 6), **record)
+
+    def count_search(self, record: dict[str, Any], field: DistanceField, graph: TileGraph) -> None:
+        # Adds the counters of a search to the record of its phase, only when they are written
+        if self.enabled:
+            record.update(search_counters(field, graph))
+
+# Metrics of the process, written once enable_metrics is called. Worker processes forked afterwards write to the same
+# stream, each line being written at once.
+METRICS = Metrics()
+
+def enable_metrics(path: str) -> None:
+    # JSON lines appended to the file in `path`, or written to the standard error with '-'
+    METRICS.stream = sys.stderr if path == '-' else open(path, 'a', encoding='utf8')
@@ -0,0 +1,183 @@
+from __future__ import annotations
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from lib.graph import TileGraph
+from lib.map import TileMap
+from lib.matrix import TownMatrix, town_costs
+from lib.metrics import METRICS
+from lib.routes import PredecessorRaster, board_from_town
+from lib.search import UNREACHABLE, DistanceField, SparseDistances, to_tile_distances
+from lib.types import TileDistance
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterator, Sequence
+
+class SharedGraph:
+    """
+    TileGraph whose arrays are published in shared memory blocks, so that worker processes can attach to them by name
+    without any copy (nor pickling) of the map.
+    """
+    # Graph attribute and memoryview format of each published array
+    ARRAYS = (
+        ('offsets', 'i'),
+        ('targets', 'i'),
+        ('codes', 'B'),
+    )
+
+    def __init__(self, graph: TileGraph):
+        self._blocks: list[SharedMemory] = []
+        for name, _ in self.ARRAYS:
+            data = memoryview(getattr(graph, name)).cast('B')
+            block = SharedMemory(create=True, size=max(len(data), 1))
+            block.buf[:len(data)] = data
+            self._blocks.append(block)
+        self.handle = tuple((block.name, len(getattr(graph, name))) for block, (name, _) in zip(self._blocks, self.ARRAYS))
+
+    @classmethod
+    def attach(cls, handle: Sequence[tuple[str, int]]) -> tuple[TileGraph, list[SharedMemory]]:
+        # The blocks must be kept alive (and closed) by the caller as long as the graph is used
+        blocks = [SharedMemory(name=name) for name, _ in handle]
+        views = [
+            block.buf.cast(fmt)[:length] if length > 0 else memoryview(b'').cast(fmt)
+                for block, (_, length), (_, fmt) in zip(blocks, handle, cls.ARRAYS)
+        ]
+        return TileGraph(*views), blocks
+
+    def close(self) -> None:
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self) -> SharedGraph:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+# State of each worker process, set once by _init_worker
+_worker_graph: TileGraph | None = None
+_worker_blocks: list[SharedMemory] = []
+
+def _init_worker(handle: Sequence[tuple[str, int]]) -> None:
+    global _worker_graph, _worker_blocks
+    _worker_graph, _worker_blocks = SharedGraph.attach(handle)
+
+def _search(task: tuple) -> tuple[str, int, Any]:
+    name, seeds, origin, max_cost, max_tiles, sparse, engine, predecessors, save, summarize = task
+    with METRICS.phase('town', town=name):
+        with METRICS.phase('search', town=name, engine=engine.__name__, sparse=sparse) as record:
+            dist = engine(_worker_graph, seeds, max_cost=max_cost, max_tiles=max_tiles, sparse=sparse, predecessors=predecessors)
+            METRICS.count_search(record, dist, _worker_graph)
+        distances = to_tile_distances(dist, *origin)
+        if predecessors:
+            board_from_town(dist, seeds)
+            save(name, distances, predecessors=PredecessorRaster.from_field(dist, *origin))
+        else:
+            save(name, distances)
+    return name, len(dist), None if summarize is None else summarize(distances)
+
+def _field(task: tuple) -> tuple[array, array, int, int]:
+    # Only the reached tiles are sent back, with their distances in the order they were settled (see SearchPool)
+    seeds, max_cost, targets, sparse, engine = task
+    field = engine(_worker_graph, seeds, max_cost=max_cost, targets=targets, sparse=sparse)
+    return field.settled, array('d', (d for _, d in field.items())), field.pushes, field.stale
+
+def _matrix_row(task: tuple) -> tuple[str, list[float | None]]:
+    name, seeds, keys, targets, max_cost, sparse, engine = task
+    dist = engine(_worker_graph, seeds, max_cost=max_cost, targets=targets, sparse=sparse)
+    return name, town_costs(dist, keys)
+
+def parallel_distances(
+    tile_map: TileMap,
+    sources: Sequence[tuple[str, int, int]],
+    save: Callable[[str, Sequence[TileDistance]], None],
+    processes: int | None = None,
+    max_cost: float | None = None,
+    max_tiles: int | None = None,
+    predecessors: bool = False,
+    summarize: Callable[[Sequence[TileDistance]], Any] | None = None,
+) -> Iterator[tuple[str, int, Any]]:
+    """
+    Computes the distances from each (name, x, y) of `sources` over a pool of `processes` workers sharing the costed map.
+    Each worker calls `save(name, distances)` (which must be picklable) as soon as its search is over, with the
+    `predecessors` keyword argument too (see lib.routes.PredecessorRaster) if they are recorded.
+    It yields the name, the number of reached tiles and the summary of the distances of each source, in completion order:
+    `summarize(distances)` (which must be picklable too) run by the worker, e.g. lib.inverted.block_minima, or None.
+    """
+    # Width and origin of the grid, to convert indexes back to coordinates
+    origin = (tile_map.grid.width, tile_map.grid.x0, tile_map.grid.y0)
+    tasks = []
+    for name, x, y in sources:
+        seeds = tile_map.sources(x, y)
+        tasks.append((name, seeds, origin, max_cost, max_tiles, tile_map.is_sparse(seeds), tile_map.engine, predecessors, save, summarize))
+    with SharedGraph(tile_map.graph) as shared:
+        with Pool(processes, initializer=_init_worker, initargs=(shared.handle,)) as pool:
+            yield from pool.imap_unordered(_search, tasks)
+
+def parallel_town_matrix(
+    tile_map: TileMap,
+    towns: Sequence[tuple[str, int, int]],
+    sources: Sequence[str] | None = None,
+    processes: int | None = None,
+    max_cost: float | None = None,
+) -> TownMatrix:
+    # Same as TileMap.town_matrix, one row per task over a pool of `processes` workers sharing the costed map
+    names = [name for name, _, _ in towns]
+    keys = [tile_map.grid.index(x, y) for _, x, y in towns]
+    coords = {name: (x, y) for name, x, y in towns}
+    matrix = TownMatrix.empty(names if sources is None else sources, names)
+    tasks = []
+    for source in matrix.sources:
+        seeds = tile_map.sources(*coords[source])
+        tasks.append((source, seeds, keys, tile_map.reachable_targets(seeds, keys), max_cost, tile_map.is_sparse(seeds), tile_map.engine))
+    with SharedGraph(tile_map.graph) as shared:
+        with Pool(processes, initializer=_init_worker, initargs=(shared.handle,)) as pool:
+            for source, costs in pool.imap_unordered(_matrix_row, tasks):
+                METRICS.progress(f'Town: {source} done')
+                matrix.set_row(source, costs)
+    return matrix
+
+class SearchPool:
+    """
+    Pool of `processes` workers sharing the costed map, for searches submitted one at a time (e.g. by lib.service) rather
+    than as a batch. Each search runs in a worker, which sends back its reached tiles and their distances only, rather
+    than whole fields sized like the map: the DistanceField is rebuilt out of them in this process.
+    """
+    def __init__(self, tile_map: TileMap, processes: int | None = None):
+        self._tile_map = tile_map
+        self._shared = SharedGraph(tile_map.graph)
+        self._executor = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(self._shared.handle,))
+
+    def submit(
+        self,
+        seeds: Sequence[tuple[int, float]],
+        max_cost: float | None = None,
+        targets: Sequence[int] | None = None,
+    ) -> Future[DistanceField]:
+        sparse = self._tile_map.is_sparse(seeds)
+        task = (seeds, max_cost, targets, sparse, self._tile_map.engine)
+        field: Future[DistanceField] = Future()
+        def rebuild(search: Future[tuple[array, array, int, int]]) -> None:
+            try:
+                field.set_result(self._rebuild(*search.result(), sparse))
+            except BaseException as e:
+                field.set_exception(e)
+        self._executor.submit(_field, task).add_done_callback(rebuild)
+        return field
+
+    def _rebuild(self, settled: array, distances: array, pushes: int, stale: int, sparse: bool) -> DistanceField:
+        dist = SparseDistances() if sparse else array('d', [UNREACHABLE]) * len(self._tile_map.graph)
+        for i, d in zip(settled, distances):
+            dist[i] = d
+        return DistanceField(dist, settled, pushes=pushes, stale=stale)
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        self._shared.close()
+
+    def __enter__(self) -> SearchPool:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
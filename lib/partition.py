@@ -0,0 +1,116 @@
+from __future__ import annotations
+from array import array
+import json
+from lib.graph import EDGE_WEIGHTS, TileGraph
+from lib.grid import TileGrid
+from lib.search import DistanceField
+import struct
+import sys
+from typing import Iterator, Mapping, Sequence
+import zlib
+
+MAGIC = b'MTWN'
+VERSION = 1
+# Town of the tiles no town reaches
+NO_TOWN = 0xFFFF
+# magic, version, length of the JSON header
+_PREAMBLE = struct.Struct('<4sII')
+# Same tolerance as lib.incremental: distances of the dial engine are converted from thousandths
+_TOLERANCE = 1e-6
+
+def nearest_towns(graph: TileGraph, field: DistanceField, seeds: Mapping[int, int]) -> array:
+    """
+    Nearest town of each tile, out of `field` computed from the seeds of every town at once, `seeds` giving the town of
+    each seed. Following the settling order, each tile passes its town to the neighbours it is the first to reach along
+    a shortest path. It returns one town per tile of the graph, NO_TOWN if it has not been reached.
+    """
+    owners = array('H', [NO_TOWN]) * len(graph)
+    for s, town in seeds.items():
+        owners[s] = town
+    offsets, targets, codes = graph.offsets, graph.targets, graph.codes
+    dist = field.dist
+    for u in field.settled:
+        owner = owners[u]
+        du = dist[u]
+        for e in range(offsets[u], offsets[u + 1]):
+            n = targets[e]
+            if owners[n] == NO_TOWN and abs(du + EDGE_WEIGHTS[codes[e]] - dist[n]) <= _TOLERANCE:
+                owners[n] = owner
+    return owners
+
+class TownRaster:
+    """
+    Nearest town of the tiles within the bounding box of a partition of the map: index into `towns` as uint16 values,
+    NO_TOWN meaning no town reaches the tile. Values are row-major.
+    """
+    def __init__(self, towns: Sequence[str], x: int, y: int, width: int, height: int, values: array):
+        self.towns = list(towns)
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.values = values
+
+    @classmethod
+    def from_owners(cls, towns: Sequence[str], owners: array, grid: TileGrid) -> TownRaster:
+        # Cropped to the tiles reached, `owners` being indexed like `grid`
+        reached = [i for i, o in enumerate(owners) if o != NO_TOWN]
+        if len(reached) == 0:
+            return cls(towns, 0, 0, 0, 0, array('H'))
+        rows = (reached[0] // grid.width, reached[-1] // grid.width)
+        columns = min(i % grid.width for i in reached), max(i % grid.width for i in reached)
+        width = columns[1] - columns[0] + 1
+        values = array('H')
+        for row in range(rows[0], rows[1] + 1):
+            start = row * grid.width + columns[0]
+            values.extend(owners[start:start + width])
+        return cls(towns, grid.x0 + columns[0], grid.y0 + rows[0], width, rows[1] - rows[0] + 1, values)
+
+    def get(self, x: int, y: int) -> str | None:
+        if not (self.x <= x < self.x + self.width and self.y <= y < self.y + self.height):
+            return None
+        value = self.values[(y - self.y) * self.width + x - self.x]
+        return None if value == NO_TOWN else self.towns[value]
+
+    def __iter__(self) -> Iterator[tuple[int, int, str]]:
+        for i, value in enumerate(self.values):
+            if value != NO_TOWN:
+                dy, dx = divmod(i, self.width)
+                yield self.x + dx, self.y + dy, self.towns[value]
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            'towns': self.towns,
+            'x': self.x,
+            'y': self.y,
+            'width': self.width,
+            'height': self.height,
+        }).encode('utf8')
+        values = self.values
+        if sys.byteorder == 'big':
+            values = array('H', values)
+            values.byteswap()
+        return _PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + zlib.compress(values.tobytes(), 9)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> TownRaster:
+        magic, version, header_length = _PREAMBLE.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a town raster, or written by another version')
+        header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        values = array('H')
+        values.frombytes(zlib.decompress(data[_PREAMBLE.size + header_length:]))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return cls(header['towns'], header['x'], header['y'], header['width'], header['height'], values)
+
+def save_town_raster(file_name: str, raster: TownRaster) -> None:
+    with open(file_name, 'wb') as fd:
+        fd.write(raster.to_bytes())
+
+def load_town_raster(file_name: str) -> TownRaster:
+    with open(file_name, 'rb') as fd:
+        return TownRaster.from_bytes(fd.read())
+
+def town_raster_to_json(raster: TownRaster) -> list[list[int | str]]:
+    return [[x, y, town] for x, y, town in raster]
@@ -0,0 +1,40 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from lib.costs import FOREST, LAND, SEA, tile_classes
+from lib.grid import TileGrid
+from typing import Sequence
+
+@dataclass(frozen=True)
+class CostProfile:
+    __slots__ = (
+        'name',
+        'land',
+        'sea',
+        'ferries',
+    )
+    name: str
+    land: bool # land moves (between two land tiles) allowed
+    sea: bool # sea moves (between two sea tiles) allowed
+    ferries: bool # ferry trips allowed
+
+# Every move, as computed by lib.costs: the default profile
+MIXED = CostProfile('mixed', land=True, sea=True, ferries=True)
+PROFILES = {p.name: p for p in (
+    MIXED,
+    CostProfile('land', land=True, sea=False, ferries=False),
+    CostProfile('sea', land=False, sea=True, ferries=True),
+)}
+
+def source_mask(grid: TileGrid, profile: CostProfile) -> bytes:
+    # 0xFF for the tiles whose moves the profile keeps, 0 for the others
+    allowed = ({LAND, FOREST} if profile.land else set()) | ({SEA} if profile.sea else set())
+    return tile_classes(grid).translate(bytes(0xFF if c in allowed else 0 for c in range(256)))
+
+def profile_planes(grid: TileGrid, planes: Sequence[bytes], profile: CostProfile) -> list[bytes]:
+    """
+    Weight planes of the moves of `profile`, out of the planes of every move (see lib.costs.compute_weight_planes).
+    Land and sea moves never cross each other (sea tiles are only boarded from towns), so the moves of a profile are the
+    ones whose source tile is of an allowed class: each plane is masked as a whole, the tile arrays are shared.
+    """
+    mask = int.from_bytes(source_mask(grid, profile), 'big')
+    return [(int.from_bytes(plane, 'big') & mask).to_bytes(grid.size, 'big') for plane in planes]
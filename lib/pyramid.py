@@ -0,0 +1,146 @@
+from __future__ import annotations
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import json
+from lib.raster import DistanceRaster, load_raster
+from lib.search import UNREACHABLE
+from lib.types import TileDistance
+import os
+import shutil
+from typing import Any, Sequence
+
+# Cells per side of each tile of the pyramid
+TILE_SIZE = 256
+MANIFEST = 'manifest.json'
+
+class Level:
+    """
+    Cells of a level of the pyramid: cell x, y of `level` covers the 2^level x 2^level map tiles from x << level,
+    y << level, and holds the lowest cost among them (UNREACHABLE if none is reached). Values are row-major over the box
+    of `width` x `height` cells from x0, y0.
+    """
+    def __init__(self, level: int, x0: int, y0: int, width: int, height: int, values: array):
+        self.level = level
+        self.x0 = x0
+        self.y0 = y0
+        self.width = width
+        self.height = height
+        self.values = values
+
+    @classmethod
+    def from_distances(cls, distances: Sequence[TileDistance], levels: int) -> Level:
+        # Level 0, its box aligned on the cells of the coarsest of `levels` levels so that each level halves it exactly
+        block = 1 << (levels - 1)
+        x0 = min(d.x for d in distances) // block * block
+        y0 = min(d.y for d in distances) // block * block
+        width = (max(d.x for d in distances) // block + 1) * block - x0
+        height = (max(d.y for d in distances) // block + 1) * block - y0
+        values = array('d', [UNREACHABLE]) * (width * height)
+        for d in distances:
+            values[(d.y - y0) * width + d.x - x0] = d.distance
+        return cls(0, x0, y0, width, height, values)
+
+    def coarser(self) -> Level:
+        # Next level: the lowest cost of each 2x2 cells, rows then columns pairwise
+        values, width = self.values, self.width
+        coarse = array('d')
+        for row in range(0, self.height, 2):
+            pairs = list(map(min, values[row * width:(row + 1) * width], values[(row + 1) * width:(row + 2) * width]))
+            coarse.extend(map(min, pairs[0::2], pairs[1::2]))
+        return Level(self.level + 1, self.x0 // 2, self.y0 // 2, width // 2, self.height // 2, coarse)
+
+    def tiles(self, tile_size: int) -> list[tuple[int, int]]:
+        # Tiles overlapping the box of the level
+        return [
+            (tx, ty)
+                for ty in range(self.y0 // tile_size, (self.y0 + self.height - 1) // tile_size + 1)
+                for tx in range(self.x0 // tile_size, (self.x0 + self.width - 1) // tile_size + 1)
+        ]
+
+    def tile(self, tx: int, ty: int, tile_size: int) -> DistanceRaster | None:
+        # Cells of tile tx, ty as a raster in level coordinates, None if none of them is reached
+        x, y = tx * tile_size, ty * tile_size
+        first, last = max(x, self.x0), min(x + tile_size, self.x0 + self.width)
+        before, after = array('d', [UNREACHABLE]) * (first - x), array('d', [UNREACHABLE]) * (x + tile_size - last)
+        empty = array('d', [UNREACHABLE]) * tile_size
+        values = array('d')
+        for cy in range(y, y + tile_size):
+            if self.y0 <= cy < self.y0 + self.height:
+                start = (cy - self.y0) * self.width - self.x0
+                values += before + self.values[start + first:start + last] + after
+            else:
+                values += empty
+        if min(values) == UNREACHABLE:
+            return None
+        return DistanceRaster.from_values(x, y, tile_size, tile_size, values, UNREACHABLE)
+
+def level_count(distances: Sequence[TileDistance], tile_size: int = TILE_SIZE) -> int:
+    # Levels down to the first one holding every reached tile in tile 0, 0: the same for every field of the map
+    extent = max(max(d.x, d.y) for d in distances)
+    levels = 1
+    while extent >> (levels - 1) >= tile_size:
+        levels += 1
+    return levels
+
+def _tile_path(directory: str, level: int, tx: int, ty: int) -> str:
+    return f'{directory}/{level}/{tx}_{ty}.dist'
+
+def save_pyramid(directory: str, distances: Sequence[TileDistance], tile_size: int = TILE_SIZE, workers: int = 4) -> int:
+    """
+    Saves the distances as a pyramid of tiles of `tile_size` x `tile_size` cells in `directory`: level 0 holds the costs
+    of the map tiles, each next level the lowest cost of 2x2 cells of the previous one (see Level), down to a single tile.
+    Each tile is a distance raster (see lib.raster) in level coordinates, saved as `directory`/LEVEL/TX_TY.dist, and the
+    tiles without any reached cell are skipped. The tiles of each level are listed in `directory`/manifest.json.
+    Tiles are quantized, compressed and written over `workers` threads, while the next level is computed.
+    It returns the number of bytes written.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    manifest: dict[str, Any] = {'tile_size': tile_size, 'levels': []}
+    if distances:
+        manifest['bbox'] = [min(d.x for d in distances), min(d.y for d in distances), max(d.x for d in distances), max(d.y for d in distances)]
+
+    def write(level: Level, tx: int, ty: int) -> int:
+        raster = level.tile(tx, ty, tile_size)
+        if raster is None:
+            return 0
+        data = raster.to_bytes()
+        with open(_tile_path(directory, level.level, tx, ty), 'wb') as fd:
+            fd.write(data)
+        return len(data)
+
+    pending = []
+    with ThreadPoolExecutor(workers) as pool:
+        levels = level_count(distances, tile_size) if distances else 0
+        level = Level.from_distances(distances, levels) if distances else None
+        for k in range(levels):
+            os.makedirs(f'{directory}/{k}')
+            tiles = level.tiles(tile_size)
+            pending.append((k, tiles, [pool.submit(write, level, tx, ty) for tx, ty in tiles]))
+            if k + 1 < levels:
+                level = level.coarser()
+        written = 0
+        for k, tiles, futures in pending:
+            sizes = [f.result() for f in futures]
+            written += sum(sizes)
+            manifest['levels'].append({'level': k, 'block': 1 << k, 'tiles': [[tx, ty] for (tx, ty), size in zip(tiles, sizes) if size > 0]})
+    data = json.dumps(manifest, separators=(',', ':'))
+    with open(f'{directory}/{MANIFEST}', 'w', encoding='utf8') as fd:
+        fd.write(data)
+    return written + len(data)
+
+def load_manifest(directory: str) -> dict[str, Any]:
+    with open(f'{directory}/{MANIFEST}', encoding='utf8') as fd:
+        return json.load(fd)
+
+def load_tile(directory: str, level: int, tx: int, ty: int) -> DistanceRaster | None:
+    # Tile of the pyramid, None if it has been skipped (none of its cells is reached)
+    path = _tile_path(directory, level, tx, ty)
+    return load_raster(path) if os.path.isfile(path) else None
+
+def pyramid_cost(directory: str, x: int, y: int, level: int = 0) -> float | None:
+    # Lowest cost of the cell of `level` holding map tile x, y, as quantized in the pyramid (None if not reached)
+    tile_size = load_manifest(directory)['tile_size']
+    cx, cy = x >> level, y >> level
+    tile = load_tile(directory, level, cx // tile_size, cy // tile_size)
+    return None if tile is None else tile.get(cx, cy)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+from array import array
+import lzma
+from lib.types import TileDistance
+import struct
+import sys
+from typing import Iterator, Sequence
+import zlib
+
+MAGIC = b'MDST'
+VERSION = 1
+# Quantized value of the tiles of the bounding box which are not reachable
+UNREACHABLE = 0xFFFF
+# magic, version, compression, x, y, width, height of the bounding box, scale
+_HEADER = struct.Struct('<4sBBHHHHd')
+
+COMPRESSIONS = {
+    'none': 0,
+    'zlib': 1,
+    'lzma': 2,
+}
+# Candidate scales (quantized units per unit of cost), the finest one fitting the largest distance is used
+_SCALES = (1000, 100, 10, 1, 0.1, 0.01)
+
+def _scale(max_distance: float) -> float:
+    return next((s for s in _SCALES if max_distance * s < UNREACHABLE - 1), _SCALES[-1])
+
+class DistanceRaster:
+    """
+    Distances of the tiles within the bounding box of a distance field, quantized as uint16 fixed-point values:
+    the distance of a tile is `value / scale`, UNREACHABLE meaning it is not reachable. Values are row-major.
+    """
+    def __init__(self, x: int, y: int, width: int, height: int, scale: float, values: array):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.values = values
+
+    @classmethod
+    def from_distances(cls, distances: Sequence[TileDistance]) -> DistanceRaster:
+        if len(distances) == 0:
+            return cls(0, 0, 0, 0, _SCALES[0], array('H'))
+        min_x = min(d.x for d in distances)
+        min_y = min(d.y for d in distances)
+        width = max(d.x for d in distances) - min_x + 1
+        height = max(d.y for d in distances) - min_y + 1
+        scale = _scale(max(d.distance for d in distances))
+        values = array('H', [UNREACHABLE]) * (width * height)
+        for d in distances:
+            values[(d.y - min_y) * width + d.x - min_x] = min(round(d.distance * scale), UNREACHABLE - 1)
+        return cls(min_x, min_y, width, height, scale, values)
+
+    @classmethod
+    def from_values(cls, x: int, y: int, width: int, height: int, values: Sequence[float], missing: float) -> DistanceRaster:
+        # Row-major distances of the whole box, `missing` for the tiles not reachable
+        scale = _scale(max((v for v in values if v != missing), default=0))
+        quantized = array('H', (UNREACHABLE if v == missing else min(round(v * scale), UNREACHABLE - 1) for v in values))
+        return cls(x, y, width, height, scale, quantized)
+
+    def get(self, x: int, y: int) -> float | None:
+        if not (self.x <= x < self.x + self.width and self.y <= y < self.y + self.height):
+            return None
+        value = self.values[(y - self.y) * self.width + x - self.x]
+        return None if value == UNREACHABLE else value / self.scale
+
+    def __iter__(self) -> Iterator[TileDistance]:
+        for i, value in enumerate(self.values):
+            if value != UNREACHABLE:
+                dy, dx = divmod(i, self.width)
+                yield TileDistance(self.x + dx, self.y + dy, value / self.scale)
+
+    def to_bytes(self, compression: str = 'zlib') -> bytes:
+        values = self.values
+        if sys.byteorder == 'big':
+            values = array('H', values)
+            values.byteswap()
+        payload = values.tobytes()
+        if compression == 'zlib':
+            payload = zlib.compress(payload, 9)
+        elif compression == 'lzma':
+            payload = lzma.compress(payload)
+        header = _HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression], self.x, self.y, self.width, self.height, self.scale)
+        return header + payload
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> DistanceRaster:
+        magic, version, compression, x, y, width, height, scale = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a distance raster, or written by another version')
+        payload = data[_HEADER.size:]
+        if compression == COMPRESSIONS['zlib']:
+            payload = zlib.decompress(payload)
+        elif compression == COMPRESSIONS['lzma']:
+            payload = lzma.decompress(payload)
+        values = array('H')
+        values.frombytes(payload)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return cls(x, y, width, height, scale, values)
+
+def save_raster(file_name: str, distances: Sequence[TileDistance], compression: str = 'zlib') -> None:
+    with open(file_name, 'wb') as fd:
+        fd.write(DistanceRaster.from_distances(distances).to_bytes(compression))
+
+def load_raster(file_name: str) -> DistanceRaster:
+    with open(file_name, 'rb') as fd:
+        return DistanceRaster.from_bytes(fd.read())
+
+def raster_to_json(raster: DistanceRaster) -> list[list[int | float]]:
+    # Same layout as the JSON files saved by utils.save_distances
+    return [[d.x, d.y, d.distance] for d in raster]
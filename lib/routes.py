@@ -0,0 +1,137 @@
+from __future__ import annotations
+import json
+from lib.search import DistanceField
+from lib.types import DIRECTIONS
+import struct
+from typing import Sequence
+import zlib
+
+MAGIC = b'MPRD'
+VERSION = 1
+# Codes of the tiles, besides the index into DIRECTIONS of the move reaching them
+FERRY = 0x8 # reached by a ferry trip, from the ferry tile listed in the header
+NONE = 0xF # source of the search, or not reached
+# magic, version, length of the JSON header
+_PREAMBLE = struct.Struct('<4sII')
+_DIRECTION_CODES = {d: code for code, d in enumerate(DIRECTIONS)}
+
+def board_from_town(field: DistanceField, seeds: Sequence[tuple[int, float]]) -> None:
+    # The tiles boarded from a town (see TileMap.sources, the town tile being the first seed) are reached from the town
+    # tile rather than being sources of their own
+    town = seeds[0][0]
+    for s, _ in seeds[1:]:
+        if s in field and field.parents[s] == -1:
+            field.parents[s] = town
+
+def _pack(codes: bytearray) -> bytes:
+    # Two codes per byte, low nibble first
+    if len(codes) % 2 == 1:
+        codes.append(NONE)
+    return bytes(low | high << 4 for low, high in zip(codes[::2], codes[1::2]))
+
+class PredecessorRaster:
+    """
+    Shortest path tree of a distance field over the bounding box of its reached tiles: the code of each tile is the
+    direction (index into DIRECTIONS, 3 bits) of the move reaching it, FERRY if it is reached by a ferry trip (the ferry
+    tile being in `ferries`), NONE for the sources and the tiles not reached. Codes are row-major and packed two per
+    byte, low nibble first.
+    """
+    def __init__(self, x: int, y: int, width: int, height: int, codes: bytes, ferries: dict[tuple[int, int], tuple[int, int]]):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.codes = codes
+        self.ferries = ferries
+
+    @classmethod
+    def from_field(cls, field: DistanceField, grid_width: int, x0: int = 0, y0: int = 0) -> PredecessorRaster:
+        # `field` must have been computed with predecessors, over a grid of `grid_width` tiles starting at x0, y0
+        if field.parents is None:
+            raise ValueError('The distance field has no predecessors, search with predecessors=True')
+        if len(field) == 0:
+            return cls(0, 0, 0, 0, b'', {})
+        def coords_of(i: int) -> tuple[int, int]:
+            y, x = divmod(i, grid_width)
+            return x0 + x, y0 + y
+        coords = [coords_of(i) for i in field.settled]
+        min_x, min_y = min(x for x, _ in coords), min(y for _, y in coords)
+        width = max(x for x, _ in coords) - min_x + 1
+        height = max(y for _, y in coords) - min_y + 1
+        codes = bytearray([NONE]) * (width * height)
+        ferries = {}
+        parents = field.parents
+        for i, (x, y) in zip(field.settled, coords):
+            parent = parents[i]
+            if parent == -1:
+                continue
+            px, py = coords_of(parent)
+            code = _DIRECTION_CODES.get((x - px, y - py))
+            if code is None:
+                code = FERRY
+                ferries[x, y] = px, py
+            codes[(y - min_y) * width + x - min_x] = code
+        return cls(min_x, min_y, width, height, _pack(codes), ferries)
+
+    def code(self, x: int, y: int) -> int:
+        if not (self.x <= x < self.x + self.width and self.y <= y < self.y + self.height):
+            return NONE
+        i = (y - self.y) * self.width + x - self.x
+        return self.codes[i >> 1] >> (i & 1) * 4 & 0xF
+
+    def predecessor(self, x: int, y: int) -> tuple[int, int] | None:
+        # Tile x, y is reached from, None for the sources and the tiles not reached
+        code = self.code(x, y)
+        if code == NONE:
+            return None
+        if code == FERRY:
+            return self.ferries[x, y]
+        dx, dy = DIRECTIONS[code]
+        return x - dx, y - dy
+
+    def route(self, x: int, y: int) -> list[tuple[int, int]]:
+        # Shortest path from the source to x, y (both included), walked back through the predecessors. Only x, y if it is
+        # not reached.
+        path = [(x, y)]
+        while (previous := self.predecessor(*path[-1])) is not None:
+            path.append(previous)
+        path.reverse()
+        return path
+
+    def crop(self, min_x: int, max_x: int, min_y: int, max_y: int) -> PredecessorRaster:
+        # Window (inclusive bounds) of the raster, e.g. the bounding box of the tiles within a range: every tile of a
+        # route is at most as far as its last one, so the routes of the tiles within a range stay within it
+        min_x, min_y = max(min_x, self.x), max(min_y, self.y)
+        max_x, max_y = min(max_x, self.x + self.width - 1), min(max_y, self.y + self.height - 1)
+        width, height = max(max_x - min_x + 1, 0), max(max_y - min_y + 1, 0)
+        codes = bytearray(self.code(x, y) for y in range(min_y, min_y + height) for x in range(min_x, min_x + width))
+        ferries = {t: f for t, f in self.ferries.items() if min_x <= t[0] <= max_x and min_y <= t[1] <= max_y}
+        return PredecessorRaster(min_x, min_y, width, height, _pack(codes), ferries)
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            'x': self.x,
+            'y': self.y,
+            'width': self.width,
+            'height': self.height,
+            'ferries': [[*t, *f] for t, f in self.ferries.items()],
+        }).encode('utf8')
+        return _PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + zlib.compress(self.codes, 9)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> PredecessorRaster:
+        magic, version, header_length = _PREAMBLE.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a predecessor raster, or written by another version')
+        header = json.loads(data[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        ferries = {(x, y): (fx, fy) for x, y, fx, fy in header['ferries']}
+        codes = zlib.decompress(data[_PREAMBLE.size + header_length:])
+        return cls(header['x'], header['y'], header['width'], header['height'], codes, ferries)
+
+def save_predecessors(file_name: str, raster: PredecessorRaster) -> None:
+    with open(file_name, 'wb') as fd:
+        fd.write(raster.to_bytes())
+
+def load_predecessors(file_name: str) -> PredecessorRaster:
+    with open(file_name, 'rb') as fd:
+        return PredecessorRaster.from_bytes(fd.read())
@@ -0,0 +1,225 @@
+from __future__ import annotations
+from array import array
+import heapq
+from lib.graph import EDGE_WEIGHTS, TileGraph
+from lib.types import TileDistance
+import math
+import sys
+from typing import Callable, Iterable, Iterator, Sequence
+
+UNREACHABLE = sys.float_info.max
+# Every move weight is a whole number of thousandths: costs are compared with the cutoffs at that precision
+COST_SCALE = 1000
+
+def cost_bound(max_cost: float | None) -> float:
+    # Costs within `max_cost` are the ones strictly below this bound, halfway to the next thousandth: float sums of the
+    # weights are off by far less, so every engine and every range filter agrees on the tiles whose cost is the cutoff
+    if max_cost is None:
+        return math.inf
+    return (round(max_cost * COST_SCALE) + 0.5) / COST_SCALE
+
+class SparseDistances(dict):
+    """
+    Distances of a search only allocated for the tiles it reaches, for searches known to stay within a small part of
+    the map (see lib.components). Other tiles are UNREACHABLE.
+    """
+    def __missing__(self, i: int) -> float:
+        return UNREACHABLE
+
+class DistanceField:
+    """
+    Result of a search: `dist` is indexed like the grid (an array, or SparseDistances) and `settled` lists the reached
+    tiles in the order they were settled (i.e. by increasing distance). Tiles not reached have distance UNREACHABLE.
+    `parents`, if recorded, is the tile each reached tile has been reached from (-1 for the seeds), indexed like `dist`.
+    `pushes` and `stale` count the entries pushed into the queue of the search and the ones popped after their tile had
+    been reached with a lower distance (see lib.metrics).
+    """
+    def __init__(
+        self,
+        dist: array,
+        settled: array,
+        parents: array | dict[int, int] | None = None,
+        pushes: int = 0,
+        stale: int = 0,
+    ):
+        self.dist = dist
+        self.settled = settled
+        self.parents = parents
+        self.pushes = pushes
+        self.stale = stale
+
+    def __len__(self) -> int:
+        return len(self.settled)
+
+    def __getitem__(self, i: int) -> float:
+        return self.dist[i]
+
+    def __contains__(self, i: int) -> bool:
+        return self.dist[i] != UNREACHABLE
+
+    def items(self) -> Iterator[tuple[int, float]]:
+        dist = self.dist
+        return ((i, dist[i]) for i in self.settled)
+
+def dijkstra(
+    graph: TileGraph,
+    seeds: Iterable[tuple[int, float]],
+    max_cost: float | None = None,
+    max_tiles: int | None = None,
+    targets: Iterable[int] | None = None,
+    sparse: bool = False,
+    predecessors: bool = False,
+) -> DistanceField:
+    """
+    Dijkstra's algorithm over `graph`, starting from the `seeds` (tile, initial distance).
+    The search stops expanding once the minimum of the heap is above `max_cost`, once `max_tiles` tiles are settled, or
+    once every tile of `targets` (if given) is settled: tiles beyond the cutoff are left UNREACHABLE.
+    With `sparse`, distances are only allocated for the reached tiles instead of the whole map. With `predecessors`, the
+    tile each tile is reached from is recorded as well (see DistanceField.parents).
+    """
+    pending = None if targets is None else set(targets)
+    offsets, targets, codes = graph.offsets, graph.targets, graph.codes
+    dist = SparseDistances() if sparse else array('d', [UNREACHABLE]) * len(graph)
+    parents = None if not predecessors else {} if sparse else array('i', [-1]) * len(graph)
+    settled = array('i')
+    stale = 0
+    pq = []
+    for s, d in seeds:
+        if d < dist[s]:
+            dist[s] = d
+            if parents is not None:
+                parents[s] = -1
+            heapq.heappush(pq, (d, s))
+    bound = cost_bound(max_cost)
+    if max_tiles is None:
+        max_tiles = len(graph)
+    if pending is not None and not pending:
+        max_tiles = 0
+
+    while len(pq) > 0:
+        # define u ← vertex in Q with minimum dist[u]
+        dist_u, u = heapq.heappop(pq)
+        # Stale entry, u has already been reached with a lower distance
+        if dist_u > dist[u]:
+            stale += 1
+            continue
+        if dist_u >= bound or len(settled) >= max_tiles:
+            heapq.heappush(pq, (dist_u, u))
+            break
+        settled.append(u)
+        if pending is not None and u in pending:
+            pending.discard(u)
+            if not pending:
+                break
+
+        # For each neighbor of u
+        for e in range(offsets[u], offsets[u + 1]):
+            n = targets[e]
+            alt = dist_u + EDGE_WEIGHTS[codes[e]]
+            if alt < dist[n]:
+                dist[n] = alt
+                if parents is not None:
+                    parents[n] = u
+                heapq.heappush(pq, (alt, n))
+
+    # Every entry pushed has been settled, found stale or is left in the queue
+    pushes = len(settled) + stale + len(pq)
+    # Forget the tentative distances of the tiles beyond the cutoff
+    for d, n in pq:
+        if d == dist[n]:
+            if sparse:
+                del dist[n]
+            else:
+                dist[n] = UNREACHABLE
+    return DistanceField(dist, settled, parents, pushes, stale)
+
+def propagate(
+    graph: TileGraph,
+    dist: array,
+    seeds: Iterable[tuple[int, float]],
+    max_cost: float | None = None,
+) -> list[int]:
+    """
+    Decrease-key propagation over `graph` of already computed distances `dist`, updated in place: each seed (tile, distance)
+    lowering the distance of its tile is relaxed onwards, like Dijkstra's algorithm but only through the tiles it improves.
+    Distances above `max_cost` (see cost_bound) are not recorded. It returns the tiles which were UNREACHABLE and are now
+    reached.
+    """
+    offsets, targets, codes = graph.offsets, graph.targets, graph.codes
+    bound = cost_bound(max_cost)
+    reached = []
+    pq = []
+    for s, d in seeds:
+        if d < dist[s] and d < bound:
+            if dist[s] == UNREACHABLE:
+                reached.append(s)
+            dist[s] = d
+            heapq.heappush(pq, (d, s))
+
+    while len(pq) > 0:
+        dist_u, u = heapq.heappop(pq)
+        if dist_u > dist[u]:
+            continue
+        for e in range(offsets[u], offsets[u + 1]):
+            n = targets[e]
+            alt = dist_u + EDGE_WEIGHTS[codes[e]]
+            if alt < dist[n] and alt < bound:
+                if dist[n] == UNREACHABLE:
+                    reached.append(n)
+                dist[n] = alt
+                heapq.heappush(pq, (alt, n))
+    return reached
+
+def astar(
+    graph: TileGraph,
+    source: int,
+    target: int,
+    heuristic: Callable[[int], float],
+    boarding: Iterable[int] = (),
+) -> tuple[float | None, list[int], int]:
+    """
+    A* search from `source` to `target` over `graph`. `heuristic` must never overestimate the cost to reach `target`
+    and be consistent, so that each tile is settled once. `boarding` tiles are reached from `source` at no cost.
+    It returns the cost (None if `target` is not reachable), the path of tiles and the number of settled tiles.
+    Only the explored tiles are stored, in dicts.
+    """
+    offsets, targets, codes = graph.offsets, graph.targets, graph.codes
+    dist = {source: 0}
+    predecessors = {source: source}
+    pq = [(heuristic(source), 0, source)]
+    for n in boarding:
+        if n not in dist:
+            dist[n] = 0
+            predecessors[n] = source
+            heapq.heappush(pq, (heuristic(n), 0, n))
+
+    settled = 0
+    while len(pq) > 0:
+        _, dist_u, u = heapq.heappop(pq)
+        # Stale entry, u has already been reached with a lower distance
+        if dist_u > dist[u]:
+            continue
+        settled += 1
+        if u == target:
+            return dist_u, reconstruct_path(predecessors, target), settled
+
+        for e in range(offsets[u], offsets[u + 1]):
+            n = targets[e]
+            alt = dist_u + EDGE_WEIGHTS[codes[e]]
+            if alt < dist.get(n, UNREACHABLE):
+                dist[n] = alt
+                predecessors[n] = u
+                heapq.heappush(pq, (alt + heuristic(n), alt, n))
+    return None, [], settled
+
+def reconstruct_path(predecessors: dict[int, int], target: int) -> list[int]:
+    # The source is its own predecessor
+    path = [target]
+    while predecessors[path[-1]] != path[-1]:
+        path.append(predecessors[path[-1]])
+    path.reverse()
+    return path
+
+def to_tile_distances(dist: DistanceField, width: int, x0: int = 0, y0: int = 0) -> Sequence[TileDistance]:
+    # `x0, y0` is the origin of the grid the field has been computed on
+    return [TileDistance(x0 + i % width, y0 + i // width, d) for i, d in dist.items()]
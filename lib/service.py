@@ -0,0 +1,223 @@
+from __future__ import annotations
+import asyncio
+from collections import OrderedDict
+import json
+import math
+from lib.map import TileMap
+from lib.matrix import town_costs
+from lib.metrics import METRICS, nbytes
+from lib.parallel import SearchPool
+from lib.search import DistanceField, cost_bound, to_tile_distances
+from typing import Any, Hashable, Sequence
+from urllib.parse import parse_qs, urlsplit
+
+def _covers(cutoff: float | None, max_cost: float | None) -> bool:
+    # Whether a field searched up to `cutoff` holds every tile within `max_cost`, None meaning no cutoff
+    return cutoff is None or (max_cost is not None and cutoff >= max_cost)
+
+def _cutoff_order(cutoff: float | None) -> float:
+    return math.inf if cutoff is None else cutoff
+
+class FieldCache:
+    """
+    Least recently used distance fields of towns, each one searched up to a cost (None without cutoff), within a memory
+    `budget` in bytes (see lib.metrics.nbytes): storing a field evicts the least recently used ones until the total fits.
+    A field larger than the whole budget is not kept. A field answers any lower cost too, so storing one drops the
+    fields of the same town it covers.
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.nbytes = 0
+        self._fields: OrderedDict[tuple[Hashable, float | None], tuple[DistanceField, int]] = OrderedDict()
+        # Cutoffs of the cached fields of each town
+        self._cutoffs: dict[Hashable, set[float | None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def get(self, town: Hashable, max_cost: float | None = None) -> DistanceField | None:
+        # Field of `town` searched up to `max_cost` at least, the one with the lowest cutoff if there are several
+        cutoffs = [c for c in self._cutoffs.get(town, ()) if _covers(c, max_cost)]
+        if not cutoffs:
+            return None
+        key = town, min(cutoffs, key=_cutoff_order)
+        self._fields.move_to_end(key)
+        return self._fields[key][0]
+
+    def put(self, town: Hashable, max_cost: float | None, field: DistanceField) -> None:
+        size = nbytes(field)
+        for cutoff in [c for c in self._cutoffs.get(town, ()) if _covers(max_cost, c)]:
+            self._remove((town, cutoff))
+        if size > self.budget:
+            return
+        while self.nbytes + size > self.budget:
+            self._remove(next(iter(self._fields)))
+        self._fields[town, max_cost] = field, size
+        self._cutoffs.setdefault(town, set()).add(max_cost)
+        self.nbytes += size
+
+    def _remove(self, key: tuple[Hashable, float | None]) -> None:
+        town, cutoff = key
+        self.nbytes -= self._fields.pop(key)[1]
+        self._cutoffs[town].discard(cutoff)
+        if not self._cutoffs[town]:
+            del self._cutoffs[town]
+
+class QueryError(Exception):
+    # Request which cannot be answered, with its HTTP status
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class QueryService:
+    """
+    Answers queries about the (name, x, y) `towns` of a costed map kept in memory. Searches run in the workers of `pool`,
+    so that concurrent queries do not block each other, and their fields are kept in `cache`: a field searched up to a
+    cost answers the queries of any lower one, filtered by the queries. Concurrent queries share the searches too.
+    """
+    def __init__(self, tile_map: TileMap, towns: Sequence[tuple[str, int, int]], pool: SearchPool, cache: FieldCache):
+        self.tile_map = tile_map
+        self.towns = {name: (x, y) for name, x, y in towns}
+        self.pool = pool
+        self.cache = cache
+        self._names = [name for name, _, _ in towns]
+        self._keys = [tile_map.grid.index(x, y) for _, x, y in towns]
+        # Searches running, by town and cutoff
+        self._pending: dict[tuple[Hashable, float | None], asyncio.Future[DistanceField]] = {}
+
+    def _town(self, query: dict[str, str]) -> tuple[int, int]:
+        name = query.get('town', '').lower()
+        if name not in self.towns:
+            raise QueryError(404, f'unknown town: {name!r}')
+        return self.towns[name]
+
+    async def field(self, x: int, y: int, max_cost: float | None = None) -> DistanceField:
+        # Field of the town in x, y, searched up to `max_cost` at least: it may go further, callers filter it
+        town = (x, y)
+        field = self.cache.get(town, max_cost)
+        if field is not None:
+            return field
+        running = [c for t, c in self._pending if t == town and _covers(c, max_cost)]
+        key = (town, min(running, key=_cutoff_order) if running else max_cost)
+        if key not in self._pending:
+            self._pending[key] = asyncio.wrap_future(self.pool.submit(self.tile_map.sources(x, y), max_cost=max_cost))
+        try:
+            field = await asyncio.shield(self._pending[key])
+        finally:
+            self._pending.pop(key, None)
+        self.cache.put(*key, field)
+        return field
+
+    async def distances(self, query: dict[str, str]) -> list[list[int | float]]:
+        # Same layout as the JSON files of utils.save_distances
+        x, y = self._town(query)
+        max_cost = _number(query, 'max_cost')
+        field = await self.field(x, y, max_cost)
+        bound = cost_bound(max_cost)
+        grid = self.tile_map.grid
+        def convert() -> list[list[int | float]]:
+            distances = to_tile_distances(field, grid.width, grid.x0, grid.y0)
+            return [[d.x, d.y, d.distance] for d in distances if d.distance < bound]
+        return await asyncio.to_thread(convert)
+
+    async def cost(self, query: dict[str, str]) -> dict[str, Any]:
+        # Cost from a town to tile x, y: read from a cached field if any, otherwise found by TileMap.shortest_path
+        x, y = self._town(query)
+        tx, ty = _integer(query, 'x'), _integer(query, 'y')
+        grid = self.tile_map.grid
+        if not grid.has(tx, ty) or not self.tile_map.is_reachable((x, y), (tx, ty)):
+            return {'cost': None}
+        target = grid.index(tx, ty)
+        field = self.cache.get((x, y))
+        if field is None:
+            route = await asyncio.to_thread(self.tile_map.shortest_path, (x, y), (tx, ty))
+            return {'cost': route.cost}
+        return {'cost': field[target] if target in field else None}
+
+    async def reachable(self, query: dict[str, str]) -> dict[str, Any]:
+        # Number of tiles and towns (with their cost) within `max_cost` of a town
+        x, y = self._town(query)
+        max_cost = _number(query, 'max_cost', required=True)
+        field = await self.field(x, y, max_cost)
+        costs = town_costs(field, self._keys)
+        bound = cost_bound(max_cost)
+        return {
+            'tiles': sum(1 for _, d in field.items() if d < bound),
+            'towns': {name: c for name, c in zip(self._names, costs) if c is not None and c < bound},
+        }
+
+    async def status(self, _: dict[str, str]) -> dict[str, Any]:
+        return {'fields': len(self.cache), 'cached_bytes': self.cache.nbytes, 'budget_bytes': self.cache.budget}
+
+    ROUTES = {
+        '/distances': distances,
+        '/cost': cost,
+        '/reachable': reachable,
+        '/status': status,
+    }
+
+    async def handle(self, target: str) -> tuple[int, Any]:
+        # Status and JSON body of the answer to GET `target` (path and query string)
+        url = urlsplit(target)
+        if url.path not in self.ROUTES:
+            return 404, {'error': f'unknown path: {url.path}'}
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            return 200, await self.ROUTES[url.path](self, query)
+        except QueryError as e:
+            return e.status, {'error': str(e)}
+
+def _number(query: dict[str, str], name: str, required: bool = False) -> float | None:
+    if name not in query:
+        if required:
+            raise QueryError(400, f'missing parameter: {name}')
+        return None
+    try:
+        value = float(query[name])
+    except ValueError:
+        raise QueryError(400, f'{name} must be a number, got {query[name]!r}')
+    if not math.isfinite(value):
+        raise QueryError(400, f'{name} must be a finite number, got {query[name]!r}')
+    return value
+
+def _integer(query: dict[str, str], name: str) -> int:
+    # Required integer parameter
+    if name not in query:
+        raise QueryError(400, f'missing parameter: {name}')
+    try:
+        return int(query[name])
+    except ValueError:
+        raise QueryError(400, f'{name} must be an integer, got {query[name]!r}')
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+async def _serve_connection(service: QueryService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # One request per connection: request line, headers (ignored) then the answer
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        if len(request_line) != 3:
+            status, body = 400, {'error': 'malformed request'}
+        elif request_line[0] != 'GET':
+            status, body = 405, {'error': 'only GET is supported'}
+        else:
+            try:
+                status, body = await service.handle(request_line[1])
+            except Exception as e:
+                status, body = 500, {'error': f'{type(e).__name__}: {e}'}
+        payload = (await asyncio.to_thread(json.dumps, body)).encode('utf8')
+        writer.write(
+            f'HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode('latin-1')
+        )
+        writer.write(payload)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(service: QueryService, host: str, port: int) -> None:
+    server = await asyncio.start_server(lambda r, w: _serve_connection(service, r, w), host, port)
+    METRICS.progress(f'Serving on http://{host}:{port}')
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import gzip
+import io
+import json
+import random
+from typing import Any, Sequence
+import zipfile
+
+# Files of the multi files (uncompressed dict format) archive, as expected by utils.stream_map
+MULTI_FILE_MAP = [
+    'plots_0.json',
+    'plots_1.json',
+    'plots_2.json',
+    'plots_3.json',
+]
+
+def _value_noise(width: int, height: int, cell: int, rng: random.Random) -> list[float]:
+    # Random values in [0, 1) on a grid of `cell` tiles, bilinearly interpolated over the map, row-major
+    columns, rows = width // cell + 2, height // cell + 2
+    knots = [[rng.random() for _ in range(columns)] for _ in range(rows)]
+    values = []
+    for y in range(height):
+        row, fy = divmod(y / cell, 1)
+        top, bottom = knots[int(row)], knots[int(row) + 1]
+        for x in range(width):
+            column, fx = divmod(x / cell, 1)
+            c = int(column)
+            upper = top[c] + (top[c + 1] - top[c]) * fx
+            lower = bottom[c] + (bottom[c + 1] - bottom[c]) * fx
+            values.append(upper + (lower - upper) * fy)
+    return values
+
+def _quantile(values: Sequence[float], ratio: float) -> float:
+    if ratio <= 0:
+        return min(values) - 1
+    ordered = sorted(values)
+    return ordered[min(int(ratio * len(ordered)), len(ordered) - 1)]
+
+def generate_map(
+    width: int,
+    height: int,
+    seed: int = 0,
+    roughness: float = 0.3,
+    forest: float = 0.3,
+    sea: float = 0.4,
+    ferries: int = 10,
+) -> tuple[list[list[int | None]], list[dict[str, Any]]]:
+    """
+    Seeded Mercatorio-like map of `width` x `height` tiles: tiles in the compressed array format (see
+    lib.utils.put_entry) and ferries in the format of the ferries data. Altitudes are value noise over
+    two scales, `roughness` (0 to 1) being the weight of the small scale one. The lowest `sea` share of the tiles is sea,
+    `forest` is the share of the land tiles covered by (clustered) forests, and the `ferries` link coastal sea tiles.
+    """
+    rng = random.Random(seed)
+    broad = _value_noise(width, height, max(width, height) // 4 or 1, rng)
+    detail = _value_noise(width, height, 4, rng)
+    relief = [(1 - roughness) * b + roughness * d for b, d in zip(broad, detail)]
+    sea_level = _quantile(relief, sea)
+    woods = _value_noise(width, height, 8, rng)
+    land_woods = [w for w, r in zip(woods, relief) if r > sea_level]
+    forest_level = _quantile(land_woods, 1 - forest) if land_woods and forest > 0 else 2
+
+    entries = []
+    is_sea = bytearray(width * height)
+    for i, r in enumerate(relief):
+        y, x = divmod(i, width)
+        if r <= sea_level:
+            is_sea[i] = 1
+            entries.append([x, y, -round((sea_level - r) * 100), 0, None, None, None, None, 1, 1])
+        else:
+            alt = round((r - sea_level) * 600)
+            tile_forest = rng.randint(1, 3) if woods[i] > forest_level else None
+            entries.append([x, y, alt, rng.randint(0, 100), tile_forest, None, None, 1 + x * 4 // width, None, None])
+
+    # Ferries between sea tiles next to the land
+    coast = [
+        i for i in range(width * height)
+            if is_sea[i] and any(
+                0 <= i % width + dx < width and 0 <= i // width + dy < height and not is_sea[i + dy * width + dx]
+                    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+            )
+    ]
+    ferry_data = []
+    for _ in range(ferries if len(coast) > 1 else 0):
+        tile, *landings = rng.sample(coast, min(len(coast), rng.randint(2, 4)))
+        ferry_data.append({
+            'location': {'x': tile % width, 'y': tile // width},
+            'landings': [{'location': {'x': l % width, 'y': l // width}} for l in landings],
+        })
+    rng.shuffle(entries)
+    return entries, ferry_data
+
+def generate_towns(entries: Sequence[Sequence[int | None]], count: int, seed: int = 0) -> list[dict[str, Any]]:
+    # Towns on random land tiles, in the format of the towns data
+    rng = random.Random(seed)
+    land = [(e[0], e[1]) for e in entries if e[9] is None]
+    return [{'name': f'Town{k}', 'location': {'x': x, 'y': y}} for k, (x, y) in enumerate(rng.sample(land, min(count, len(land))))]
+
+def to_uncompressed(entry: Sequence[int | None]) -> dict[str, Any]:
+    # Uncompressed dict format (see lib.utils.put_entry): missing attributes are left out
+    names = ('alt', 'fertility', 'forest', 'res', 'res_amount', 'region', 'area', 'type')
+    return {'x': entry[0], 'y': entry[1], 'data': {n: v for n, v in zip(names, entry[2:]) if v is not None}}
+
+def save_map_archive(entries: Sequence[Sequence[int | None]], path: str, compressed: bool = True) -> None:
+    """
+    Saves the tiles as a map archive: a gzip JSON array of the compressed array format (like map_compressed.gz), or a
+    zip of the uncompressed dict format split over MULTI_FILE_MAP (like the multi files map). `path` must end in .gz
+    for the former.
+    """
+    if compressed:
+        with gzip.open(path, 'wt', encoding='utf8') as fd:
+            json.dump(entries, fd)
+        return
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        part = -(-len(entries) // len(MULTI_FILE_MAP))
+        for k, name in enumerate(MULTI_FILE_MAP):
+            buffer = io.StringIO()
+            json.dump([to_uncompressed(e) for e in entries[k * part:(k + 1) * part]], buffer)
+            archive.writestr(name, buffer.getvalue())
@@ -1,14 +1,29 @@
 from __future__ import annotations
 from dataclasses import dataclass
-import heapq
-import sys
 from typing import Sequence
 
 MAX_HEIGHT = 4096
 MAX_WIDTH = 4096
 
+# Neighbour offsets (dx, dy), in the same order as the weight planes of TileMap
+DIRECTIONS = (
+    (0, -1), # up
+    (-1, 0), # left
+    (1, 0), # right
+    (0, 1), # down
+    (-1, -1), # up_left
+    (1, -1), # up_right
+    (-1, 1), # down_left
+    (1, 1), # down_right
+)
+
 def hash_coords(x: int, y: int) -> int:
-    return hash((x, y))
+    # Flat index of the tile in a row-major MAX_WIDTH x MAX_HEIGHT grid
+    return y * MAX_WIDTH + x
+
+def unhash_coords(key: int) -> tuple[int, int]:
+    y, x = divmod(key, MAX_WIDTH)
+    return x, y
 
 @dataclass(frozen=True)
 class Tile:
@@ -129,56 +144,20 @@ class FerryInfo(Tile):
     )
     ferries: set[int]
 
-class TileWeight(TileInfo):
-    __slots__ = (
-        'ferries',
-        'up_weight',
-        'left_weight',
-        'right_weight',
-        'down_weight',
-        'up_left_weight',
-        'up_right_weight',
-        'down_left_weight',
-        'down_right_weight',
-    )
-    ferries: set[int]
-    up_weight: int | None
-    left_weight: int | None
-    right_weight: int | None
-    down_weight: int | None
-    up_left_weight: int | None
-    up_right_weight: int | None
-    down_left_weight: int | None
-    down_right_weight: int | None
-
-    @property
-    def adjacency_keys(self) -> Sequence[int]:
-        return super().adjacency_keys + self.ferries
-
-    def distance(self, key: int) -> int | None:
-        if key in self.ferries:
-            return 0
-        if key == self.up_key:
-            return self.up_weight
-        if key == self.left_key:
-            return self.left_weight
-        if key == self.right_key:
-            return self.right_weight
-        if key == self.down_key:
-            return self.down_weight
-        if key == self.up_left_key:
-            return self.up_left_weight
-        if key == self.up_right_key:
-            return self.up_right_weight
-        if key == self.down_left_key:
-            return self.down_left_weight
-        if key == self.down_right_key:
-            return self.down_right_weight
-        return None
-
 @dataclass(frozen=True)
 class TileDistance(Tile):
     __slots__ = (
         'distance',
     )
     distance: int | None
+
+@dataclass(frozen=True)
+class Route:
+    __slots__ = (
+        'cost',
+        'path',
+        'settled',
+    )
+    cost: float | None # None if the destination is not reachable
+    path: Sequence[tuple[int, int]] # coordinates of the tiles from source to destination, both included
+    settled: int # number of tiles settled by the search
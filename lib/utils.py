@@ -1,7 +1,14 @@
 from __future__ import annotations
-from lib.types import FerryInfo, TileInfo, TileWeight, hash_coords
+from lib.grid import TileGrid
+from lib.types import FerryInfo, TileInfo, hash_coords
 from typing import Sequence
 
+# Bump whenever the rules below change: it invalidates the costs saved by lib.cache
+COST_RULES_VERSION = 1
+
+STRAIGHT_LENGTH = 1
+DIAGONAL_LENGTH = 1.414
+
 def compute_weight(src: TileInfo, dest: TileInfo, neighbors: Sequence[TileInfo] = (), is_source_town: bool = False) -> float | None:
     # Land movement cost: The cost of one move is l * c + p where 
     # - c is cost of passing through forest (1 for no forest, 1.5 if one plot has forest and 2 if both origin and destination has)
@@ -15,7 +22,7 @@ def compute_weight(src: TileInfo, dest: TileInfo, neighbors: Sequence[TileInfo]
     if not is_source_town and not _is_crossable(src, dest, neighbors=neighbors):
         return None
 
-    l = 1.414 if src.is_diagonal(dest) else 1
+    l = DIAGONAL_LENGTH if src.is_diagonal(dest) else STRAIGHT_LENGTH
     c = _forest_cost(src, dest)
     p = _height_penalty(abs(src.alt - dest.alt))
 
@@ -75,38 +82,42 @@ def _height_penalty(height: int) -> float:
         return 5
     return 20
 
-def convert(entry: dict | Sequence[int | None]) -> TileWeight:
+def _weight_table() -> tuple[float | None, ...]:
+    # Every value compute_weight can return: l * c + p for land moves (sea moves are the same as c = 1 and p = 0).
+    # Code 0 is reserved for non crossable moves.
+    weights = [None]
+    for l in (STRAIGHT_LENGTH, DIAGONAL_LENGTH):
+        for c in (1, 1.5, 2):
+            for p in (_height_penalty(h) for h in (0, 25, 75, 125)):
+                if l * c + p not in weights:
+                    weights.append(l * c + p)
+    return tuple(weights)
+
+# Weights are stored as one byte codes indexing this table
+WEIGHTS = _weight_table()
+_WEIGHT_CODES = {w: code for code, w in enumerate(WEIGHTS)}
+
+def weight_code(weight: float | None) -> int:
+    return _WEIGHT_CODES[weight]
+
+def put_entry(grid: TileGrid, entry: dict | Sequence[int | None]) -> None:
+    # Map entry, in either the compressed (list) or the uncompressed (dict) format, written straight into the grid
     if isinstance(entry, dict):
-        return _convert_from_uncompressed(entry)
-    return _convert_from_compressed(entry)
-
-def _convert_from_compressed(arr: Sequence[int | None]) -> TileWeight:
-    return TileWeight(
-        x=arr[0],
-        y=arr[1],
-        alt=arr[2],
-        fertility=arr[3],
-        forest=arr[4],
-        res=arr[5],
-        res_amount=arr[6],
-        region=arr[7],
-        area=arr[8],
-        type=arr[9],
-    )
-
-def _convert_from_uncompressed(entry: dict) -> TileWeight:
-    return TileWeight(
-        x=entry['x'],
-        y=entry['y'],
-        alt=entry['data'].get('alt'),
-        fertility=entry['data'].get('fertility'),
-        forest=entry['data'].get('forest'),
-        res=entry['data'].get('res'),
-        res_amount=entry['data'].get('res_amount'),
-        region=entry['data'].get('region'),
-        area=entry['data'].get('area'),
-        type=entry['data'].get('type'),
-    )
+        data = entry['data']
+        grid.put(
+            entry['x'],
+            entry['y'],
+            data.get('alt'),
+            data.get('fertility'),
+            data.get('forest'),
+            data.get('res'),
+            data.get('res_amount'),
+            data.get('region'),
+            data.get('area'),
+            data.get('type'),
+        )
+    else:
+        grid.put(*entry[:10])
 
 def convert_ferry(entry: dict) -> FerryInfo:
     return FerryInfo(
@@ -115,28 +126,5 @@ def convert_ferry(entry: dict) -> FerryInfo:
         ferries={hash_coords(l['location']['x'], l['location']['y']) for l in entry['landings']} if entry['landings'] is not None else {}
     )
 
-def size_logger(message: str, data: object, unit: str = 'B') -> None:
-    """
-    It logs the size of 'data' in the 'message', in the position where the placeholder 'size' has been positioned.
-    It also accepts a 'unit' keyword arg, where the allowed values are 'B', 'KB', 'MB', 'GB' used for proper formatting.
-
-    To compute size, it uses the external dependency pympler. If the module is not installed, it will skip logging.
-    """
-    try:
-        from pympler.asizeof import asizeof
-        size = asizeof(data)
-        if unit.upper() == 'KB':
-            size = size / 1024
-        elif unit.upper() == 'MB':
-            size = size / 1024 / 1024
-        elif unit.upper() == 'GB':
-            size = size / 1024 / 1024 / 1024
-        print(message.format(size=size))
-    except ModuleNotFoundError:
-        print("""
-Warning: 'pympler' module is not installed. If you want to have some debugging information about memory foot prints, please run:
-pip install pympler
-            """)
-
 # jq 'map([.x,.y,.data.alt,.data.fertility,.data.forest,.data.res,.data.res_amount,.data.region,.data.area,.data.type])'
 # jq -s '.[0] + .[1] + .[2] + .[3]'
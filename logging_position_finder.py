@@ -1,7 +1,7 @@
-from lib.types import TileDistance, TileWeight
-import os.path
+from lib.coverage import ForestCoverage, circle_spans, in_circle
+from lib.types import TileInfo
 from typing import Sequence, Iterable, Tuple
-from utils import decompress, load_map
+from utils import load_map_window
 
 
 #    ^
@@ -26,26 +26,8 @@ from utils import decompress, load_map
 # -7             o o o o o
 
 def circle_boundaries(radius) -> Sequence[Tuple[int, int, int]]:
-    # Radius needs to be an integer for this grid-based approach
-    radius = radius - 1 # excluding the center
-    boundaries = []
-    
-    # Determine the size of the grid
-    for x in range(-radius, radius + 1):
-        line_boundaries = []
-        for y in range(-radius, radius + 1):
-            # Equation of a circle: x^2 + y^2 = r^2
-            distance = (x**2 + y**2)**0.5
-            # if radius - 0.5 <= distance <= radius:
-            if radius - 0.5 <= distance <= radius + 0.5:
-                line_boundaries.append(y)
-                # print("#", end="")
-            else:
-                # print(" ", end="")
-                pass
-        boundaries.append((x, min(line_boundaries), max(line_boundaries)))
-        # print()
-    return boundaries
+    # Cached: see lib.coverage.circle_spans
+    return circle_spans(radius)
 
 def compute_ranges(coords: Tuple[int, int], radius: int) -> Sequence[Tuple[Tuple[int, int], Tuple[int, int]]]:
     x, y = coords
@@ -56,62 +38,31 @@ def compute_ranges(coords: Tuple[int, int], radius: int) -> Sequence[Tuple[Tuple
         ranges.append(((x + offset_x, y + offset_y_left), (x + offset_x, y + offset_y_right)))
     return ranges
 
-def is_in_range(target: tuple[int, int], t: TileWeight, radius: int = 8) -> bool:
-    # ranges = [
-    #     [(target_x + 7, target_y - 2), (target_x + 7, target_y + 2)],
-    #     [(target_x + 6, target_y - 4), (target_x + 6, target_y + 4)],
-    #     [(target_x + 5, target_y - 5), (target_x + 5, target_y + 5)],
-    #     [(target_x + 4, target_y - 6), (target_x + 4, target_y + 6)],
-    #     [(target_x + 3, target_y - 6), (target_x + 3, target_y + 6)],
-    #     [(target_x + 2, target_y - 7), (target_x + 2, target_y + 7)],
-    #     [(target_x + 1, target_y - 7), (target_x + 1, target_y + 7)],
-
-    #     [(target_x + 0, target_y - 7), (target_x + 0, target_y + 7)],
-
-    #     [(target_x - 1, target_y - 7), (target_x - 1, target_y + 7)],
-    #     [(target_x - 2, target_y - 7), (target_x - 2, target_y + 7)],
-    #     [(target_x - 3, target_y - 6), (target_x - 3, target_y + 6)],
-    #     [(target_x - 4, target_y - 6), (target_x - 4, target_y + 6)],
-    #     [(target_x - 5, target_y - 5), (target_x - 5, target_y + 5)],
-    #     [(target_x - 6, target_y - 4), (target_x - 6, target_y + 4)],
-    #     [(target_x - 7, target_y - 2), (target_x - 7, target_y + 2)],
-    # ]
-    ranges = compute_ranges(target, radius)
-
-    # print(target)
-    # print((t.x, t.y))
-    # print(ranges)
-
-    def _in_interval(left_interval: tuple[int, int], right_interval: tuple[int, int]) -> bool:
-        return t.x == left_interval[0] and t.x == right_interval[0] and left_interval[1] <= t.y <= right_interval[1]
-
-    in_range = False
-    for r in ranges:
-        r_left, r_right = r
-        in_range = in_range or _in_interval(r_left, r_right)
-
-    # print(in_range)
-    return in_range
+def is_in_range(target: tuple[int, int], t: TileInfo, radius: int = 8) -> bool:
+    return in_circle(target, t.x, t.y, radius)
 
 # MAP_ARCHIVE = 'map_compressed.gz' # Currently missing some tiles for some reason.
 MAP_ARCHIVE = 'compressed.zip'
-MAP_DIR = 'map'
-
-# If MAP_DIR doesn't exists yet or is still empty
-if not os.path.isdir(MAP_DIR) or not os.listdir(MAP_DIR):
-    decompress(MAP_ARCHIVE, MAP_DIR)
+MAP_CHUNKS = 'map.chunks'
 
 c_x, c_y = (2090, 3150)
 size = 46
 min_x, max_x, min_y, max_y = (c_x - size / 2, c_x + size / 2, c_y - size / 2, c_y + size / 2)
 
-tiles_map = load_map(MAP_DIR)
+OUTPOST_RADIUS = 8
+CLAIM_LIMIT_X = 2097 # limit for claimable tiles
+
+# Only the tiles around the camps are read, with enough margin for the circles of the outposts near the border
+tiles_map = load_map_window(
+    MAP_ARCHIVE, MAP_CHUNKS,
+    int(min_x) - OUTPOST_RADIUS, int(max_x) + OUTPOST_RADIUS, int(min_y) - OUTPOST_RADIUS, int(max_y) + OUTPOST_RADIUS,
+)
 
 existing_camp_1 = (2105, 3131)
 existing_camp_2 = (2104, 3142)
 # existing_camp_3 = (2093, 3152) Soon to be
 
-def _print(target: tuple[int, int], tiles: Sequence[Sequence[TileWeight]], outpost: tuple[int, int] = None):
+def _print(target: tuple[int, int], tiles: Sequence[Sequence[TileInfo]], outpost: tuple[int, int] = None):
     target_x, target_y = target
     # tiles.sort(key=lambda t_row: -t_row[0].x)
     print(f'target: {target_x}, {target_y}')
@@ -135,7 +86,7 @@ def _print(target: tuple[int, int], tiles: Sequence[Sequence[TileWeight]], outpo
                     str_to_print += '#'
                 elif is_in_range(target, t):
                     str_to_print += 'O'
-                elif t.x >= 2097: # limit for claimable tiles
+                elif t.x >= CLAIM_LIMIT_X:
                     str_to_print += 'X'
                 else:
                     if outpost is not None and is_in_range(outpost, t, radius=30):
@@ -147,7 +98,7 @@ def _print(target: tuple[int, int], tiles: Sequence[Sequence[TileWeight]], outpo
         print(str_to_print)
 
 # Group by rows
-def to_matrix(tiles: Iterable[TileWeight]) -> Sequence[Sequence[TileWeight]]:
+def to_matrix(tiles: Iterable[TileInfo]) -> Sequence[Sequence[TileInfo]]:
     tiles_of_interest_dict = {}
 
     for t in tiles:
@@ -162,29 +113,31 @@ def to_matrix(tiles: Iterable[TileWeight]) -> Sequence[Sequence[TileWeight]]:
     matrix.sort(key=lambda t_row: -t_row[0].x)
     return matrix
 
-tiles_of_interest = to_matrix(filter(lambda t: min_x < t.x < max_x and min_y < t.y < max_y, tiles_map))
+tiles_of_interest = to_matrix(filter(lambda t: min_x < t.x < max_x and min_y < t.y < max_y, tiles_map.window(int(min_x), int(max_x), int(min_y), int(max_y))))
 
 # _print(tiles_of_interest)
 
 outpost = (2099, 3155)  # +2, +5
 targets = [(2090, 3150), (2093, 3152)]
 
+# Forest tiles of the area of interest (without the margin) not covered by the existing camps yet
+coverage = ForestCoverage(
+    tiles_map, radius=OUTPOST_RADIUS, camps=[existing_camp_1, existing_camp_2],
+    area=(int(min_x) + 1, int(max_x) - 1, int(min_y) + 1, int(max_y) - 1),
+)
+
 def count_forest_tiles(targets: Sequence[tuple[int, int]]) -> Sequence[tuple[tuple[int, int], int]]:
-    results = []
-    for target in targets:
-        c = 0
-        for t_row in tiles_of_interest:
-            for t in t_row:
-                if is_in_range(target, t) and t.forest is not None and not (is_in_range(existing_camp_1, t) or is_in_range(existing_camp_2, t)):
-                    c += 1
-        results.append((target, c))
-    return results
+    return [(target, coverage.count(*target)) for target in targets]
 
 # Possible outposts
 # 2099, 3150
 # 2097, 3150
 print(count_forest_tiles(targets))
 
+# Best outposts among the claimable land tiles of the area
+claimable = [(t.x, t.y) for t_row in tiles_of_interest for t in t_row if t.x < CLAIM_LIMIT_X and t.type is None]
+print(coverage.best(5, claimable))
+
 # (2105, 3135) ok, but on the bottom limit for x for claiming territories. Maybe moving it to the "left" (i.e. lower y)
 
 _print((2090, 3150), tiles_of_interest, outpost=outpost)
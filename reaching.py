@@ -0,0 +1,11 @@
+import json
+from lib.inverted import load_index
+import sys
+
+# Prints the towns reaching tile X, Y within COST (the largest --range of the batch by default) with their cost, as a
+# JSON list of [town, cost] by increasing cost, out of the index saved with --index (e.g. distances/towns.index)
+if len(sys.argv) not in (4, 5):
+    sys.exit(f'usage: {sys.argv[0]} FILE.index X Y [COST]')
+index = load_index(sys.argv[1])
+max_cost = float(sys.argv[4]) if len(sys.argv) == 5 else None
+print(json.dumps(index.reaching(int(sys.argv[2]), int(sys.argv[3]), max_cost)))
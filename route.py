@@ -0,0 +1,10 @@
+import json
+from lib.routes import load_predecessors
+import sys
+
+# Prints the route (JSON list of [x, y], from the town to the tile) to tile X, Y out of the predecessors saved next to
+# the distances of a town with --routes (e.g. distances/suryes.pred), without searching again
+if len(sys.argv) != 4:
+    sys.exit(f'usage: {sys.argv[0]} FILE.pred X Y')
+predecessors = load_predecessors(sys.argv[1])
+print(json.dumps([[x, y] for x, y in predecessors.route(int(sys.argv[2]), int(sys.argv[3]))]))
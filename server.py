@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+from lib.map import SEARCH_ENGINES
+from lib.metrics import METRICS
+from lib.parallel import SearchPool
+from lib.service import FieldCache, QueryService, serve
+from utils import FERRIES_DATA, load_costed_map, load_json, retrieve_or_update_ferries
+
+# MAP_ARCHIVE = 'map_compressed.gz' # Currently missing some tiles for some reason.
+MAP_ARCHIVE = 'compressed.zip'
+TOWN_JSON = 'towns_s2.json'
+FERRIES_JSON = 'ferries.json'
+MAP_CACHE = 'map.cache'
+
+parser = argparse.ArgumentParser(description='Serves distance queries over a costed map kept in memory (see lib/service.py).')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=8000)
+parser.add_argument('--workers', type=int, default=4,
+                    help='Number of worker processes running the searches.')
+parser.add_argument('--memory', type=int, default=2048,
+                    help='Memory budget of the cached distance fields, in MB.')
+parser.add_argument('--engine', choices=tuple(SEARCH_ENGINES), default='heap')
+parser.add_argument('--ferries', default=FERRIES_DATA,
+                    help='URL or local file to get the ferries from.')
+parser.add_argument('--quiet', action='store_true',
+                    help='Do not print the progress messages.')
+
+# Worker processes import this module too: the service must only run in the main one
+if __name__ == '__main__':
+    args = parser.parse_args()
+    METRICS.verbose = not args.quiet
+    retrieve_or_update_ferries(FERRIES_JSON, args.ferries)
+    towns = [(t['name'].lower(), t['location']['x'], t['location']['y']) for t in load_json(TOWN_JSON)]
+    map = load_costed_map(MAP_ARCHIVE, FERRIES_JSON, MAP_CACHE)
+    map.use_engine(args.engine)
+    with SearchPool(map, processes=args.workers) as pool:
+        service = QueryService(map, towns, pool, FieldCache(args.memory * 1024 * 1024))
+        try:
+            asyncio.run(serve(service, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,45 @@
+from lib.grid import TileGrid
+from lib.map import TileMap
+from lib.synthetic import generate_map, generate_towns
+from lib.types import FerryInfo
+from lib.utils import convert_ferry, put_entry
+import pytest
+import random
+from typing import Any, Sequence
+
+# Seeds of the synthetic maps the tests run on, small enough to search every town of each in a few milliseconds
+SEEDS = (1, 2, 3)
+SIZE = 48
+
+def build_map(entries: Sequence[Sequence[int | None]], ferry_data: Sequence[dict[str, Any]]) -> TileMap:
+    # Costed map of synthetic entries (see lib.synthetic.generate_map)
+    grid = TileGrid(SIZE, SIZE)
+    for entry in entries:
+        put_entry(grid, entry)
+    tile_map = TileMap(grid, ferries=ferries(ferry_data))
+    tile_map.compute_costs()
+    return tile_map
+
+def ferries(ferry_data: Sequence[dict[str, Any]]) -> list[FerryInfo]:
+    return [convert_ferry(entry) for entry in ferry_data]
+
+def coastal_towns(entries: Sequence[Sequence[int | None]], count: int, seed: int) -> list[tuple[str, int, int]]:
+    # Towns on land tiles next to the sea: only their searches board the sea, and take the ferries
+    sea = {(e[0], e[1]) for e in entries if e[9] is not None}
+    coast = sorted(
+        (e[0], e[1]) for e in entries
+            if e[9] is None and any((e[0] + dx, e[1] + dy) in sea for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+    )
+    return [(f'Port{k}', x, y) for k, (x, y) in enumerate(random.Random(seed).sample(coast, min(count, len(coast))))]
+
+class SyntheticMap:
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.entries, self.ferry_data = generate_map(SIZE, SIZE, seed, ferries=6)
+        self.map = build_map(self.entries, self.ferry_data)
+        self.towns = [(t['name'], t['location']['x'], t['location']['y']) for t in generate_towns(self.entries, 4, seed)]
+        self.towns += coastal_towns(self.entries, 4, seed)
+
+@pytest.fixture(scope='session', params=SEEDS, ids=lambda seed: f'seed{seed}')
+def synthetic(request: pytest.FixtureRequest) -> SyntheticMap:
+    return SyntheticMap(request.param)
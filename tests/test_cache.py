@@ -0,0 +1,37 @@
+import json
+from lib.cache import cache_key, load_cache, save_cache
+from lib.grid import TileGrid
+
+def test_roundtrip(synthetic, tmp_path):
+    path = str(tmp_path / 'map.cache')
+    tile_map = synthetic.map
+    save_cache(tile_map, path, 'key')
+    loaded = load_cache(path, 'key')
+    assert loaded is not None
+    grid, cached = tile_map.grid, loaded.grid
+    assert (cached.width, cached.height, cached.x0, cached.y0) == (grid.width, grid.height, grid.x0, grid.y0)
+    assert bytes(cached.present) == bytes(grid.present)
+    for name, _ in TileGrid.FIELDS:
+        assert list(getattr(cached, name)) == list(getattr(grid, name)), name
+    assert [bytes(p) for p in loaded.weights] == [bytes(p) for p in tile_map.weights]
+    assert loaded.ferries == tile_map.ferries
+    for name in ('offsets', 'targets', 'codes'):
+        assert list(getattr(loaded.graph, name)) == list(getattr(tile_map.graph, name)), name
+    assert list(loaded.components.labels) == list(tile_map.components.labels)
+    for _, x, y in synthetic.towns:
+        assert dict(loaded.dijkstra(x, y).items()) == dict(tile_map.dijkstra(x, y).items())
+
+def test_other_key_or_missing_file(synthetic, tmp_path):
+    path = str(tmp_path / 'map.cache')
+    assert load_cache(path, 'key') is None
+    save_cache(synthetic.map, path, 'key')
+    assert load_cache(path, 'other') is None
+
+def test_key_follows_the_content(tmp_path):
+    archive, ferries = tmp_path / 'map.gz', tmp_path / 'ferries.json'
+    archive.write_bytes(b'map')
+    ferries.write_text(json.dumps([]))
+    key = cache_key(str(archive), str(ferries))
+    assert cache_key(str(archive), str(ferries)) == key
+    ferries.write_text(json.dumps([{'location': {'x': 0, 'y': 0}, 'landings': []}]))
+    assert cache_key(str(archive), str(ferries)) != key
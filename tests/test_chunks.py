@@ -0,0 +1,33 @@
+from conftest import SIZE, build_map
+from lib.chunks import load_window, read_header, save_chunks
+from lib.map import TileMap
+import pytest
+
+@pytest.mark.parametrize('window', [(0, SIZE - 1, 0, SIZE - 1), (5, 20, 17, 40), (-4, 9, 30, SIZE + 6), (40, 40, 3, 3)])
+def test_window_matches_the_full_grid(synthetic, tmp_path, window):
+    path = str(tmp_path / 'map.chunks')
+    grid = synthetic.map.grid
+    save_chunks(grid, path, key='key', chunk_size=16)
+    assert read_header(path, 'key') is not None
+    assert read_header(path, 'other') is None
+    min_x, max_x, min_y, max_y = window
+    part = load_window(path, *window)
+    for y in range(min_y - 2, max_y + 3):
+        for x in range(min_x - 2, max_x + 3):
+            inside = min_x <= x <= max_x and min_y <= y <= max_y
+            assert part.has(x, y) == (inside and grid.has(x, y)), (x, y)
+            if part.has(x, y):
+                assert part.tile(x, y) == grid.tile(x, y)
+
+def test_map_around_a_town(synthetic, tmp_path):
+    # Without ferries, every tile within the cost is in the window around the town, at the same distance
+    path = str(tmp_path / 'map.chunks')
+    full = build_map(synthetic.entries, [])
+    save_chunks(full.grid, path, chunk_size=16)
+    max_cost = 9
+    for _, x, y in synthetic.towns:
+        local = TileMap.around(path, x, y, max_cost)
+        local.compute_costs()
+        expected = {full.grid.coords(i): round(d, 6) for i, d in full.dijkstra(x, y, max_cost=max_cost).items()}
+        got = {local.grid.coords(i): round(d, 6) for i, d in local.dijkstra(x, y, max_cost=max_cost).items()}
+        assert got == expected
@@ -0,0 +1,35 @@
+from lib.dial import SCALE
+from lib.map import SEARCH_ENGINES
+import pytest
+
+def _distances(tile_map, engine, x, y, max_cost=None):
+    # Thousandths, as the heap engine sums floats and the dial engine exact fixed-point values
+    tile_map.use_engine(engine)
+    try:
+        return {i: round(d * SCALE) for i, d in tile_map.dijkstra(x, y, max_cost=max_cost).items()}
+    finally:
+        tile_map.use_engine('heap')
+
+@pytest.mark.parametrize('max_cost', [None, 12.5], ids=['full', 'max_cost'])
+def test_engines_agree(synthetic, max_cost):
+    for _, x, y in synthetic.towns:
+        reference = _distances(synthetic.map, 'heap', x, y, max_cost)
+        assert len(reference) > 1
+        for engine in SEARCH_ENGINES:
+            assert _distances(synthetic.map, engine, x, y, max_cost) == reference, engine
+
+def test_max_cost_is_a_prefix_of_the_full_search(synthetic):
+    _, x, y = synthetic.towns[0]
+    full = _distances(synthetic.map, 'dial', x, y)
+    cut = _distances(synthetic.map, 'dial', x, y, 12.5)
+    assert cut == {i: d for i, d in full.items() if d <= 12500}
+
+def test_engines_agree_at_a_reached_cutoff(synthetic):
+    # Cutoffs which are the cost of some tile and not exact in binary: those tiles are within the cutoff in both engines
+    for _, x, y in synthetic.towns:
+        full = _distances(synthetic.map, 'dial', x, y)
+        costs = sorted(d for d in set(full.values()) if d % 125)
+        max_cost = costs[len(costs) // 2] / SCALE
+        expected = {i: d for i, d in full.items() if d <= costs[len(costs) // 2]}
+        for engine in SEARCH_ENGINES:
+            assert _distances(synthetic.map, engine, x, y, max_cost) == expected, engine
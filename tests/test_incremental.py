@@ -0,0 +1,53 @@
+from conftest import build_map, ferries
+from lib.incremental import diff_ferries, is_affected, repair
+from lib.search import dijkstra
+import pytest
+
+def _field(tile_map, x, y, max_cost=None):
+    # Dense float field, like the ones read back from the saved files
+    return dijkstra(tile_map.graph, tile_map.sources(x, y), max_cost=max_cost)
+
+def _distances(field):
+    return {i: round(d, 6) for i, d in field.items()}
+
+def _town_ferries(synthetic):
+    # Ferries between the sea tiles closest to consecutive towns: they shorten many paths from both towns
+    sea = [(e[0], e[1]) for e in synthetic.entries if e[9] is not None]
+    def closest(x, y):
+        return min(sea, key=lambda t: abs(t[0] - x) + abs(t[1] - y))
+    ends = [closest(x, y) for _, x, y in synthetic.towns]
+    return [
+        {'location': {'x': a[0], 'y': a[1]}, 'landings': [{'location': {'x': b[0], 'y': b[1]}}]}
+            for a, b in zip(ends, ends[1:] + ends[:1]) if a != b
+    ]
+
+def _scenarios(synthetic):
+    # Half of the ferries replaced by town ferries, and back: ferries on shortest paths are added, then removed
+    changed = synthetic.ferry_data[len(synthetic.ferry_data) // 2:] + _town_ferries(synthetic)
+    return [(synthetic.ferry_data, changed), (changed, synthetic.ferry_data)]
+
+@pytest.mark.parametrize('max_cost', [None, 15], ids=['full', 'max_cost'])
+def test_repair_matches_a_full_recompute(synthetic, max_cost):
+    repaired = 0
+    for old_data, new_data in _scenarios(synthetic):
+        old_map, new_map = build_map(synthetic.entries, old_data), build_map(synthetic.entries, new_data)
+        added, removed = diff_ferries(old_map.grid, ferries(old_data), ferries(new_data))
+        assert added and removed
+        for _, x, y in synthetic.towns:
+            field = _field(old_map, x, y, max_cost)
+            expected = _field(new_map, x, y, max_cost)
+            if not is_affected(field, added, removed):
+                assert _distances(field) == _distances(expected)
+                continue
+            repair(new_map, field, new_map.sources(x, y), added, removed, max_cost=max_cost)
+            repaired += 1
+            assert _distances(field) == _distances(expected)
+            assert [field[i] for i in field.settled] == sorted(field[i] for i in field.settled)
+    assert repaired > 0
+
+def test_no_change_leaves_the_fields_alone(synthetic):
+    old = ferries(synthetic.ferry_data)
+    added, removed = diff_ferries(synthetic.map.grid, old, old)
+    assert not added and not removed
+    _, x, y = synthetic.towns[0]
+    assert not is_affected(_field(synthetic.map, x, y), added, removed)
@@ -0,0 +1,26 @@
+from lib.partition import NO_TOWN, TownRaster
+
+def test_nearest_town_and_cost_are_the_minimum_per_town(synthetic):
+    tile_map = synthetic.map
+    towns = synthetic.towns
+    owners, field = tile_map.nearest_towns(towns)
+    per_town = [tile_map.dijkstra(x, y) for _, x, y in towns]
+    grid = tile_map.grid
+    for i in range(grid.size):
+        costs = [f[i] for f in per_town if i in f]
+        if not costs:
+            assert owners[i] == NO_TOWN and i not in field
+            continue
+        assert abs(field[i] - min(costs)) <= 1e-6
+        owner = per_town[owners[i]]
+        assert i in owner and abs(owner[i] - field[i]) <= 1e-6
+
+def test_town_raster(synthetic):
+    tile_map = synthetic.map
+    names = [name for name, _, _ in synthetic.towns]
+    owners, _ = tile_map.nearest_towns(synthetic.towns)
+    raster = TownRaster.from_bytes(TownRaster.from_owners(names, owners, tile_map.grid).to_bytes())
+    grid = tile_map.grid
+    for i in range(grid.size):
+        expected = None if owners[i] == NO_TOWN else names[owners[i]]
+        assert raster.get(*grid.coords(i)) == expected
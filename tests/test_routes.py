@@ -0,0 +1,67 @@
+from lib.landmarks import Landmarks
+from lib.routes import PredecessorRaster
+import random
+
+def _targets(tile_map, field, count, seed):
+    reached = sorted(field.settled)
+    return [tile_map.grid.coords(i) for i in random.Random(seed).sample(reached, min(count, len(reached)))]
+
+def test_astar_and_alt_costs_match_dijkstra(synthetic):
+    tile_map = synthetic.map
+    for _, x, y in synthetic.towns:
+        field = tile_map.dijkstra(x, y)
+        for tx, ty in _targets(tile_map, field, 10, synthetic.seed):
+            route = tile_map.shortest_path((x, y), (tx, ty), use_landmarks=False)
+            assert abs(route.cost - field[tile_map.grid.index(tx, ty)]) <= 1e-6
+            assert route.path[0] == (x, y) and route.path[-1] == (tx, ty)
+    tile_map.compute_landmarks(4, candidates=[(x, y) for _, x, y in synthetic.towns])
+    try:
+        for _, x, y in synthetic.towns:
+            field = tile_map.dijkstra(x, y)
+            for tx, ty in _targets(tile_map, field, 10, synthetic.seed):
+                route = tile_map.shortest_path((x, y), (tx, ty))
+                assert abs(route.cost - field[tile_map.grid.index(tx, ty)]) <= 1e-6
+    finally:
+        tile_map.use_landmarks(None)
+
+def test_landmarks_round_trip(synthetic, tmp_path):
+    tile_map = synthetic.map
+    landmarks = tile_map.compute_landmarks(4, candidates=[(x, y) for _, x, y in synthetic.towns])
+    tile_map.use_landmarks(None)
+    file_name = str(tmp_path / 'landmarks.bin')
+    landmarks.save(file_name, 'key')
+    loaded = Landmarks.load(file_name, 'key')
+    assert loaded.coords == landmarks.coords
+    assert [field.tolist() for field in loaded.fields] == [field.tolist() for field in landmarks.fields]
+    assert Landmarks.load(file_name, 'other') is None
+
+def test_unreachable_destination(synthetic):
+    tile_map = synthetic.map
+    _, x, y = synthetic.towns[0]
+    field = tile_map.dijkstra(x, y)
+    grid = tile_map.grid
+    unreached = next((grid.coords(i) for i in range(grid.size) if grid.present[i] and i not in field), None)
+    if unreached is not None:
+        assert tile_map.shortest_path((x, y), unreached).cost is None
+
+def _step_cost(tile_map, a, b, town):
+    grid = tile_map.grid
+    i, j = grid.index(*a), grid.index(*b)
+    weights = [w for n, w in tile_map.graph.neighbours(i) if n == j]
+    if not weights:
+        # Tiles boarded from the town are reached at no cost
+        assert a == town
+        return 0
+    return min(weights)
+
+def test_predecessors_walk_back_at_the_field_cost(synthetic):
+    tile_map = synthetic.map
+    grid = tile_map.grid
+    for _, x, y in synthetic.towns:
+        field = tile_map.dijkstra(x, y, predecessors=True)
+        raster = PredecessorRaster.from_bytes(PredecessorRaster.from_field(field, grid.width, grid.x0, grid.y0).to_bytes())
+        for tx, ty in _targets(tile_map, field, 25, synthetic.seed):
+            path = raster.route(tx, ty)
+            assert path[0] == (x, y) and path[-1] == (tx, ty)
+            cost = sum(_step_cost(tile_map, a, b, (x, y)) for a, b in zip(path, path[1:]))
+            assert abs(cost - field[grid.index(tx, ty)]) <= 1e-6
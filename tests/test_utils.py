@@ -0,0 +1,18 @@
+import io
+import json
+import pytest
+from utils import iter_json_array
+
+# Small chunks cut the items (and the separators) anywhere
+CHUNK_SIZES = (1, 2, 3, 5, 1 << 22)
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('text', ['[]', '[ ]', '[1]', '[1,2, 3]', '[ {"a": [1, 2]} , "x,]" ,[ ] ]', '[1.25e3,\n-7]'])
+def test_iter_json_array(text, chunk_size):
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text)
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+@pytest.mark.parametrize('text', ['[1,,2]', '[,1]', '[1,]', '[,]', '[1 2]', '[1', '[1,', '1'])
+def test_iter_json_array_rejects_malformed_arrays(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size))
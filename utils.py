@@ -1,72 +1,302 @@
+from array import array
 import gzip
+import io
 import json
+import re
+import shutil
 import zipfile
-from lib.types import FerryInfo, TileWeight
-from lib.utils import convert, convert_ferry
+from lib.cache import cache_key, load_cache, save_cache
+from lib.chunks import load_window, read_header, save_chunks
+from lib.grid import TileGrid
+from lib.incremental import FerryEdge, is_affected, repair
+from lib.isochrones import isochrones
+from lib.map import TileMap
+from lib.metrics import METRICS
+from lib.partition import TownRaster, save_town_raster
+from lib.pyramid import MANIFEST, save_pyramid
+from lib.raster import load_raster, save_raster
+from lib.routes import PredecessorRaster, save_predecessors
+from lib.search import UNREACHABLE, DistanceField, cost_bound, to_tile_distances
+from lib.types import MAX_HEIGHT, MAX_WIDTH, FerryInfo, TileDistance
+from lib.utils import convert_ferry, put_entry
 import os.path
-from typing import Sequence
+from typing import Any, Iterator, Sequence, TextIO
 from urllib.request import urlretrieve
 
-# How compressed map is unachived
-SINGLE_FILE_MAP_FILE = 'map_data.json'
-# How uncompressed map is unachived
-MULTI_FILE_MAP = [
-    'plots_0.json',
-    'plots_1.json',
-    'plots_2.json',
-    'plots_3.json',
-]
 FERRIES_DATA = 'https://raw.githubusercontent.com/King-BR/Mercatorio-Interactive-Map/refs/heads/master/assets/s2/ferriesData.json'
-
-def _map_json_path(map_dir: str, file_path: str) -> str:
-    return f'{map_dir}/{file_path}'
-
-def _compressed_map_json_path(map_dir: str) -> str:
-    return _map_json_path(map_dir, SINGLE_FILE_MAP_FILE)
-
-def decompress(map_archive: str, map_output_dir: str) -> None:
-    if 'gz' in map_archive:
-        _decompress_gz(map_archive, _compressed_map_json_path(map_output_dir))
-    else:
-        _decompress_zip(map_archive, map_output_dir)
-        if len(os.listdir(map_output_dir)) == 1:
-            os.rename(_map_json_path(map_output_dir, os.listdir(map_output_dir)[0]), _compressed_map_json_path(map_output_dir))
-
-def _decompress_zip(infile: str, todir: str):
-    with zipfile.ZipFile(infile, 'r') as zip_ref:
-        zip_ref.extractall(todir)
-
-def _decompress_gz(infile: str, tofile: str):
-    with open(infile, 'rb') as inf, open(tofile, 'w', encoding='utf8') as tof:
-        decom_str = gzip.decompress(inf.read()).decode('utf-8')
-        tof.write(decom_str)
+# Extension of the predecessor files saved next to the distances
+ROUTES_EXTENSION = 'pred'
+# Base name of the nearest town rasters
+NEAREST_TOWN = 'nearest_town'
+# Extension of the isochrone files saved next to the distances
+ISOCHRONES_EXTENSION = 'iso.json'
 
 def load_json(json_path: str) -> dict | list:
     with open(json_path) as fd:
         json_data = json.load(fd)
     return json_data
 
-def load_map(map_dir: str) -> Sequence[TileWeight]:
-    print('Loading map...')
-    if os.path.isfile(_compressed_map_json_path(map_dir)):
-        json_data = load_json(_compressed_map_json_path(map_dir))
-        return [convert(entry) for entry in json_data]
-    else:
-        for file in MULTI_FILE_MAP:
-            assert(os.path.isfile(_map_json_path(map_dir, file)))
-        def _to_json_path(f: str) -> str:
-            print(f)
-            return _map_json_path(map_dir, f)
-        return [
-            convert(entry) for f in MULTI_FILE_MAP for entry in load_json(_to_json_path(f))
-        ]
-
-def retrieve_or_update_ferries(output_file_name: str) -> None:
+_WHITESPACES = re.compile(r'\s*')
+
+def iter_json_array(fd: TextIO, chunk_size: int = 1 << 22) -> Iterator[Any]:
+    """
+    Parses the JSON array read from `fd` incrementally, yielding its items one at a time.
+    Only `chunk_size` characters (plus the item being parsed) are kept in memory at once.
+    """
+    decoder = json.JSONDecoder()
+    buffer = fd.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Expected a JSON array')
+    pos = 1
+    eof = False
+    # The array may only end right after its opening bracket or after an item, and each comma must be followed by an item
+    first = True
+    while True:
+        pos = _WHITESPACES.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unterminated JSON array')
+            buffer, pos = fd.read(chunk_size), 0
+            eof = not buffer
+            continue
+        if first and buffer[pos] == ']':
+            return
+        if buffer[pos] in ',]':
+            raise ValueError(f'Expecting an array item at {buffer[pos]!r}')
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # A cut number is still a valid (shorter) number: an item is complete only once its delimiter has been read
+            delimiter = _WHITESPACES.match(buffer, end).end()
+            if delimiter == len(buffer) or buffer[delimiter] not in ',]':
+                raise json.JSONDecodeError('Expecting , or ] after array item', buffer, delimiter)
+        except json.JSONDecodeError:
+            # The item is cut by the end of the buffer
+            if eof:
+                raise
+            more = fd.read(chunk_size)
+            eof = not more
+            buffer, pos = buffer[pos:] + more, 0
+            continue
+        yield item
+        if buffer[delimiter] == ']':
+            return
+        pos, first = delimiter + 1, False
+
+def stream_map(map_archive: str, width: int = MAX_WIDTH, height: int = MAX_HEIGHT) -> TileGrid:
+    """
+    Loads the map straight from the archive (either the single file compressed map or the multi files uncompressed one),
+    parsing its entries incrementally and writing them directly into the grid arrays: nothing is extracted on disk.
+    """
+    METRICS.progress('Loading map...')
+    grid = TileGrid(width, height)
+    with METRICS.phase('load', archive=map_archive) as record:
+        if 'gz' in map_archive:
+            with gzip.open(map_archive, 'rt', encoding='utf8') as fd:
+                for entry in iter_json_array(fd):
+                    put_entry(grid, entry)
+        else:
+            with zipfile.ZipFile(map_archive, 'r') as zip_ref:
+                for member in zip_ref.namelist():
+                    if member.endswith('/'):
+                        continue
+                    METRICS.progress(member)
+                    with io.TextIOWrapper(zip_ref.open(member), encoding='utf8') as fd:
+                        for entry in iter_json_array(fd):
+                            put_entry(grid, entry)
+        record.update(tiles=len(grid), bytes=grid.nbytes)
+    return grid
+
+def retrieve_or_update_ferries(output_file_name: str, source: str = FERRIES_DATA) -> None:
+    # `source` is either the URL of the ferries data or a local file, e.g. to work offline
+    if os.path.isfile(source) and os.path.exists(output_file_name) and os.path.samefile(source, output_file_name):
+        return
     if os.path.isfile(output_file_name):
         os.remove(output_file_name)
-    
-    urlretrieve(FERRIES_DATA, output_file_name)
+
+    if os.path.isfile(source):
+        shutil.copyfile(source, output_file_name)
+    else:
+        urlretrieve(source, output_file_name)
 
 def load_ferries(json_path: str) -> Sequence[FerryInfo]:
     data = load_json(json_path)
     return [convert_ferry(entry) for entry in data]
+
+def load_costed_map(map_archive: str, ferries_json: str, cache_file: str) -> TileMap:
+    # The costed map is cached until the map archive, the ferries or the cost rules change
+    key = cache_key(map_archive, ferries_json)
+    with METRICS.phase('load_cache', cache=cache_file) as record:
+        tile_map = load_cache(cache_file, key)
+        record['hit'] = tile_map is not None
+    if tile_map is None:
+        tile_map = TileMap(stream_map(map_archive), ferries=load_ferries(ferries_json))
+        tile_map.compute_costs()
+        save_cache(tile_map, cache_file, key)
+    return tile_map
+
+def _file_stamp(path: str) -> str:
+    # Cheaper than a content hash: the chunk file is read for small windows, where hashing the archive would dominate
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+def load_map_window(map_archive: str, chunk_file: str, min_x: int, max_x: int, min_y: int, max_y: int) -> TileGrid:
+    """
+    Tiles of the window (inclusive bounds) only. They are read from `chunk_file`, which is built out of the map archive
+    the first time and again whenever the archive changes.
+    """
+    header = read_header(chunk_file, _file_stamp(map_archive))
+    if header is None:
+        save_chunks(stream_map(map_archive), chunk_file, _file_stamp(map_archive))
+        header = read_header(chunk_file)
+    return load_window(chunk_file, min_x, max_x, min_y, max_y, header=header)
+
+def save_distances(
+    town_name: str,
+    distances: Sequence[TileDistance],
+    output_dir: str,
+    output_format: str = 'json',
+    predecessors: PredecessorRaster | None = None,
+) -> None:
+    # The predecessors, if any, are saved next to the distances, in `town_name`.pred (see lib.routes)
+    os.makedirs(output_dir, exist_ok=True)
+    with METRICS.phase('save', town=town_name, format=output_format, tiles=len(distances)) as record:
+        if predecessors is not None:
+            save_predecessors(f'{output_dir}/{town_name}.{ROUTES_EXTENSION}', predecessors)
+
+        if output_format == 'pyramid':
+            file_name = f'{output_dir}/{town_name}/{MANIFEST}'
+            record['bytes'] = save_pyramid(f'{output_dir}/{town_name}', distances)
+        elif output_format == 'raster':
+            file_name = f'{output_dir}/{town_name}.dist'
+            save_raster(file_name, distances)
+        else:
+            # Convert to compressed format
+            compressed = [[d.x, d.y, d.distance] for d in distances]
+            file_name = f'{output_dir}/{town_name}.json'
+            with open(file_name, 'w', encoding='utf8') as fp:
+                fp.write(json.dumps(compressed))
+        if 'bytes' not in record:
+            record['bytes'] = os.path.getsize(file_name)
+    METRICS.progress(f'Town distances file saved as {file_name}')
+
+def _iter_distances(file_name: str) -> Iterator[tuple[int, int, float]]:
+    if file_name.endswith('.dist'):
+        for d in load_raster(file_name):
+            yield d.x, d.y, d.distance
+    else:
+        with open(file_name, encoding='utf8') as fd:
+            yield from iter_json_array(fd)
+
+def load_distance_field(file_name: str, grid: TileGrid) -> DistanceField:
+    # Distance field (indexed like `grid`) out of a file saved by save_distances (JSON or raster)
+    dist = array('d', [UNREACHABLE]) * grid.size
+    settled = []
+    for x, y, d in _iter_distances(file_name):
+        i = grid.index(x, y)
+        dist[i] = d
+        settled.append(i)
+    # JSON files are already in settling order
+    settled.sort(key=dist.__getitem__)
+    return DistanceField(dist, array('i', settled))
+
+def save_town_distances(
+    town_name: str,
+    distances: Sequence[TileDistance],
+    output_dir: str,
+    ranges: Sequence[tuple[str, float]] = (),
+    output_format: str = 'json',
+    predecessors: PredecessorRaster | None = None,
+    shapes: Sequence[str] = (),
+) -> None:
+    # Without vehicle ranges, all the distances are saved in output_dir. Otherwise one sub directory per vehicle, with the
+    # predecessors cropped to the tiles within range, and the isochrone of the range as `shapes` (see lib.isochrones).
+    if not ranges:
+        save_distances(town_name, distances, output_dir, output_format=output_format, predecessors=predecessors)
+    for vehicle, cost in ranges:
+        bound = cost_bound(cost)
+        within = [d for d in distances if d.distance < bound]
+        cropped = None
+        if predecessors is not None and within:
+            cropped = predecessors.crop(min(d.x for d in within), max(d.x for d in within), min(d.y for d in within), max(d.y for d in within))
+        save_distances(town_name, within, f'{output_dir}/{vehicle}', output_format=output_format, predecessors=cropped)
+        if shapes:
+            save_isochrones(town_name, within, f'{output_dir}/{vehicle}', [cost], shapes)
+
+def save_isochrones(town_name: str, distances: Sequence[TileDistance], output_dir: str, thresholds: Sequence[float], shapes: Sequence[str]) -> None:
+    # Tiles within each threshold as spans and/or polygons, in `town_name`.iso.json
+    file_name = f'{output_dir}/{town_name}.{ISOCHRONES_EXTENSION}'
+    with METRICS.phase('isochrones', town=town_name, thresholds=len(thresholds)) as record:
+        data = isochrones(distances, thresholds, shapes)
+        with open(file_name, 'w', encoding='utf8') as fp:
+            fp.write(json.dumps(data, separators=(',', ':')))
+        record['bytes'] = os.path.getsize(file_name)
+    METRICS.progress(f'Town isochrones file saved as {file_name}')
+
+def save_nearest_towns(
+    tile_map: TileMap,
+    towns: Sequence[tuple[str, int, int]],
+    output_dir: str,
+    max_cost: float | None = None,
+    output_format: str = 'raster',
+) -> None:
+    # Nearest town of each tile and its cost, as two rasters: `name`.towns (see lib.partition) and `name`.dist, or a
+    # pyramid of the costs in `name`/ (see lib.pyramid) with the 'pyramid' format
+    owners, field = tile_map.nearest_towns(towns, max_cost=max_cost)
+    grid = tile_map.grid
+    os.makedirs(output_dir, exist_ok=True)
+    save_town_raster(f'{output_dir}/{NEAREST_TOWN}.towns', TownRaster.from_owners([name for name, _, _ in towns], owners, grid))
+    distances = to_tile_distances(field, grid.width, grid.x0, grid.y0)
+    if output_format == 'pyramid':
+        save_pyramid(f'{output_dir}/{NEAREST_TOWN}', distances)
+        costs = f'{output_dir}/{NEAREST_TOWN}/{MANIFEST}'
+    else:
+        costs = f'{output_dir}/{NEAREST_TOWN}.dist'
+        save_raster(costs, distances)
+    METRICS.progress(f'Nearest towns saved as {output_dir}/{NEAREST_TOWN}.towns and {costs}')
+
+def update_town_distances(
+    tile_map: TileMap,
+    town_name: str,
+    x: int,
+    y: int,
+    output_dir: str,
+    added: set[FerryEdge],
+    removed: set[FerryEdge],
+    ranges: Sequence[tuple[str, float]] = (),
+    output_format: str = 'json',
+    predecessors: bool = False,
+) -> None:
+    """
+    Brings the files saved by save_town_distances up to date with the ferry changes (see lib.incremental), `tile_map`
+    including the new ferries. Files which cannot be affected are left untouched and missing ones are computed.
+    JSON files are repaired, while rasters are computed again as their quantized distances cannot be repaired exactly.
+    Saved predecessors (or all of them, with `predecessors`) are computed again too, as the repair does not track them.
+    """
+    grid = tile_map.grid
+    extension = 'dist' if output_format == 'raster' else 'json'
+    for directory, cost in [(f'{output_dir}/{vehicle}', cost) for vehicle, cost in ranges] or [(output_dir, None)]:
+        file_name = f'{directory}/{town_name}.{extension}'
+        routes = predecessors or os.path.isfile(f'{directory}/{town_name}.{ROUTES_EXTENSION}')
+        if not os.path.isfile(file_name):
+            field = tile_map.dijkstra(x, y, max_cost=cost, predecessors=routes)
+        elif output_format == 'raster':
+            raster = load_raster(file_name)
+            if all(raster.get(*grid.coords(f)) is None for f, _ in added | removed):
+                continue
+            field = tile_map.dijkstra(x, y, max_cost=cost, predecessors=routes)
+        else:
+            field = load_distance_field(file_name, grid)
+            if not is_affected(field, added, removed):
+                continue
+            if routes:
+                field = tile_map.dijkstra(x, y, max_cost=cost, predecessors=True)
+            else:
+                reset = repair(tile_map, field, tile_map.sources(x, y), added, removed, max_cost=cost)
+                METRICS.progress(f'{file_name}: {reset} tiles reset')
+        save_distances(
+            town_name,
+            to_tile_distances(field, grid.width, grid.x0, grid.y0),
+            directory,
+            output_format=output_format,
+            predecessors=PredecessorRaster.from_field(field, grid.width, grid.x0, grid.y0) if routes else None,
+        )